@@ -7,10 +7,14 @@ import logging
 
 logger = logging.getLogger('dht')
 
+# Characters searched first for the end of an integer (or string length).
+# Longer integers are searched in the rest of the bencoded data.
+INT_SEARCH_LEN = 32
+
 class LoggingException(Exception):
 
     def __init__(self, msg):
-        logger.info('%s: %s' % (self.__class__, msg))
+        logger.info('%s: %s', self.__class__, msg)
                     
 
 class EncodeError(LoggingException):
@@ -19,8 +23,9 @@ class EncodeError(LoggingException):
 class DecodeError(LoggingException):
     """Raised by decoder when invalid bencode input."""
     def __init__(self, msg, bencoded):
-        LoggingException.__init__(
-            self, '\nBencoded: '.join((msg, repr(bencoded))))
+        if logger.isEnabledFor(logging.INFO):
+            msg = '\nBencoded: '.join((msg, repr(str(bencoded))))
+        LoggingException.__init__(self, msg)
     
 class RecursionDepthError(DecodeError):
     """Raised when the bencoded recursivity is too deep.
@@ -41,6 +46,21 @@ def encode(data):
     return result
         
 def decode(bencoded, max_depth=4):
+    """
+    Decode a bencoded string. Besides str, the bencoded data can be a
+    read-only buffer, a bytearray or a memoryview (e.g., a receive buffer).
+    Only the decoded strings are copied, not the whole bencoded data.
+
+    >>> data = bytearray('d1:ai1e1:b3:xyze' + 'garbage')
+    >>> decode(buffer(data, 0, 16))
+    {'a': 1, 'b': 'xyz'}
+
+    """
+    if type(bencoded) is bytearray:
+        bencoded = buffer(bencoded)
+    elif type(bencoded) is memoryview:
+        # Python 2's memoryview has no str-like slicing. Copy it.
+        bencoded = bencoded.tobytes()
     if not bencoded:
         raise DecodeError('Empty bencoded string', bencoded)
     try:
@@ -200,10 +220,14 @@ def _get_encode_f(value):
         raise EncodeError, 'Invalid type: <%r>' % e
     
 def _get_int(bencoded, pos, char):
-    try:
-        end = bencoded.index(char, pos)
-    except (ValueError):
-        raise DecodeError('Character %s not found.', bencoded)
+    # Buffers have no index method. Search in a short slice (integers are
+    # usually short) and then, only if needed, in the rest.
+    end = bencoded[pos:pos + INT_SEARCH_LEN].find(char)
+    if end == -1 and len(bencoded) > pos + INT_SEARCH_LEN:
+        end = bencoded[pos:].find(char)
+    if end == -1:
+        raise DecodeError('Character %s not found.' % char, bencoded)
+    end += pos
     try:
         result = int(bencoded[pos:end])
     except (ValueError), e:
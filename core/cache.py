@@ -9,41 +9,189 @@ results.
 
 The obvious example is when Tribler does a lookup to gather information about
 an infohash, and a few seconds later the user clicks 'download', thus calling
-pymdht.get_peers() again.\
+pymdht.get_peers() again.
+
+Cached lookups are indexed by info_hash and kept in LRU order. A cached
+lookup is valid for 'validity_time' seconds after its first peers were
+added. The cache is bounded by number of info_hashes and total number of
+peers (the least recently used lookups are evicted first).
+
+Lookups which found no peers (e.g., dead torrents) are the most expensive
+ones. NegativeCache remembers them (for a shorter time) with the closest
+nodes which responded, so that the lookup can be answered right away or
+restarted from those nodes.
+
 """
 
+from collections import OrderedDict
+
 import ptime as time
 
-CACHING_NODE = ('0.0.0.0', 0)
+MAX_ENTRIES = 50000
+MAX_PEERS = 1000000
+MAX_PEERS_PER_ENTRY = 1000
+MAX_NEGATIVE_ENTRIES = 10000
+
 
 class CachedLookup(object):
 
     def __init__(self, info_hash):
         self.info_hash = info_hash
         self.start_ts = time.time()
-        self.peers = set()
+        self.peers = []
+        self._peer_set = set()
 
-    def add_peers(self, peers):
+    def add_peers(self, peers, max_peers=MAX_PEERS_PER_ENTRY):
+        """Add the new peers (up to max_peers). Return how many."""
+        num_added = 0
         for peer in peers:
-            self.peers.add(peer)
-    
+            if len(self.peers) >= max_peers:
+                break
+            if peer not in self._peer_set:
+                self._peer_set.add(peer)
+                self.peers.append(peer)
+                num_added += 1
+        return num_added
+
 
 class Cache(object):
 
-    def __init__(self, validity_time):
+    def __init__(self, validity_time, max_entries=MAX_ENTRIES,
+                 max_peers=MAX_PEERS):
         self.validity_time = validity_time
-        self.cached_lookups = []
-
-    def put_cached_lookup(self, cached_lookup):
-        # first remove expired chached lookups
-        for i in range(len(self.cached_lookups)):
-            if time.time() > (self.cached_lookups[i].start_ts +
-                              self.validity_time):
-                del self.cached_lookups[i]
-        self.cached_lookups.append(cached_lookup)
-        
-    def get_cached_lookup(self, info_hash):
-        for cached_lookup in self.cached_lookups:
-            if cached_lookup.info_hash == info_hash:
-                if time.time() < cached_lookup.start_ts + self.validity_time:
-                    return cached_lookup.peers, CACHING_NODE
+        self.max_entries = max_entries
+        self.max_peers = max_peers
+        self._cached_lookups = OrderedDict() # LRU first
+        self._num_peers = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self.num_expirations = 0
+
+    def put(self, info_hash, peers):
+        """Add peers to info_hash's cached lookup (create it if needed)."""
+        cached_lookup = self._pop_valid(info_hash)
+        if cached_lookup is None:
+            cached_lookup = CachedLookup(info_hash)
+        self._num_peers += cached_lookup.add_peers(peers)
+        self._cached_lookups[info_hash] = cached_lookup
+        while (len(self._cached_lookups) > self.max_entries or
+               self._num_peers > self.max_peers):
+            _, evicted = self._cached_lookups.popitem(last=False)
+            self._num_peers -= len(evicted.peers)
+            self.num_evictions += 1
+
+    def get(self, info_hash):
+        """
+        Return a list with the cached peers for info_hash (None if there
+        is no valid cached lookup).
+
+        """
+        cached_lookup = self._pop_valid(info_hash)
+        if cached_lookup is None:
+            self.num_misses += 1
+            return
+        self.num_hits += 1
+        # Most recently used
+        self._cached_lookups[info_hash] = cached_lookup
+        return cached_lookup.peers[:]
+
+    def __len__(self):
+        return len(self._cached_lookups)
+
+    def get_stats(self):
+        """
+        Return a dictionary with counters:
+        - hits/misses: get calls which found (or not) valid cached peers
+        - evictions: cached lookups evicted to stay within the limits
+        - expirations: cached lookups found expired (and removed)
+        - size: cached lookups (info_hashes)
+        - num_peers: cached peers (all info_hashes)
+        """
+        return {'hits': self.num_hits,
+                'misses': self.num_misses,
+                'evictions': self.num_evictions,
+                'expirations': self.num_expirations,
+                'size': len(self._cached_lookups),
+                'num_peers': self._num_peers,
+                }
+
+    def _pop_valid(self, info_hash):
+        # Remove info_hash's cached lookup and return it if still valid
+        cached_lookup = self._cached_lookups.pop(info_hash, None)
+        if cached_lookup is None:
+            return
+        if time.time() < cached_lookup.start_ts + self.validity_time:
+            return cached_lookup
+        self._num_peers -= len(cached_lookup.peers)
+        self.num_expirations += 1
+
+
+class NegativeResult(object):
+
+    def __init__(self, info_hash, closest_nodes):
+        self.info_hash = info_hash
+        self.start_ts = time.time()
+        self.closest_nodes = closest_nodes
+
+
+class NegativeCache(object):
+
+    def __init__(self, validity_time, max_entries=MAX_NEGATIVE_ENTRIES):
+        self.validity_time = validity_time
+        self.max_entries = max_entries
+        self._negative_results = OrderedDict() # LRU first
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self.num_expirations = 0
+
+    def put(self, info_hash, closest_nodes):
+        """Remember that a lookup for info_hash found no peers."""
+        self._negative_results.pop(info_hash, None)
+        self._negative_results[info_hash] = NegativeResult(info_hash,
+                                                           closest_nodes[:])
+        if len(self._negative_results) > self.max_entries:
+            self._negative_results.popitem(last=False)
+            self.num_evictions += 1
+
+    def get(self, info_hash):
+        """
+        Return a list with the closest nodes which responded to the lookup
+        (None if there is no valid negative result for info_hash).
+
+        """
+        negative_result = self._negative_results.pop(info_hash, None)
+        if negative_result and (time.time() > negative_result.start_ts +
+                                self.validity_time):
+            self.num_expirations += 1
+            negative_result = None
+        if negative_result is None:
+            self.num_misses += 1
+            return
+        self.num_hits += 1
+        # Most recently used
+        self._negative_results[info_hash] = negative_result
+        return negative_result.closest_nodes[:]
+
+    def remove(self, info_hash):
+        """Forget info_hash's negative result (peers have been found)."""
+        self._negative_results.pop(info_hash, None)
+
+    def __len__(self):
+        return len(self._negative_results)
+
+    def get_stats(self):
+        """
+        Return a dictionary with counters:
+        - hits/misses: get calls which found (or not) a valid negative result
+        - evictions: negative results evicted to stay within max_entries
+        - expirations: negative results found expired (and removed)
+        - size: negative results (info_hashes)
+        """
+        return {'hits': self.num_hits,
+                'misses': self.num_misses,
+                'evictions': self.num_evictions,
+                'expirations': self.num_expirations,
+                'size': len(self._negative_results),
+                }
@@ -14,6 +14,7 @@ implementations of routing and lookup managers in parallel.
 """
 
 import sys
+from collections import OrderedDict
 import ptime as time
 import datetime
 import os
@@ -25,10 +26,13 @@ import identifier
 from identifier import Id
 import message
 from querier import Querier
+import query_scheduler
 from message import QUERY, RESPONSE, ERROR
 from node import Node
 import responder
 import bootstrap
+import routing_table
+import cache
 #import pkgutil
 
 #from profilestats import profile
@@ -36,6 +40,14 @@ import bootstrap
 logger = logging.getLogger('dht')
 
 CACHE_VALID_PERIOD = 5 * 60 # 5 minutes
+# Lookups which found no peers are cached for a shorter period
+NEGATIVE_CACHE_VALID_PERIOD = 60
+# get_peers for an info_hash being looked up joins the running lookup
+# (unless it started longer ago than this)
+MAX_COALESCING_PERIOD = 60
+# Routing table snapshot (saved on stop, loaded on start). It is saved in
+# the same directory as the logs (see conf_path in pymdht.Pymdht).
+ROUTING_TABLE_FILENAME = 'pymdht.routing_table'
 
 
 class Controller:
@@ -55,8 +67,12 @@ class Controller:
         self.msg_f = message.MsgFactory(version_label, self._my_id,
                                         private_dht_name)
         self._querier = Querier()
+        self._scheduler = query_scheduler.QueryScheduler()
         self._routing_m = routing_m_mod.RoutingManager(
             self._my_node, self.msg_f, self.bootstrapper)
+        self._routing_table_filename = os.path.join(conf_path,
+                                                    ROUTING_TABLE_FILENAME)
+        self._load_routing_table()
 
         self._responder = responder.Responder(self._my_id, self._routing_m,
                                               self.msg_f, bootstrap_mode)
@@ -71,11 +87,58 @@ class Controller:
         self._next_maintenance_ts = current_ts
         self._next_timeout_ts = current_ts
         self._next_main_loop_call_ts = current_ts
-        self._cached_lookups = []
+        self._peer_cache = cache.Cache(CACHE_VALID_PERIOD)
+        self._negative_cache = cache.NegativeCache(
+            NEGATIVE_CACHE_VALID_PERIOD)
+        self.num_restarted_lookups = 0
+        # {info_hash: _RunningLookup} oldest first
+        self._running_lookups = OrderedDict()
+        self.num_coalesced_lookups = 0
            
     def on_stop(self):
         self._experimental_m.on_stop()
         self.bootstrapper.save_to_file()
+        self._save_routing_table()
+
+    def _load_routing_table(self):
+        """
+        Warm restart: fill the routing table with the nodes saved on
+        stop. These nodes will be refreshed by the routing manager's
+        maintenance (and dropped on timeout).
+
+        """
+        try:
+            data = open(self._routing_table_filename, 'rb').read()
+        except IOError:
+            logger.debug('No routing table snapshot')
+            return
+        try:
+            num_rnodes = self._routing_m.table.load_snapshot(data)
+        except routing_table.SnapshotError, e:
+            logger.info('Routing table snapshot not loaded: %s', e)
+            return
+        logger.info('%d rnodes loaded from routing table snapshot',
+                    num_rnodes)
+
+    def _save_routing_table(self):
+        table = self._routing_m.table
+        if not table.num_rnodes:
+            # Do not overwrite a good snapshot with an empty table
+            return
+        # Write and rename to avoid leaving a truncated snapshot
+        tmp_filename = self._routing_table_filename + '.tmp'
+        try:
+            out = open(tmp_filename, 'wb')
+            out.write(table.get_snapshot())
+            out.close()
+            try:
+                os.rename(tmp_filename, self._routing_table_filename)
+            except OSError:
+                # Windows does not overwrite on rename
+                os.remove(self._routing_table_filename)
+                os.rename(tmp_filename, self._routing_table_filename)
+        except (IOError, OSError):
+            logger.exception('Cannot save routing table snapshot')
 
     def get_peers(self, lookup_id, info_hash, callback_f, bt_port, use_cache):
         """
@@ -85,30 +148,67 @@ class Controller:
         completed, the handler will be called with arguments:
         ('lookup\_id', None, None).
 
+        When a lookup for 'info\_hash' is already running (and it announces
+        to the same 'bt\_port', if any), no new lookup is started. The
+        handler gets the peers found so far and it is called as the running
+        lookup finds more peers and completes.
+
+        When a recent lookup for 'info\_hash' found no peers, the handler
+        is told right away that the lookup is completed ('use\_cache' and
+        no 'bt\_port' to announce) or the lookup starts from the closest
+        nodes found by that lookup.
+
         This method is called by minitwisted, using the minitwisted thread.
 
         """
         datagrams_to_send = []
-        logger.debug('get_peers %d %r' % (bt_port, info_hash))
+        logger.debug('get_peers %d %r', bt_port, info_hash)
         if use_cache:
-            peers = self._get_cached_peers(info_hash)
+            peers = self._peer_cache.get(info_hash)
             if peers and callback_f and callable(callback_f):
                 callback_f(lookup_id, peers, None)
                 callback_f(lookup_id, None, None)
                 return datagrams_to_send
+        closest_nodes = self._negative_cache.get(info_hash)
+        if (closest_nodes and use_cache and not bt_port and
+            callback_f and callable(callback_f)):
+            # Nothing to announce: the lookup would find no peers again
+            logger.debug('get_peers %r: cached lookup without peers',
+                         info_hash)
+            callback_f(lookup_id, None, None)
+            return datagrams_to_send
+        running_lookup = self._running_lookups.get(info_hash)
+        if running_lookup and running_lookup.can_join(bt_port):
+            logger.debug('get_peers %r joins the running lookup', info_hash)
+            self.num_coalesced_lookups += 1
+            running_lookup.add_callback(lookup_id, callback_f)
+            return datagrams_to_send
+        running_lookup = _RunningLookup(info_hash, bt_port,
+                                        self._running_lookups,
+                                        self._negative_cache)
+        running_lookup.add_callback(lookup_id, callback_f)
+        # A replaced lookup is no longer joinable (the new one goes last)
+        self._running_lookups.pop(info_hash, None)
+        self._running_lookups[info_hash] = running_lookup
         lookup_obj = self._lookup_m.get_peers(lookup_id,
                                               info_hash,
-                                              callback_f,
+                                              running_lookup.on_peers,
                                               bt_port)
+        running_lookup.lookup_obj = lookup_obj
         queries_to_send = []
-        distance = lookup_obj.info_hash.distance(self._my_id)
-        bootstrap_rnodes = self._routing_m.get_closest_rnodes(
-            distance.log, 0, True) #TODO: get the full bucket
+        if closest_nodes:
+            # Restart from where the last lookup (no peers) got
+            self.num_restarted_lookups += 1
+            bootstrap_rnodes = closest_nodes
+        else:
+            distance = lookup_obj.info_hash.distance(self._my_id)
+            bootstrap_rnodes = self._routing_m.get_closest_rnodes(
+                distance.log, 0, True) #TODO: get the full bucket
         # look if I'm tracking this info_hash
         peers = self._tracker.get(lookup_obj.info_hash)
         callback_f = lookup_obj.callback_f
         if peers:
-            self._add_cache_peers(lookup_obj.info_hash, peers)
+            self._cache_peers(lookup_obj.info_hash, peers)
             if callback_f and callable(callback_f):
                 callback_f(lookup_obj.lookup_id, peers, None)
         # do the lookup
@@ -119,25 +219,43 @@ class Controller:
         datagrams_to_send = self._register_queries(queries_to_send)
         return datagrams_to_send
     
-    def _get_cached_peers(self, info_hash):
-        oldest_valid_ts = time.time() - CACHE_VALID_PERIOD
-        for ts, cached_info_hash, peers in self._cached_lookups:
-            if ts > oldest_valid_ts and info_hash == cached_info_hash:
-                return peers
-
-    def _add_cache_peers(self, info_hash, peers):
-        oldest_valid_ts = time.time() - CACHE_VALID_PERIOD
-        while self._cached_lookups and self._cached_lookups[0][0] < oldest_valid_ts:
-            # clean up old entries
-            del self._cached_lookups[0]
-        if self._cached_lookups and self._cached_lookups[-1][1] == info_hash:
-            self._cached_lookups[-1][2].extend(peers)
-        else:
-            self._cached_lookups.append((time.time(), info_hash, peers))
+    def _purge_running_lookups(self):
+        # Lookups too old to join (they may never end)
+        running_lookups = self._running_lookups
+        while running_lookups:
+            info_hash = next(iter(running_lookups))
+            if running_lookups[info_hash].can_join(0):
+                break
+            del running_lookups[info_hash]
+
+    def _cache_peers(self, info_hash, peers):
+        self._peer_cache.put(info_hash, peers)
+        self._negative_cache.remove(info_hash)
 
     def print_routing_table_stats(self):
         self._routing_m.print_stats()
 
+    def get_querier_stats(self):
+        return self._querier.get_stats()
+
+    def get_scheduler_stats(self):
+        return self._scheduler.get_stats()
+
+    def get_lookup_stats(self):
+        return {'num_running': len(self._running_lookups),
+                'num_coalesced': self.num_coalesced_lookups}
+
+    def get_peer_cache_stats(self):
+        return self._peer_cache.get_stats()
+
+    def get_tracker_stats(self):
+        return self._tracker.get_stats()
+
+    def get_negative_cache_stats(self):
+        stats = self._negative_cache.get_stats()
+        stats['num_restarted_lookups'] = self.num_restarted_lookups
+        return stats
+
     def print_routing_table(self):
         self._routing_m.print_table()
 
@@ -171,6 +289,13 @@ class Controller:
              timeout_queries) = self._querier.get_timeout_queries()
             for query in timeout_queries:
                 queries_to_send.extend(self._on_timeout(query))
+        # Per query timeouts (RTO) can be due sooner than 1 second
+        self._next_main_loop_call_ts = min(self._next_main_loop_call_ts,
+                                           self._next_timeout_ts)
+
+        # Expired announcements (a bounded number per call)
+        self._tracker.expire()
+        self._purge_running_lookups()
 
         # Routing table maintenance
         if time.time() >= self._next_maintenance_ts:
@@ -184,6 +309,7 @@ class Controller:
             if maintenance_lookup:
                 target, rnodes = maintenance_lookup
                 lookup_obj = self._lookup_m.maintenance_lookup(target)
+                self._scheduler.add_maintenance_lookup(lookup_obj)
                 queries_to_send.extend(lookup_obj.start(rnodes))
 
         # Return control to reactor
@@ -257,7 +383,7 @@ class Controller:
                 lookup_id = lookup_obj.lookup_id
                 callback_f = lookup_obj.callback_f
                 if peers:
-                    self._add_cache_peers(lookup_obj.info_hash, peers)
+                    self._cache_peers(lookup_obj.info_hash, peers)
                     if callback_f and callable(callback_f):
                         callback_f(lookup_id, peers, msg.src_node)
                 if lookup_done:
@@ -298,7 +424,8 @@ class Controller:
                     if lookup_done:
                         callback_f(lookup_id, None, msg.src_node)
                 if lookup_done:
-                    datagrams = self._announce(related_query.lookup_obj)
+                    queries_to_send = self._announce(related_query.lookup_obj)
+                    datagrams = self._register_queries(queries_to_send)
                     datagrams_to_send.extend(datagrams)
             # maintenance related tasks
             maintenance_queries_to_send = \
@@ -315,6 +442,20 @@ class Controller:
             datagrams_to_send.extend(datagrams)
         return self._next_main_loop_call_ts, datagrams_to_send
 
+    def on_datagrams_received(self, datagrams):
+        """
+        Batch version of on\_datagram\_received. All the datagrams are
+        processed in order and the datagrams to be sent are returned together.
+        This method is designed to be used as minitwisted's networking handler
+        in batch mode.
+
+        """
+        datagrams_to_send = []
+        for datagram in datagrams:
+            _, datagrams_ = self.on_datagram_received(datagram)
+            datagrams_to_send.extend(datagrams_)
+        return self._next_main_loop_call_ts, datagrams_to_send
+
     def _on_query_received(self):
         return
     def _on_response_received(self):
@@ -357,11 +498,65 @@ class Controller:
     '''
     
     def _register_queries(self, queries_to_send, lookup_obj=None):
+        # The scheduler may delay some of these queries (and release queries
+        # delayed before), even when there are no queries to send
+        queries_to_send = self._scheduler.schedule(
+            queries_to_send or [], self._querier.num_in_flight)
         if not queries_to_send:
             return []
         timeout_call_ts, datagrams_to_send = self._querier.register_queries(
             queries_to_send)
         self._next_main_loop_call_ts = min(self._next_main_loop_call_ts,
                                            timeout_call_ts)
+        # Timeouts are per query (they can expire before the ones pending)
+        self._next_timeout_ts = min(self._next_timeout_ts, timeout_call_ts)
         return datagrams_to_send
     
+
+
+class _RunningLookup(object):
+    """
+    Callers (lookup_id, callback_f) of a running lookup. on_peers is the
+    lookup's callback: it forwards peers (and the end of the lookup) to
+    every caller. Callers joining late get the peers found so far.
+    A lookup which ends without peers goes to the negative cache (unless no
+    node responded).
+
+    """
+    def __init__(self, info_hash, bt_port, running_lookups, negative_cache):
+        self.start_ts = time.time()
+        self.info_hash = info_hash
+        self.bt_port = bt_port
+        self.lookup_obj = None
+        self.peers = []
+        self._callbacks = []
+        self._running_lookups = running_lookups
+        self._negative_cache = negative_cache
+
+    def can_join(self, bt_port):
+        return (bt_port in (0, self.bt_port) and
+                time.time() < self.start_ts + MAX_COALESCING_PERIOD)
+
+    def add_callback(self, lookup_id, callback_f):
+        if not (callback_f and callable(callback_f)):
+            return
+        if self.peers:
+            callback_f(lookup_id, self.peers[:], None)
+        self._callbacks.append((lookup_id, callback_f))
+
+    def on_peers(self, _, peers, node_):
+        if peers is None:
+            # Lookup done
+            if self._running_lookups.get(self.info_hash) is self:
+                del self._running_lookups[self.info_hash]
+            if not self.peers and self.lookup_obj:
+                closest_nodes = self.lookup_obj.get_closest_responded_nodes()
+                if closest_nodes:
+                    self._negative_cache.put(self.info_hash, closest_nodes)
+            callbacks, self._callbacks = self._callbacks, []
+            for lookup_id, callback_f in callbacks:
+                callback_f(lookup_id, None, node_)
+            return
+        self.peers.extend(peers)
+        for lookup_id, callback_f in self._callbacks:
+            callback_f(lookup_id, peers, node_)
@@ -68,19 +68,16 @@ class FloodBarrier(object):
         num_packets = self.ip_registers[0].get_num_packets(ip) + \
             self.ip_registers[1].get_num_packets(ip)
         if num_packets > self.max_packets_per_period:
-            logger.debug('Got %d packets: blocking %r...' % (
-                    num_packets, ip))
+            logger.debug('Got %d packets: blocking %r...', num_packets, ip)
             self.blocked_ips[ip] = current_time + self.blocking_period
             return True
         # At this point there are no enough packets to block ip (in current
         # period). Now, we need to check whether the ip is currently blocked
         if ip in self.blocked_ips:
-            logger.debug('Ip %r (%d) currently blocked' % (ip,
-                                                            num_packets))
+            logger.debug('Ip %r (%d) currently blocked', ip, num_packets)
             if current_time > self.blocked_ips[ip]:
-                logger.debug(
-                    'Block for %r (%d) has expired: unblocking...' %
-                    (ip, num_packets))
+                logger.debug('Block for %r (%d) has expired: unblocking...',
+                             ip, num_packets)
                 # Blocking period already expired
                 del self.blocked_ips[ip]
                 return False
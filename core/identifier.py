@@ -12,7 +12,7 @@ This module provides the Id object and necessary tools.
 
 import sys
 import random
-import base64
+from binascii import hexlify, unhexlify
 
 import logging
 
@@ -50,85 +50,86 @@ class Id(object):
     
     """
 
+    __slots__ = ('_long', '_bin', '_hex')
+
     def __init__(self, hex_or_bin_id):
-        self._bin_id = None
+        # The canonical form is _long. The binary and hexadecimal forms are
+        # computed when needed.
         self._bin = None
         self._hex = None
-        self._bin_str = None
-        self._long = None
-        self._log = None
         if isinstance(hex_or_bin_id, str):
             if len(hex_or_bin_id) == ID_SIZE_BYTES:
-                self._bin_id = hex_or_bin_id
+                self._bin = hex_or_bin_id
+                self._long = long(hexlify(hex_or_bin_id), 16)
+                return
             elif len(hex_or_bin_id) == ID_SIZE_BYTES*2:
-                self._hex = hex_or_bin_id
                 try:
-                    self._bin_id = base64.b16decode(hex_or_bin_id, True)
-                except:
+                    self._bin = unhexlify(hex_or_bin_id)
+                except TypeError:
                     raise IdError, 'input: %r' % hex_or_bin_id
-        elif isinstance(hex_or_bin_id, long) or isinstance(hex_or_bin_id, int):
-            if hex_or_bin_id < 0 or hex_or_bin_id > MAX_ID_LONG:
-                raise IdError, 'input: %r' % hex_or_bin_id
-            self._long = long(hex_or_bin_id)
-            self._hex = '%040x' % self._long
-            self._bin_id = base64.b16decode(self._hex, True)
-        if not self._bin_id:
-            raise IdError, 'input: %r' % hex_or_bin_id
-        self._bin = self._bin_id
+                self._long = long(hexlify(self._bin), 16)
+                self._hex = hex_or_bin_id
+                return
+        elif isinstance(hex_or_bin_id, (int, long)):
+            if 0 <= hex_or_bin_id <= MAX_ID_LONG:
+                self._long = long(hex_or_bin_id)
+                return
+        raise IdError, 'input: %r' % hex_or_bin_id
+
+    def __getstate__(self):
+        return self._long
+
+    def __setstate__(self, long_id):
+        self._long = long_id
+        self._bin = None
+        self._hex = None
 
     def __hash__(self):
-        return self.bin_id.__hash__()
+        return hash(self._long)
 
     @property
     def bin_id(self):
         """bin_id is read-only."""
+        if self._bin is None:
+            self._bin = unhexlify('%040x' % self._long)
         return self._bin
  
-    @property
-    def bin(self):
-        return self._bin
+    bin = bin_id
 
     @property
     def hex(self):
-        if not self._hex:
-            self._hex = base64.b16encode(self._bin)
+        if self._hex is None:
+            self._hex = '%040X' % self._long
         return self._hex
 
     @property
     def bin_str(self):
-        if not self._bin_str:
-            bin_str = bin(self.long)[2:]
-            # Need to pad to get 160 bits
-            self._bin_str = '0'*(ID_SIZE_BITS - len(bin_str)) + bin_str
-        return self._bin_str
+        return bin(self._long)[2:].zfill(ID_SIZE_BITS)
 
     @property
     def long(self):
-        if not self._long:
-            self._long = long(self.hex, 16)
         return self._long
 
     @property
     def log(self):
-        if not self._log:
-            if self.long == 0:
-                self._log = -1
-            else:
-                self._log = len(bin(self.long)) - 3
-        return self._log
+        """Return log (base 2) of the Id (-1 for Id(0))."""
+        return self._long.bit_length() - 1
 
     @property
     def prefix_len(self):
         return ID_SIZE_BITS - self.log
 
     def __cmp__(self, other):
-        return self.long.__cmp__(other.long)
+        return cmp(self._long, other._long)
         
     def __eq__(self, other):
-        return self.long == other.long
+        return self._long == other._long
 
     def __ne__(self, other):
-        return not self == other
+        return self._long != other._long
+
+    def __lt__(self, other):
+        return self._long < other._long
         
     def __str__(self):
         return self.bin_id
@@ -142,7 +143,11 @@ class Id(object):
         object.
 
         """
-        return Id(self.long ^ other.long)
+        distance = Id.__new__(Id)
+        distance._long = self._long ^ other._long
+        distance._bin = None
+        distance._hex = None
+        return distance
     
     def log_distance(self, other):
         """Return log (base 2) of the XOR distance between two Id
@@ -191,13 +196,13 @@ class Id(object):
         159
 
         """
-        return self.distance(other).log
+        return (self._long ^ other._long).bit_length() - 1
 
     def get_prefix(self, prefix_len):
         return self.bin_str[:prefix_len]
 
     def get_bit(self, index):
-        if self.long & (1 << (ID_SIZE_BITS - index - 1)):
+        if self._long & (1 << (ID_SIZE_BITS - index - 1)):
             return 1
         else:
             return 0
@@ -239,6 +244,8 @@ MAX_ID = Id(MAX_ID_LONG)
 class RandomId(Id):
 
     """Create a random Id object."""
+    __slots__ = ()
+
     def __init__(self, bin_prefix=''):
         padding_len = ID_SIZE_BITS - len(bin_prefix)
         long_id = 0
@@ -5,6 +5,8 @@
 import logging
 import logging.handlers
 import os
+import threading
+import Queue
 
 FORMAT = '%(asctime)s %(levelname)s %(filename)s:%(lineno)s - %(funcName)s()\n\
 %(message)s\n'
@@ -20,6 +22,104 @@ FORMAT = '%(asctime)s %(levelname)s %(filename)s:%(lineno)s - %(funcName)s()\n\
 LOG_SIZE_LIMIT_NORMAL = 10 * 2 ** 20  # 10 MB
 LOG_SIZE_LIMIT_DEBUG = 2 ** 30  # 1 GB
 
+ASYNC_QUEUE_SIZE = 10000 # log records
+ASYNC_CLOSE_TIMEOUT = 5 # seconds
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Hand log records over to a background thread which passes them to
+    'target_handler' (e.g., a RotatingFileHandler). File writes and rotation
+    do not happen in the thread logging the record (i.e., the minitwisted
+    thread).
+
+    The queue is bounded ('queue_size' records). When the queue is full,
+    records are dropped (and counted) instead of blocking the caller. The
+    writer thread logs the number of records dropped before writing the next
+    record.
+
+    Messages are formatted by the thread logging the record (the objects
+    given as arguments can change afterwards).
+
+    """
+    def __init__(self, target_handler, queue_size=ASYNC_QUEUE_SIZE):
+        logging.Handler.__init__(self, target_handler.level)
+        self.target_handler = target_handler
+        self._queue = Queue.Queue(queue_size)
+        self.num_queued = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self._num_dropped_reported = 0
+        self._writer = threading.Thread(target=self._write_records,
+                                        name='AsyncLogWriter')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                formatter = self.target_handler.formatter or logging.Formatter()
+                record.exc_text = formatter.formatException(record.exc_info)
+                record.exc_info = None
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.num_dropped += 1
+        else:
+            self.num_queued += 1
+
+    def get_stats(self):
+        """
+        Return a dictionary with counters:
+        - queued: records put into the queue
+        - written: records passed to the target handler
+        - dropped: records discarded because the queue was full
+        - queue_len: records waiting in the queue
+        """
+        return {'queued': self.num_queued,
+                'written': self.num_written,
+                'dropped': self.num_dropped,
+                'queue_len': self._queue.qsize(),
+                }
+
+    def close(self):
+        """Write the records in the queue and close the target handler."""
+        if self._writer.is_alive():
+            try:
+                self._queue.put(None, timeout=ASYNC_CLOSE_TIMEOUT)
+            except Queue.Full:
+                pass
+            self._writer.join(ASYNC_CLOSE_TIMEOUT)
+        self.target_handler.close()
+        logging.Handler.close(self)
+
+    def _write_records(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            num_dropped = self.num_dropped
+            if num_dropped != self._num_dropped_reported:
+                self.target_handler.handle(logging.makeLogRecord(
+                        {'name': record.name,
+                         'levelno': logging.WARNING,
+                         'levelname': logging.getLevelName(logging.WARNING),
+                         'msg': '%d log records dropped (queue full)' % (
+                                num_dropped - self._num_dropped_reported),
+                         }))
+                self._num_dropped_reported = num_dropped
+            self.target_handler.handle(record)
+            self.num_written += 1
+        self.target_handler.flush()
+
+
 
 def testing_setup(module_name):
     logger = logging.getLogger('dht')
@@ -36,7 +136,12 @@ def testing_setup(module_name):
     logger_conf.setFormatter(logging.Formatter(FORMAT))
     logger.addHandler(logger_conf)
 
-def setup(logs_path, logs_level):
+def setup(logs_path, logs_level, async_queue_size=0):
+    """
+    Log into logs_path/pymdht.log. When async_queue_size is not zero, records
+    are written by a background thread (see AsyncHandler).
+
+    """
     logger = logging.getLogger('dht')
     logger.setLevel(logs_level)
 
@@ -49,8 +154,20 @@ def setup(logs_path, logs_level):
         filename, mode='w', maxBytes=log_size_limit, backupCount=0)
     logger_conf.setLevel(logs_level)
     logger_conf.setFormatter(logging.Formatter(FORMAT))
+    if async_queue_size:
+        logger_conf = AsyncHandler(logger_conf, async_queue_size)
     logger.addHandler(logger_conf)
 
+def get_stats():
+    """
+    Return the counters of the asynchronous handler (see
+    AsyncHandler.get_stats) or None when logging is synchronous.
+
+    """
+    for handler in logging.getLogger('dht').handlers:
+        if isinstance(handler, AsyncHandler):
+            return handler.get_stats()
+
 def close():
     logger = logging.getLogger('dht')
     for i in list(logger.handlers):
@@ -55,6 +55,9 @@ class GetPeersLookup(object):
         announcements_to_send = []
         announce_to_myself = False
         return announcements_to_send, announce_to_myself
+
+    def get_closest_responded_nodes(self):
+        return []
             
 class MaintenanceLookup(GetPeersLookup):
 
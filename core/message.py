@@ -93,6 +93,8 @@ class MsgFactory(object):
         self.version_label = version_label
         self.src_id = src_id
         self.private_dht_name = private_dht_name
+        self._response_template = _ResponseTemplate(version_label, src_id,
+                                                    private_dht_name)
 
     def outgoing_ping_query(self, dst_node, experimental_obj=None):
         msg = OutgoingMsg(self.version_label, dst_node,
@@ -126,33 +128,28 @@ class MsgFactory(object):
         return msg
     
     def outgoing_ping_response(self, dst_node):
-        msg = OutgoingMsg(self.version_label, dst_node,
-                          self.private_dht_name)
-        msg.make_response(self.src_id)
-        msg.ping_response()
-        return msg
+        return OutgoingResponse(self._response_template, dst_node)
     
     def outgoing_find_node_response(self, dst_node, nodes):
-        msg = OutgoingMsg(self.version_label, dst_node,
-                          self.private_dht_name)
-        msg.make_response(self.src_id)
-        msg.find_node_response(nodes)
-        return msg
+        return OutgoingResponse(self._response_template, dst_node,
+                                c_nodes=mt.compact_nodes(nodes))
     
     def outgoing_get_peers_response(self, dst_node, token=None,
-                                    nodes=None, peers=None):
-        msg = OutgoingMsg(self.version_label, dst_node,
-                          self.private_dht_name)
-        msg.make_response(self.src_id)
-        msg.get_peers_response(token, nodes, peers)
-        return msg
+                                    nodes=None, peers=None, c_peers=None):
+        """Peers can be given already in compact form (c_peers)."""
+        assert nodes or peers or c_peers
+        c_nodes = None
+        if nodes:
+            c_nodes = mt.compact_nodes(nodes)
+        if peers:
+            c_peers = mt.compact_peers(peers)
+        elif not c_peers:
+            c_peers = None
+        return OutgoingResponse(self._response_template, dst_node,
+                                c_nodes, token or None, c_peers)
     
     def outgoing_announce_peer_response(self, dst_node):
-        msg = OutgoingMsg(self.version_label, dst_node,
-                          self.private_dht_name)
-        msg.make_response(self.src_id)
-        msg.announce_peer_response()
-        return msg
+        return OutgoingResponse(self._response_template, dst_node)
 
     def outgoing_error(self, dst_node, error):
         msg = OutgoingMsg(self.version_label, dst_node,
@@ -213,7 +210,7 @@ class OutgoingMsg(object):
       True.
       
       """
-      matched = self._dict[TID][0] == response_msg.tid[0]
+      matched = self._dict[TID] == response_msg.tid
       if matched:
           self.rtt = time.time() - self.sending_ts
           self.got_response = True            
@@ -277,6 +274,206 @@ class OutgoingMsg(object):
         self._dict[TYPE] = ERROR
         self._dict[ERROR] = error
 
+
+class _ResponseTemplate(object):
+    """
+    Bencoded pieces shared by all the responses sent by a node. Keys are
+    sorted as bencode.encode does (d < r < t < v < y; id < nodes < token <
+    values), so the result is the same.
+
+    """
+    def __init__(self, version_label, src_id, private_dht_name):
+        self.version_label = version_label
+        self.src_id = src_id
+        self.private_dht_name = private_dht_name
+        prefix = ['d']
+        if private_dht_name:
+            prefix.append('1:d' + bencode.encode(private_dht_name))
+        prefix.append('1:rd2:id' + bencode.encode(str(src_id)))
+        self.prefix = ''.join(prefix)
+        self.suffix = '1:v%s1:y1:re' % bencode.encode(version_label)
+
+    def encode(self, tid, c_nodes, token, c_peers):
+        pieces = [self.prefix]
+        if c_nodes is not None:
+            pieces.append('5:nodes%d:%s' % (len(c_nodes), c_nodes))
+        if token is not None:
+            pieces.append('5:token%d:%s' % (len(token), token))
+        if c_peers is not None:
+            pieces.append('6:valuesl')
+            pieces.extend(['%d:%s' % (len(c_peer), c_peer)
+                           for c_peer in c_peers])
+            pieces.append('e')
+        pieces.append('e1:t%d:%s' % (len(tid), tid))
+        pieces.append(self.suffix)
+        return ''.join(pieces)
+
+
+class OutgoingResponse(OutgoingMsg):
+    """
+    Response created by MsgFactory. Only the TID and the variable values
+    (nodes, token, and peers) are encoded when stamping, the rest comes
+    from the factory's template. The result is identical to OutgoingMsg's.
+
+    """
+
+    def __init__(self, template, dst_node,
+                 c_nodes=None, token=None, c_peers=None):
+        self.dst_node = dst_node
+        self._template = template
+        self._c_nodes = c_nodes
+        self._token = token
+        self._c_peers = c_peers
+        self._tid = None
+        self._msg_dict = None
+
+    @property
+    def _dict(self):
+        # The dictionary is only built when needed (e.g., logging). Once
+        # built, it can be modified and it is used to encode the message.
+        if self._msg_dict is None:
+            template = self._template
+            response = {ID: str(template.src_id)}
+            if self._c_nodes is not None:
+                response[NODES] = self._c_nodes
+            if self._token is not None:
+                response[TOKEN] = self._token
+            if self._c_peers is not None:
+                response[VALUES] = self._c_peers
+            self._msg_dict = {VERSION: template.version_label,
+                              TYPE: RESPONSE,
+                              RESPONSE: response}
+            if template.private_dht_name:
+                self._msg_dict['d'] = template.private_dht_name
+            if self._tid is not None:
+                self._msg_dict[TID] = self._tid
+        return self._msg_dict
+
+    def stamp(self, tid):
+        if self._msg_dict is not None:
+            return OutgoingMsg.stamp(self, tid)
+        if self._tid is not None:
+            raise MsgError, 'Message has already been stamped'
+        self._tid = tid
+        self.sending_ts = time.time()
+        return self._template.encode(tid, self._c_nodes, self._token,
+                                     self._c_peers)
+
+    @property
+    def tid(self):
+        if self._msg_dict is not None:
+            return self._msg_dict[TID]
+        return self._tid
+
+############################################
+#
+# KRPC parser
+#
+# bencode.decode can decode anything. These functions only decode the
+# messages we usually get (queries and responses with the keys below) but
+# they do it in a single pass, checking value types while scanning. Any
+# other shape raises ShapeError and IncomingMsg falls back to
+# bencode.decode (which also takes care of the error reporting).
+#
+
+_DIGITS = '0123456789'
+_MAX_STR_LEN_DIGITS = 6 # longest string: 999999 bytes (datagrams are smaller)
+
+
+class ShapeError(Exception):
+    """Raised by decode_krpc when the message is not a usual KRPC message."""
+
+
+def _krpc_str(data, pos):
+    if data[pos] not in _DIGITS:
+        raise ShapeError
+    colon = data[pos:pos + _MAX_STR_LEN_DIGITS + 1].find(':')
+    if colon == -1:
+        raise ShapeError
+    begin = pos + colon + 1
+    end = begin + int(data[pos:pos + colon])
+    if end > len(data):
+        raise ShapeError
+    return data[begin:end], end
+
+def _krpc_int(data, pos):
+    if data[pos] != 'i':
+        raise ShapeError
+    end = data[pos:pos + bencode.INT_SEARCH_LEN].find('e')
+    if end == -1:
+        # Unusually long: bencode.decode handles it
+        raise ShapeError
+    return int(data[pos + 1:pos + end]), pos + end + 1
+
+def _krpc_str_list(data, pos):
+    if data[pos] != 'l':
+        raise ShapeError
+    result = []
+    pos += 1
+    while data[pos] != 'e':
+        value, pos = _krpc_str(data, pos)
+        result.append(value)
+    return result, pos + 1
+
+def _krpc_dict(data, pos, value_fs):
+    if data[pos] != 'd':
+        raise ShapeError
+    result = {}
+    pos += 1
+    while data[pos] != 'e':
+        key, pos = _krpc_str(data, pos)
+        try:
+            value_f = value_fs[key]
+        except (KeyError):
+            raise ShapeError
+        result[key], pos = value_f(data, pos)
+    return result, pos + 1
+
+# Keys found in queries' arguments and responses
+_KRPC_ARGS_FS = {ID: _krpc_str,
+                 TARGET: _krpc_str,
+                 INFO_HASH: _krpc_str,
+                 TOKEN: _krpc_str,
+                 NODES: _krpc_str,
+                 PORT: _krpc_int,
+                 'implied_port': _krpc_int,
+                 VALUES: _krpc_str_list,
+                 NODES2: _krpc_str_list,
+                 }
+
+def _krpc_args(data, pos):
+    return _krpc_dict(data, pos, _KRPC_ARGS_FS)
+
+# Top-level keys ('ip' and 'ro' are added by some clients)
+_KRPC_MSG_FS = {TID: _krpc_str,
+                TYPE: _krpc_str,
+                QUERY: _krpc_str,
+                VERSION: _krpc_str,
+                'd': _krpc_str, # private DHT name
+                'ip': _krpc_str,
+                'ro': _krpc_int,
+                ARGS: _krpc_args,
+                RESPONSE: _krpc_args,
+                }
+
+def decode_krpc(data):
+    """
+    Decode a KRPC message (query or response). The result is the same as
+    bencode.decode's. Raise ShapeError when the message has a different
+    shape (e.g., error messages or unknown keys) or it is not valid.
+
+    >>> decode_krpc('d1:ad2:id20:aaaaaaaaaaaaaaaaaaaae1:q4:ping1:t2:aa1:y1:qe')
+    {'a': {'id': 'aaaaaaaaaaaaaaaaaaaa'}, 'q': 'ping', 't': 'aa', 'y': 'q'}
+
+    """
+    try:
+        msg_dict, end = _krpc_dict(data, 0, _KRPC_MSG_FS)
+    except (IndexError, ValueError):
+        raise ShapeError
+    if end != len(data):
+        raise ShapeError
+    return msg_dict
+
 ############################################
 
 class IncomingMsg(object):
@@ -313,6 +510,15 @@ class IncomingMsg(object):
         self.peers = None
         # ERROR
         self.error = None
+        if type(bencoded_msg) is not str:
+            bencoded_msg = mt.as_buffer(bencoded_msg)
+        try:
+            self._msg_dict = decode_krpc(bencoded_msg)
+            self._sanitize_krpc()
+        except (ShapeError):
+            self._decode_and_sanitize(bencoded_msg)
+
+    def _decode_and_sanitize(self, bencoded_msg):
         try:
             # bencode.decode may raise bencode.DecodeError
             self._msg_dict = bencode.decode(bencoded_msg)
@@ -328,8 +534,8 @@ class IncomingMsg(object):
         except (MsgError):
             raise
         except:
-            logger.warning(
-                'This bencoded message is broken:\n%s' % repr(bencoded_msg))
+            logger.warning('This bencoded message is broken:\n%r',
+                           str(bencoded_msg))
             raise MsgError, 'Invalid message'
 
     def __repr__(self):
@@ -338,6 +544,68 @@ class IncomingMsg(object):
     #
     # Sanitize functions
     #
+
+    def _sanitize_krpc(self):
+        """
+        Sanitize a message decoded by decode_krpc (values have the right
+        types already). Raise ShapeError when something is wrong, so
+        that the generic sanitize functions can report it.
+
+        """
+        msg_dict = self._msg_dict
+        try:
+            tid = msg_dict[TID]
+            msg_type = msg_dict[TYPE]
+            if (self.private_dht_name
+                and msg_dict['d'] != self.private_dht_name):
+                raise ShapeError
+            if not tid:
+                raise ShapeError
+            version = msg_dict.get(VERSION)
+            if msg_type == QUERY:
+                args = msg_dict[ARGS]
+                query = msg_dict[QUERY]
+                src_id = Id(args[ID])
+                if query == FIND_NODE:
+                    self.target = Id(args[TARGET])
+                elif query == GET_PEERS or query == ANNOUNCE_PEER:
+                    self.info_hash = Id(args[INFO_HASH])
+                    if query == ANNOUNCE_PEER:
+                        bt_port = args[PORT]
+                        if not MIN_BT_PORT <= bt_port <= MAX_BT_PORT:
+                            raise ShapeError
+                        self.bt_port = bt_port
+                        self.token = args[TOKEN]
+                self.query = query
+            elif msg_type == RESPONSE:
+                response = msg_dict[RESPONSE]
+                src_id = Id(response[ID])
+                self.all_nodes = []
+                c_nodes = response.get(NODES)
+                if c_nodes:
+                    self.nodes = mt.uncompact_nodes(c_nodes)
+                    self.all_nodes = self.nodes
+                c_nodes2 = response.get(NODES2)
+                if c_nodes2 is not None:
+                    self.nodes2 = mt.uncompact_nodes2(c_nodes2)
+                    for n in self.nodes2:
+                        if n not in self.all_nodes:
+                            self.all_nodes.append(n)
+                self.token = response.get(TOKEN)
+                c_peers = response.get(PEERS)
+                if c_peers:
+                    self.peers = mt.uncompact_peers(c_peers)
+            else:
+                raise ShapeError
+        except (KeyError, IdError):
+            raise ShapeError
+        self.tid = tid
+        self.type = msg_type
+        self.version = version
+        self.ns_node = version and version.startswith('NS')
+        self.src_id = src_id
+        self.src_node = Node(self.src_addr, src_id, version)
+
     
     def _get_value(self, k, kk=None, optional=False):
         try:
@@ -466,9 +734,11 @@ class IncomingMsg(object):
 
 class Datagram(object):
 
-    def __init__(self, data, addr):
+    def __init__(self, data, addr, is_query=False):
         self.data = data
         self.addr = addr
+        # Queries are registered by the querier (waiting for a response)
+        self.is_query = is_query
 
     def __eq__(self, other):
         return (self.data == other.data and 
@@ -25,6 +25,8 @@ C_NODE2_SIZE = ID_SIZE_BYTES + ADDR6_SIZE
 
 IP6_PADDING = '\x00' * 10 + '\xff\xff'
 
+NODE_POOL_SIZE = 4000 # nodes
+
 
 class AddrError(Exception):
     pass
@@ -43,19 +45,34 @@ def int_to_bin(i):
 def compact_addr(addr):
     return ''.join((inet_aton(addr[0]), int_to_bin(addr[1])))
 
+def as_buffer(data):
+    """
+    Return data in a form which can be indexed and sliced like a string
+    (str or read-only buffer) without copying it. A memoryview has to be
+    copied because Python 2's memoryview cannot be wrapped in a buffer.
+
+    """
+    data_type = type(data)
+    if data_type is bytearray:
+        return buffer(data)
+    if data_type is memoryview:
+        return data.tobytes()
+    return data
+
 def uncompact_addr(c_addr):
+    c_addr = as_buffer(c_addr)
     if len(c_addr) != ADDR4_SIZE:
         raise AddrError, 'invalid address size'
     # inet_ntoa only raises socket.error when the parameter is not 4
     # bytes, no need to try/except
     if c_addr[0] == '\x7f' or c_addr[:2] == '\xc0\xa8':
         #Exclude addresses 127.* and 192.168.*
-        logger.warning('Got private address: %r' % (c_addr))
+        logger.warning('Got private address: %r', str(c_addr))
         raise AddrError, 'private address'
-    ip = inet_ntoa(c_addr[:-2])
-    port = bin_to_int(c_addr[-2:])
+    ip = inet_ntoa(buffer(c_addr, 0, IP4_SIZE))
+    port = bin_to_int(buffer(c_addr, IP4_SIZE))
     if port == 0:
-        logger.warning('c_addr: %r > port is ZERO' % c_addr)
+        logger.warning('c_addr: %r > port is ZERO', str(c_addr))
         raise AddrError
     return (ip, port)
 
@@ -71,26 +88,99 @@ def uncompact_peers(c_peers):
             pass
     return peers
 
+class NodePool(object):
+    """
+    Intern table of the Node objects built by uncompact_nodes, keyed by the
+    compact node string (id + IPv4 address). Popular nodes show up in many
+    responses. Returning the same Node (and Id) object saves allocations and
+    makes most Node comparisons identity checks.
+
+    The table keeps at most 'max_size' nodes in two generations (an
+    approximated LRU): nodes are looked up in the current generation first
+    and then in the old one (if found there, they are moved to the current
+    one). When the current generation is full, the old generation is
+    discarded and the current one becomes the old one.
+
+    Nodes in the pool are shared: they must not be modified.
+
+    """
+    def __init__(self, max_size=NODE_POOL_SIZE):
+        self._max_generation_size = max(1, max_size / 2)
+        self._current = {}
+        self._old = {}
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get(self, c_node):
+        """
+        Return the Node for c_node (a C_NODE_SIZE string). Raise AddrError
+        when c_node's address is not valid.
+
+        """
+        node_ = self._current.get(c_node)
+        if node_ is None:
+            node_ = self._old.get(c_node)
+            if node_ is None:
+                self.num_misses += 1
+                node_ = Node(uncompact_addr(c_node[ID_SIZE_BYTES:]),
+                             Id(c_node[:ID_SIZE_BYTES]), version=None)
+            else:
+                self.num_hits += 1
+            if len(self._current) >= self._max_generation_size:
+                self._old = self._current
+                self._current = {}
+            self._current[c_node] = node_
+        else:
+            self.num_hits += 1
+        return node_
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def get_stats(self):
+        """
+        Return a dictionary with counters:
+        - hits/misses: lookups which found (or not) a node in the pool
+        - hit_rate: hits / (hits + misses)
+        - size: nodes in the pool (a node can be in both generations)
+        """
+        num_lookups = self.num_hits + self.num_misses
+        if num_lookups:
+            hit_rate = float(self.num_hits) / num_lookups
+        else:
+            hit_rate = 0.
+        return {'hits': self.num_hits,
+                'misses': self.num_misses,
+                'hit_rate': hit_rate,
+                'size': len(self),
+                }
+
+node_pool = NodePool()
+
+
 def compact_nodes(nodes):
     return ''.join([node.id.bin_id + compact_addr(node.addr) \
                     for node in nodes])
     
 def uncompact_nodes(c_nodes):
+    """
+    Return a list of Node objects. c_nodes can be a string or a view on a
+    receive buffer (see as_buffer). The Node objects come from node_pool
+    (see NodePool): they must not be modified.
+
+    """
+    c_nodes = as_buffer(c_nodes)
     if len(c_nodes) % C_NODE_SIZE != 0:
-        logger.info('invalid size (%d) %s' % (len(c_nodes),
-                                              c_nodes))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('invalid size (%d) %s', len(c_nodes), str(c_nodes))
         return []
     nodes = []
+    get_node = node_pool.get
     for begin in xrange(0, len(c_nodes), C_NODE_SIZE):
-        node_id = Id(c_nodes[begin:begin + ID_SIZE_BYTES])
         try:
-            node_addr = uncompact_addr(
-                c_nodes[begin+ID_SIZE_BYTES:begin+C_NODE_SIZE])
+            nodes.append(get_node(c_nodes[begin:begin + C_NODE_SIZE]))
         except AddrError:
             pass
-        else:
-            node = Node(node_addr, node_id, version=None)
-            nodes.append(node)
     return nodes
 
 def compact_nodes2(nodes):
@@ -104,7 +194,7 @@ def uncompact_nodes2(c_nodes):
         try:
             node_addr = uncompact_addr(c_node[ID_SIZE_BYTES:]) 
         except (AddrError):
-            logger.warning('IPv6 addr in nodes2: %s' % c_node)
+            logger.warning('IPv6 addr in nodes2: %s', c_node)
         else:
             node = Node(node_addr, node_id)
             nodes.append(node)
@@ -5,16 +5,32 @@
 '''
 Minitwisted is inspired by the Twisted framework. Although, it is much
 simpler.
-- It can only handle one UDP connection per reactor.
 - Reactor runs in a thread
+- Besides the DHT's UDP socket, other sockets can be watched by the reactor
+  (see listen_udp and add_reader). Sockets are watched using epoll (select on
+  platforms without epoll)
+- call_asap, call_later, and stop wake the reactor up immediately (the reactor
+  also watches the reading end of a pipe)
 - You can use call_asap to run your code in thread-safe mode
+- You can use call_later to run your code (thread-safe) after a delay. The
+  returned DelayedCall object can be used to cancel the call
+- In batch mode (recv_batch_size > 1), all the datagrams ready in the socket
+  (up to recv_batch_size) are read in one step and handed over together
+- Outgoing datagrams are queued and flushed together. Sending can be paced
+  (max_send_rate packets per second). Maintenance datagrams (returned by
+  main_loop) are only sent when there are no other datagrams waiting
 
 '''
 
 import sys
+import os
+import errno
+import select
 import socket
 import threading
 import logging
+import heapq
+from collections import deque
 
 from message import Datagram
 import ptime as time
@@ -24,7 +40,90 @@ logger = logging.getLogger('dht')
 
 BUFFER_SIZE = 3000
 
+PROC_NET_UDP = '/proc/net/udp'
+
+# Datagrams per queue when pacing is on. Only non-query datagrams are
+# dropped (queries are registered by the querier and the query scheduler
+# limits how many are in flight).
+MAX_SEND_QUEUE_LEN = 1000
+
 DEBUG = False
+
+try:
+    import fcntl
+except (ImportError):
+    fcntl = None # Windows: no self-pipe, wake up every task_interval
+
+
+class _Poller(object):
+
+    """
+    Watch file descriptors for reading. Use epoll when available, select
+    otherwise. Not meant to be used outside this module.
+
+    """
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+        else:
+            self._epoll = None
+        self._fds = set()
+
+    def register(self, fd):
+        if fd in self._fds:
+            return
+        self._fds.add(fd)
+        if self._epoll:
+            self._epoll.register(fd, select.EPOLLIN)
+
+    def unregister(self, fd):
+        if fd not in self._fds:
+            return
+        self._fds.remove(fd)
+        if self._epoll:
+            self._epoll.unregister(fd)
+
+    def poll(self, timeout):
+        """Return a list of the file descriptors ready to be read."""
+        try:
+            if self._epoll:
+                return [fd for fd, _ in self._epoll.poll(timeout)]
+            if not self._fds:
+                time.sleep(timeout)
+                return []
+            return select.select(list(self._fds), [], [], timeout)[0]
+        except (select.error, IOError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+
+    def close(self):
+        if self._epoll:
+            self._epoll.close()
+
+
+class DelayedCall(object):
+
+    """
+    Handle returned by ThreadedReactor.call_later. Do not create instances
+    yourself.
+
+    """
+    def __init__(self, call_ts, callback_f, args, kwds):
+        self.call_ts = call_ts
+        self.callback_f = callback_f
+        self.args = args
+        self.kwds = kwds
+        self.cancelled = False
+        self.called = False
+
+    def cancel(self):
+        """Cancel the call (if it hasn't been called yet)."""
+        self.cancelled = True
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
                             
 class ThreadedReactor(threading.Thread):
 
@@ -37,14 +136,31 @@ class ThreadedReactor(threading.Thread):
     def __init__(self, main_loop_f,
                  port, on_datagram_received_f,
                  task_interval=0.1,
-                 floodbarrier_active=True):
+                 floodbarrier_active=True,
+                 on_datagrams_received_f=None,
+                 recv_batch_size=1,
+                 max_send_rate=0,
+                 zero_copy_recv=False):
+        """
+        When zero_copy_recv is on, datagrams are received into preallocated
+        buffers (one per datagram in a batch) and Datagram.data is a
+        read-only buffer on them. Such data is only valid until the
+        datagram handler returns: handlers must copy (e.g., slice or
+        decode) whatever they want to keep.
+
+        """
         threading.Thread.__init__(self, name = "DHT")
         self.daemon = True
         
         self._lock = threading.RLock()
         self._running = False
-        self._call_asap_queue = []
-        self._next_main_loop_call_ts = 0 # call immediately
+        self._stop_requested = False # stop() may be called before run()
+        self._call_asap_queue = deque()
+        # Heap of (call_ts, seq_num, DelayedCall). Cancelled calls are removed
+        # from the heap when their time comes.
+        self._delayed_calls = []
+        self._delayed_call_seq_num = 0
+        self._main_loop_call = None
 
         self._capturing = False
         self._captured = []
@@ -52,16 +168,57 @@ class ThreadedReactor(threading.Thread):
         self._main_loop_f = main_loop_f
         self._port = port
         self._on_datagram_received_f = on_datagram_received_f
+        self._on_datagrams_received_f = on_datagrams_received_f
         self.task_interval = task_interval
+        assert recv_batch_size >= 1
+        self.recv_batch_size = recv_batch_size
+        # Receive counters (see get_stats)
+        self.num_recv_batches = 0
+        self.num_datagrams_received = 0
+        self.num_full_recv_batches = 0
+        self.max_recv_batch_len = 0
+        # Receive buffers (reused in every batch)
+        if zero_copy_recv:
+            self._recv_buffers = [bytearray(BUFFER_SIZE)
+                                  for _ in xrange(recv_batch_size)]
+        else:
+            self._recv_buffers = None
+        # Send queues (maintenance datagrams have lower priority)
+        self._send_queue = deque()
+        self._maintenance_send_queue = deque()
+        self.max_send_rate = max_send_rate # 0 means no pacing
+        self._send_burst = max(1, max_send_rate * task_interval)
+        self._send_tokens = self._send_burst
+        self._last_send_tokens_ts = time.time()
+        # Send counters (see get_stats)
+        self.num_datagrams_sent = 0
+        self.num_send_queue_drops = 0
         self.floodbarrier_active = floodbarrier_active
         if self.floodbarrier_active:
             self.floodbarrier = FloodBarrier()
 
+        self._poller = _Poller()
+        # Extra sockets/files watched by the reactor {fd: (fileobj, f)}
+        self._readers = {}
+        # Self-pipe: other threads write a byte to wake the reactor up
+        self._wakeup_pending = False
+        if fcntl:
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            for fd in (self._wakeup_r, self._wakeup_w):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._poller.register(self._wakeup_r)
+        else:
+            self._wakeup_r = self._wakeup_w = None
+
         self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.s.settimeout(self.task_interval)
+        self.s.setblocking(0)
         my_addr = ('', self._port)
         self.s.bind(my_addr)
+        self._polled_s = None
+
+        self._schedule_main_loop(0) # call immediately
 
     def _get_running(self):
         self._lock.acquire()
@@ -96,7 +253,11 @@ class ThreadedReactor(threading.Thread):
         doesn't count run as being executed (it doesn't count as 'covered').
         
         """
-        self.running = True
+        self._lock.acquire()
+        try:
+            self.running = not self._stop_requested
+        finally:
+            self._lock.release()
         logger.critical('run')
         try:
             while self.running:
@@ -108,6 +269,15 @@ class ThreadedReactor(threading.Thread):
             if DEBUG:
                 raise
         self.running = False
+        self._lock.acquire()
+        try:
+            self._poller.close()
+            for fd in (self._wakeup_r, self._wakeup_w):
+                if fd is not None:
+                    os.close(fd)
+            self._wakeup_r = self._wakeup_w = None
+        finally:
+            self._lock.release()
         logger.debug('Reactor stopped')
 
     def start_capture(self):
@@ -132,58 +302,294 @@ class ThreadedReactor(threading.Thread):
     def run_one_step(self):
         """Main loop activated by calling self.start()"""
 
-        # Deal with call_asap requests
-        #TODO: retry for 5 seconds if no msgs_to_send (inside controller?)
-        call_asap_tuple = None
+        # Deal with call_asap requests (all the queued ones)
         self._lock.acquire()
         try:
-            if self._call_asap_queue:
-                call_asap_tuple = self._call_asap_queue.pop(0)
+            call_asap_queue = self._call_asap_queue
+            self._call_asap_queue = deque()
         finally:
             self._lock.release()
-        if call_asap_tuple:
-            callback_f, args, kwds = call_asap_tuple
+        while call_asap_queue:
+            callback_f, args, kwds = call_asap_queue.popleft()
             datagrams_to_send = callback_f(*args, **kwds)
-            for datagram in datagrams_to_send:
-                self._sendto(datagram)
-
-        # Call main_loop
-        if time.time() >= self._next_main_loop_call_ts:
-            (self._next_main_loop_call_ts,
-             datagrams_to_send) = self._main_loop_f()
-            for datagram in datagrams_to_send:
-                self._sendto(datagram)
-
-        # Get data from the network
-        try:
-            data, addr = self.s.recvfrom(BUFFER_SIZE)
-        except (socket.timeout):
-            pass #timeout
-        except (socket.error), e:
-            logger.warning(
-                'Got socket.error when receiving data:\n%s' % e)
+            self._enqueue(self._send_queue, datagrams_to_send)
+
+        # Deal with delayed calls (including main_loop)
+        current_ts = time.time()
+        while True:
+            self._lock.acquire()
+            try:
+                if (self._delayed_calls and
+                    self._delayed_calls[0][0] <= current_ts):
+                    delayed_call = heapq.heappop(self._delayed_calls)[2]
+                else:
+                    delayed_call = None
+            finally:
+                self._lock.release()
+            if not delayed_call:
+                break
+            if delayed_call.cancelled:
+                continue
+            delayed_call.called = True
+            datagrams_to_send = delayed_call.callback_f(*delayed_call.args,
+                                                        **delayed_call.kwds)
+            self._enqueue(self._send_queue, datagrams_to_send)
+
+        # Send before blocking on the sockets
+        self._flush_send_queues()
+
+        # Wait for the network (or a wake-up)
+        ready_fds = self._wait()
+        if not ready_fds:
+            return
+        s_fd = self._polled_s.fileno()
+        for fd in ready_fds:
+            if fd == self._wakeup_r:
+                self._drain_wakeup_pipe()
+            elif fd != s_fd and fd in self._readers:
+                _, on_readable_f = self._readers[fd]
+                datagrams_to_send = on_readable_f()
+                self._enqueue(self._send_queue, datagrams_to_send)
+        if s_fd not in ready_fds:
+            self._flush_send_queues()
+            return
+
+        # Get data from the DHT socket
+        datagrams_received = self._recv_datagrams()
+        if not datagrams_received:
+            return
+        if self._on_datagrams_received_f:
+            (next_main_loop_call_ts,
+             datagrams_to_send) = self._on_datagrams_received_f(
+                datagrams_received)
+            self._enqueue(self._send_queue, datagrams_to_send)
         else:
-            self._add_capture((time.time(), addr, False, data))
-            ip_is_blocked = self.floodbarrier_active and \
-                            self.floodbarrier.ip_blocked(addr[0])
-            if ip_is_blocked:
-                import sys
-#                print >>sys.stderr, '>>>>>>>>>>>>>>>>>>', addr
-#                print >>sys.stderr, '>>>>>>>>>>>>>>>>>>', `addr`
-                logger.warning("blocked")
-#                print >>sys.stderr, '>>>>>>>>>>>>>>>>>> DONE'
+            for datagram_received in datagrams_received:
+                (next_main_loop_call_ts,
+                 datagrams_to_send) = self._on_datagram_received_f(
+                    datagram_received)
+                self._enqueue(self._send_queue, datagrams_to_send)
+        self._schedule_main_loop(next_main_loop_call_ts)
+        self._flush_send_queues()
+
+    def _call_main_loop(self):
+        (next_main_loop_call_ts,
+         datagrams_to_send) = self._main_loop_f()
+        self._enqueue(self._maintenance_send_queue, datagrams_to_send)
+        self._schedule_main_loop(next_main_loop_call_ts)
+        return []
+
+    def _schedule_main_loop(self, call_ts):
+        main_loop_call = self._main_loop_call
+        if main_loop_call and main_loop_call.active():
+            if main_loop_call.call_ts == call_ts:
+                return # already scheduled
+            main_loop_call.cancel()
+        self._main_loop_call = self._call_at(call_ts, self._call_main_loop,
+                                             (), {})
+
+    def _wait(self):
+        """
+        Block till a watched socket (or the wake-up pipe) is ready to be read,
+        the next delayed call is due, or task_interval seconds have passed.
+        Return the list of file descriptors ready to be read.
+
+        """
+        if self.s is not self._polled_s:
+            # The DHT socket has been replaced (tests use mock sockets)
+            if self._polled_s:
+                self._poller.unregister(self._polled_s.fileno())
+            self._polled_s = self.s
+            self._poller.register(self.s.fileno())
+        self._lock.acquire()
+        try:
+            if self._call_asap_queue:
+                next_call_ts = 0
+            elif self._delayed_calls:
+                next_call_ts = self._delayed_calls[0][0]
+            else:
+                next_call_ts = None
+        finally:
+            self._lock.release()
+        timeout = self.task_interval
+        if next_call_ts is not None:
+            timeout = max(0, min(timeout, next_call_ts - time.time()))
+        return self._poller.poll(timeout)
+
+    def _wakeup(self):
+        """Make the reactor thread return from _wait (thread-safe)."""
+        self._lock.acquire()
+        try:
+            if self._wakeup_w is None or self._wakeup_pending:
                 return
-            datagram_received = Datagram(data, addr)
-            (self._next_main_loop_call_ts,
-             datagrams_to_send) = self._on_datagram_received_f(
-             datagram_received)
-            for datagram in datagrams_to_send:
-                self._sendto(datagram)
+            self._wakeup_pending = True
+            try:
+                os.write(self._wakeup_w, '\0')
+            except (OSError):
+                pass # pipe full (a wake-up is pending anyway)
+        finally:
+            self._lock.release()
+
+    def _drain_wakeup_pipe(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except (OSError):
+            pass # EAGAIN: the pipe is empty
+        # Only once the pipe is empty. A _wakeup call while draining does not
+        # write (still pending) but its call_asap is handled in the next step.
+        self._lock.acquire()
+        try:
+            self._wakeup_pending = False
+        finally:
+            self._lock.release()
+
+    def _enqueue(self, send_queue, datagrams):
+        send_queue.extend(datagrams)
+        if not self.max_send_rate:
+            # No pacing: everything is sent in this step
+            return
+        num_drops = len(send_queue) - MAX_SEND_QUEUE_LEN
+        if num_drops > 0:
+            self._drop_non_queries(send_queue, num_drops)
+
+    def _drop_non_queries(self, send_queue, num_drops):
+        # Drop the newest non-query datagrams (responses, errors). Queries
+        # are kept (the querier waits for their responses).
+        kept = []
+        num_dropped = 0
+        while send_queue:
+            datagram = send_queue.pop()
+            if num_dropped < num_drops and not datagram.is_query:
+                num_dropped += 1
+            else:
+                kept.append(datagram)
+        kept.reverse()
+        send_queue.extend(kept)
+        if num_dropped:
+            logger.warning('Send queue full: %d datagrams dropped',
+                           num_dropped)
+            self.num_send_queue_drops += num_dropped
+
+    def _flush_send_queues(self):
+        """
+        Send the queued datagrams (non-maintenance first). When pacing is on,
+        datagrams exceeding the send budget stay queued till next step.
+
+        """
+        if self.max_send_rate:
+            current_ts = time.time()
+            self._send_tokens = min(
+                self._send_burst,
+                self._send_tokens + self.max_send_rate * (
+                    current_ts - self._last_send_tokens_ts))
+            self._last_send_tokens_ts = current_ts
+        for send_queue in (self._send_queue, self._maintenance_send_queue):
+            while send_queue:
+                if self.max_send_rate:
+                    if self._send_tokens < 1:
+                        return
+                    self._send_tokens -= 1
+                self._sendto(send_queue.popleft())
+
+    def _recv_datagrams(self):
+        """
+        Return a list of the Datagram objects read from the DHT socket
+        (non-blocking). The socket is read until it is empty or
+        recv_batch_size datagrams have been read.
+
+        Datagrams from blocked IPs (floodbarrier) are dropped here.
+
+        """
+        datagrams = []
+        num_reads = 0
+        recv_buffers = self._recv_buffers
+        while num_reads < self.recv_batch_size:
+            try:
+                if recv_buffers:
+                    recv_buffer = recv_buffers[num_reads]
+                    num_bytes, addr = self.s.recvfrom_into(recv_buffer)
+                    data = buffer(recv_buffer, 0, num_bytes)
+                else:
+                    data, addr = self.s.recvfrom(BUFFER_SIZE)
+            except (socket.timeout):
+                break # nothing to read
+            except (socket.error), e:
+                if e.args and e.args[0] not in (errno.EAGAIN,
+                                                errno.EWOULDBLOCK):
+                    logger.warning(
+                        'Got socket.error when receiving data:\n%s', e)
+                break
+            num_reads += 1
+            self._on_data_received(data, addr, datagrams)
+        if not num_reads:
+            return datagrams
+        self.num_recv_batches += 1
+        self.num_datagrams_received += num_reads
+        if num_reads == self.recv_batch_size:
+            self.num_full_recv_batches += 1
+        self.max_recv_batch_len = max(self.max_recv_batch_len, num_reads)
+        return datagrams
+
+    def _on_data_received(self, data, addr, datagrams):
+        if self._capturing:
+            # Capture is off most of the time. Check before taking the lock.
+            self._add_capture((time.time(), addr, False, str(data)))
+        ip_is_blocked = self.floodbarrier_active and \
+                        self.floodbarrier.ip_blocked(addr[0])
+        if ip_is_blocked:
+            logger.warning("blocked")
+            return
+        datagrams.append(Datagram(data, addr))
+
+    def get_stats(self):
+        """
+        Return a dictionary with the reactor's receive counters:
+        - recv_batches: number of steps where at least one datagram was read
+        - datagrams_received: number of datagrams read from the socket
+        - full_recv_batches: batches which reached recv_batch_size (if this
+          number is high, recv_batch_size is probably too low)
+        - max_recv_batch_len: largest batch read so far
+        - avg_recv_batch_len: datagrams_received / recv_batches
+        - kernel_drops: datagrams dropped by the kernel because the socket's
+          receive buffer was full (None when not available on this platform)
+        - datagrams_sent: number of datagrams passed to the socket
+        - send_queue_len/maintenance_send_queue_len: datagrams waiting to be
+          sent (only when pacing is on)
+        - send_queue_drops: datagrams (never queries) dropped because a send
+          queue was full (only when pacing is on)
+
+        """
+        if self.num_recv_batches:
+            avg_recv_batch_len = (float(self.num_datagrams_received) /
+                                  self.num_recv_batches)
+        else:
+            avg_recv_batch_len = 0.
+        return {'recv_batch_size': self.recv_batch_size,
+                'recv_batches': self.num_recv_batches,
+                'datagrams_received': self.num_datagrams_received,
+                'full_recv_batches': self.num_full_recv_batches,
+                'max_recv_batch_len': self.max_recv_batch_len,
+                'avg_recv_batch_len': avg_recv_batch_len,
+                'kernel_drops': get_kernel_drops(self._port),
+                'max_send_rate': self.max_send_rate,
+                'datagrams_sent': self.num_datagrams_sent,
+                'send_queue_len': len(self._send_queue),
+                'maintenance_send_queue_len': len(
+                    self._maintenance_send_queue),
+                'send_queue_drops': self.num_send_queue_drops,
+                }
             
     def stop(self):#, stop_callback):
         """Stop the thread. It cannot be resumed afterwards"""
 
-        self.running = False
+        self._lock.acquire()
+        try:
+            self._stop_requested = True
+            self.running = False
+        finally:
+            self._lock.release()
+        self._wakeup()
         self.join(self.task_interval*20)
         if self.isAlive():
             logger.info('minitwisted thread still alive. Wait a little more')
@@ -203,24 +609,132 @@ class ThreadedReactor(threading.Thread):
             self._call_asap_queue.append((callback_f, args, kwds))
         finally:
             self._lock.release()
+        self._wakeup()
         return
+
+    def call_later(self, delay, callback_f, *args, **kwds):
+        """Call the given callback with given arguments after 'delay'
+        seconds. Like in call_asap, the callback must return a list of
+        datagrams to be sent.
+
+        Return a DelayedCall object which can be used to cancel the call.
+        
+        """
+        return self._call_at(time.time() + delay, callback_f, args, kwds)
+
+    def _call_at(self, call_ts, callback_f, args, kwds):
+        delayed_call = DelayedCall(call_ts, callback_f, args, kwds)
+        self._lock.acquire()
+        try:
+            self._delayed_call_seq_num += 1
+            heapq.heappush(self._delayed_calls,
+                           (call_ts, self._delayed_call_seq_num,
+                            delayed_call))
+        finally:
+            self._lock.release()
+        if threading.currentThread() is not self:
+            self._wakeup()
+        return delayed_call
+
+    def add_reader(self, fileobj, on_readable_f):
+        """Watch 'fileobj' (anything with a fileno method). Whenever it is
+        ready to be read, on_readable_f is called (without arguments) in the
+        reactor's thread. Like in call_asap, the callback must return a list
+        of datagrams to be sent through the DHT socket.
+
+        """
+        fd = fileobj.fileno()
+        self._lock.acquire()
+        try:
+            self._readers[fd] = (fileobj, on_readable_f)
+            self._poller.register(fd)
+        finally:
+            self._lock.release()
+        self._wakeup()
+
+    def remove_reader(self, fileobj):
+        fd = fileobj.fileno()
+        self._lock.acquire()
+        try:
+            if self._readers.pop(fd, None):
+                self._poller.unregister(fd)
+        finally:
+            self._lock.release()
+
+    def listen_udp(self, port, on_datagram_received_f):
+        """Open a new UDP socket on the given port and watch it. The handler
+        on_datagram_received_f is called (in the reactor's thread) with each
+        Datagram received on this socket and it must return a list of
+        datagrams to be sent back through the same socket. Return the socket
+        object.
+
+        """
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udp_socket.setblocking(0)
+        udp_socket.bind(('', port))
+
+        def on_readable():
+            for _ in xrange(self.recv_batch_size):
+                try:
+                    data, addr = udp_socket.recvfrom(BUFFER_SIZE)
+                except (socket.error):
+                    break # nothing else to read (EAGAIN)
+                for datagram in on_datagram_received_f(Datagram(data, addr)):
+                    try:
+                        udp_socket.sendto(datagram.data, datagram.addr)
+                    except (socket.error):
+                        logger.warning('Got socket.error when sending data'
+                                       ' to %r (port %d)', datagram.addr, port)
+            return []
+        self.add_reader(udp_socket, on_readable)
+        return udp_socket
         
     def _sendto(self, datagram):
-        """Send data to addr using the UDP port used by listen_udp."""
+        """Send data to addr using the DHT socket."""
 
         try:
             bytes_sent = self.s.sendto(datagram.data, datagram.addr)
             if bytes_sent != len(datagram.data):
-                logger.warning(
-                    'Just %d bytes sent out of %d (Data follows)' % (
-                        bytes_sent, len(datagram.data)))
-                logger.critical('Data: %s' % datagram.data)
+                logger.warning('Just %d bytes sent out of %d (Data follows)',
+                               bytes_sent, len(datagram.data))
+                logger.critical('Data: %s', datagram.data)
         except (socket.error):
-            logger.warning(
-                'Got socket.error when sending data to %r\n%r' % (
-                    datagram.addr, datagram.data))
+            logger.warning('Got socket.error when sending data to %r\n%r',
+                           datagram.addr, datagram.data)
         except:
-            logging.error('datagram >>>>>>>>>>>', datagram)
-            logging.error('data,addr: %s %s' % (datagram.data, datagram.addr))
+            logging.error('datagram >>>>>>>>>>> %r', datagram)
+            logging.error('data,addr: %s %s', datagram.data, datagram.addr)
             raise
-        self._add_capture((time.time(), datagram.addr, True, datagram.data))
+        self.num_datagrams_sent += 1
+        if self._capturing:
+            self._add_capture((time.time(), datagram.addr, True,
+                               datagram.data))
+
+
+def get_kernel_drops(port):
+    """
+    Return the number of datagrams dropped by the kernel on the UDP socket
+    bound to the given port (last column of /proc/net/udp). Return None when
+    this information is not available (non-Linux platforms, or no socket
+    found).
+
+    """
+    try:
+        proc_file = open(PROC_NET_UDP)
+    except (IOError):
+        return None
+    try:
+        lines = proc_file.readlines()
+    finally:
+        proc_file.close()
+    port_hex = ':%04X' % port
+    drops = None
+    for line in lines[1:]:
+        fields = line.split()
+        try:
+            if fields[1].endswith(port_hex):
+                drops = (drops or 0) + int(fields[-1])
+        except (IndexError, ValueError):
+            continue
+    return drops
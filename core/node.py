@@ -9,6 +9,8 @@ import identifier
 
 class Node(object):
 
+    __slots__ = ('_addr', '_id', 'version', 'is_ns', '_compact_addr')
+
     def __init__(self, addr, node_id=None, version=1, ns_node=False):
         #assert version != 1 # debug only
         self._addr = addr
@@ -39,6 +41,9 @@ class Node(object):
         return self._addr[0]
     
     def __eq__(self, other):
+        if self is other:
+            # Common case with nodes from message_tools.node_pool
+            return True
         if self.addr == other.addr:
             try:
                 return self.id == other.id
@@ -65,8 +70,7 @@ class Node(object):
         return self.id.distance(other.id)
 
     def log_distance(self, other):
-        # Only for backward compatibility. It will be removed.
-        return self.distance(other).log
+        return self.id.log_distance(other.id)
 
     def compact(self):
         """Return compact format"""
@@ -83,9 +87,26 @@ MAX_LAST_EVENTS = 10
 
 class RoutingNode(Node):
 
+    """
+    Node in the routing table. The last MAX_LAST_EVENTS events (timestamp,
+    event) are kept in a ring buffer. Timeouts in a row are counted as
+    events are added.
+
+    """
+    __slots__ = ('log_distance_to_me', 'rtt', 'real_rtt', 'rtt_avg',
+                 'num_queries', 'num_responses', 'num_timeouts',
+                 'msgs_since_timeout', 'rank',
+                 'creation_ts', 'last_action_ts', 'in_quarantine',
+                 'last_seen', 'bucket_insertion_ts', 'questionable',
+                 '_events', '_next_event_index',
+                 '_timeouts_since_response', '_timeouts_since_msg')
+
     def __init__(self, node_, log_distance):
-        Node.__init__(self, node_.addr, node_.id, node_.version,
-                      node_.is_ns)
+        self._addr = node_.addr
+        self._id = node_.id
+        self.version = node_.version
+        self.is_ns = node_.is_ns
+        self._compact_addr = node_.compact_addr
         self.log_distance_to_me = log_distance
         self.rtt = 99
         self.real_rtt = 99
@@ -94,7 +115,6 @@ class RoutingNode(Node):
         self.num_responses = 0
         self.num_timeouts = 0
         self.msgs_since_timeout = 0
-        self.last_events = []
         #self.refresh_task = None
         self.rank = 0
         current_time = time.time()
@@ -103,6 +123,13 @@ class RoutingNode(Node):
         self.in_quarantine = True
         self.last_seen = current_time
         self.bucket_insertion_ts = None
+        self.questionable = False
+        # Ring buffer (created on the first event)
+        self._events = None
+        self._next_event_index = 0
+        # Timeouts since the last response (or the last query/response)
+        self._timeouts_since_response = 0
+        self._timeouts_since_msg = 0
         
     #def __repr__(self):
     #    return '<rnode: %r %r>' % (self.addr, self.id)
@@ -113,20 +140,39 @@ class RoutingNode(Node):
     def get_node(self):
         return Node(self.addr, self.id)
 
+    @property
+    def last_events(self):
+        """List of the last events (oldest first)."""
+        if self._events is None:
+            return []
+        i = self._next_event_index
+        return [e for e in self._events[i:] + self._events[:i] if e]
+
     def add_event(self, timestamp, event):
-        self.last_events.append((timestamp, event))
-        self.last_events = self.last_events[:MAX_LAST_EVENTS]
+        if self._events is None:
+            self._events = [None] * MAX_LAST_EVENTS
+        self._events[self._next_event_index] = (timestamp, event)
+        self._next_event_index = (
+            self._next_event_index + 1) % MAX_LAST_EVENTS
+        if event == TIMEOUT:
+            self._timeouts_since_response += 1
+            self._timeouts_since_msg += 1
+        elif event == RESPONSE:
+            self._timeouts_since_response = 0
+            self._timeouts_since_msg = 0
+        elif event == QUERY:
+            self._timeouts_since_msg = 0
     
     def timeouts_in_a_row(self, consider_queries=True):
-        """Return number of timeouts in a row for this rnode."""
-        result = 0
-        for timestamp, event in reversed(self.last_events):
-            if event == TIMEOUT:
-                result += 1
-            elif event == RESPONSE or \
-                     (consider_queries and event == QUERY):
-                return result
-        return result # all timeouts (and queries), or empty list
+        """
+        Return number of timeouts in a row for this rnode. That is, the
+        number of timeouts since the last response (or the last query or
+        response when consider_queries is True).
+
+        """
+        if consider_queries:
+            return self._timeouts_since_msg
+        return self._timeouts_since_response
 
     
 class LookupNode(Node):
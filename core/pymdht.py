@@ -18,6 +18,7 @@ import ptime as time
 
 import minitwisted
 import controller
+import message_tools
 import logging, logging_conf
 import swift_tracker
 
@@ -30,6 +31,8 @@ VERSION_LABEL = ''.join(
      chr(PYMDHT_VERSION[2])
      ])
 
+RECV_BATCH_SIZE = 64
+
 
 class Pymdht:
     """Pymdht is the interface for the whole package.
@@ -46,6 +49,11 @@ class Pymdht:
     - auto_bootstrap: perform a lookup on node's id to bootstrap into the overlay
     - bootstrap_mode: (only if YOU want to run a stablebootstrap node)
     - swift_port: UDP port for Swift interface (used in Android app)
+    - recv_batch_size: max number of datagrams read (and processed) in one
+      reactor step
+    - max_send_rate: max number of datagrams sent per second (0: no limit)
+    - async_logging: write logs from a background thread (see
+      logging_conf.AsyncHandler). Useful when debug_level is DEBUG.
     """
     def __init__(self, my_node, conf_path,
                  routing_m_mod, lookup_m_mod,
@@ -54,8 +62,15 @@ class Pymdht:
                  debug_level,
                  auto_bootstrap=True,
                  bootstrap_mode=False,
-                 swift_port=0):
-        logging_conf.setup(conf_path, debug_level)
+                 swift_port=0,
+                 recv_batch_size=RECV_BATCH_SIZE,
+                 max_send_rate=0,
+                 async_logging=False):
+        if async_logging:
+            async_queue_size = logging_conf.ASYNC_QUEUE_SIZE
+        else:
+            async_queue_size = 0
+        logging_conf.setup(conf_path, debug_level, async_queue_size)
         self.controller = controller.Controller(VERSION_LABEL,
                                                 my_node, conf_path,
                                                 routing_m_mod,
@@ -65,7 +80,11 @@ class Pymdht:
                                                 bootstrap_mode)
         self.reactor = minitwisted.ThreadedReactor(
             self.controller.main_loop,
-            my_node.addr[1], self.controller.on_datagram_received)
+            my_node.addr[1], self.controller.on_datagram_received,
+            on_datagrams_received_f=self.controller.on_datagrams_received,
+            recv_batch_size=recv_batch_size,
+            max_send_rate=max_send_rate,
+            zero_copy_recv=True)
 
         self.swift_tracker_thread = None
         if swift_port:
@@ -110,7 +129,7 @@ class Pymdht:
         callback needs to be ready to get peers BEFORE calling this fuction.
         
         """
-        # logger.critical("pymdht.get_peers: callback: %r" % (callback_f))
+        # logger.critical("pymdht.get_peers: callback: %r", callback_f)
         current_time = time.time()
         self.timestamps.append(current_time)
         num_sec = 0
@@ -127,11 +146,11 @@ class Pymdht:
         self.max_num_min = max(self.max_num_min, num_min)
         self.max_num_10min = max(self.max_num_10min, num_10min)
         self.timestamps = self.timestamps[-num_10min:]
-        logger.info("%d(%d) %d(%d) %d(%d) --- %r callback: %r" % (
+        logger.info("%d(%d) %d(%d) %d(%d) --- %r callback: %r",
                 num_sec, self.max_num_sec,
                 num_min, self.max_num_min,
                 num_10min, self.max_num_10min,
-                info_hash, callback_f))
+                info_hash, callback_f)
 
         use_cache = True
         print 'pymdht: use_cache ON!!'
@@ -146,6 +165,28 @@ class Pymdht:
     def print_routing_table(self):
         self.controller.print_routing_table()
 
+    def get_stats(self):
+        """
+        Return a dictionary with counters (see ThreadedReactor.get_stats,
+        logging_conf.get_stats, message_tools.NodePool.get_stats,
+        querier.Querier.get_stats, query_scheduler.QueryScheduler.get_stats,
+        cache.Cache.get_stats, cache.NegativeCache.get_stats and
+        tracker.CompactTracker.get_stats).
+        'lookups' has the number of get_peers lookups running and the
+        number of get_peers calls which joined a running lookup.
+        'negative_cache' also has the number of lookups restarted from the
+        closest nodes of a lookup which found no peers.
+        """
+        return {'reactor': self.reactor.get_stats(),
+                'logging': logging_conf.get_stats(),
+                'node_pool': message_tools.node_pool.get_stats(),
+                'querier': self.controller.get_querier_stats(),
+                'scheduler': self.controller.get_scheduler_stats(),
+                'lookups': self.controller.get_lookup_stats(),
+                'peer_cache': self.controller.get_peer_cache_stats(),
+                'negative_cache': self.controller.get_negative_cache_stats(),
+                'tracker': self.controller.get_tracker_stats()}
+
     def start_capture(self):
         self.reactor.start_capture()
 
@@ -0,0 +1,186 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+This module runs several Pymdht nodes (workers), each one in its own process,
+so that a single host can use several cores.
+
+Workers get node identifiers evenly spread across the identifier space and
+consecutive UDP ports (starting from the port given by the user). Notice that
+workers cannot share a single port (SO_REUSEPORT): the kernel would deliver
+responses to whichever worker the remote address hashes to, and not to the
+worker that sent the query.
+
+PymdhtFarm offers the same get_peers interface as Pymdht. Each lookup is
+routed to the worker whose identifier is the closest to the info_hash.
+
+"""
+
+import os
+import random
+import threading
+import multiprocessing
+import logging
+
+from identifier import Id, ID_SIZE_BITS
+from node import Node
+import pymdht
+
+logger = logging.getLogger('dht')
+
+STOP = 'stop'
+GET_PEERS = 'get_peers'
+JOIN_TIMEOUT = 5 # seconds
+
+
+def get_worker_ids(num_workers):
+    """
+    Return a list of 'num_workers' Id objects. The identifier space is split
+    into 'num_workers' equal slices and each Id is a random Id within a slice.
+
+    >>> ids = get_worker_ids(4)
+    >>> [id_.long >> (ID_SIZE_BITS - 2) for id_ in ids]
+    [0L, 1L, 2L, 3L]
+
+    """
+    slice_size = (1 << ID_SIZE_BITS) / num_workers
+    return [Id(i * slice_size + random.randint(0, slice_size - 1))
+            for i in xrange(num_workers)]
+
+def get_closest_worker(worker_ids, info_hash):
+    """Return the index of the Id (in worker_ids) closest to info_hash."""
+    closest_index = 0
+    closest_distance = worker_ids[0].distance(info_hash)
+    for i in xrange(1, len(worker_ids)):
+        distance = worker_ids[i].distance(info_hash)
+        if distance < closest_distance:
+            closest_index = i
+            closest_distance = distance
+    return closest_index
+
+
+def _run_worker(node_, conf_path, routing_m_name, lookup_m_name,
+                experimental_m_name, private_dht_name, debug_level,
+                request_queue, result_queue):
+    """Worker process' main function."""
+    routing_m_mod = __import__(routing_m_name, fromlist=[''])
+    lookup_m_mod = __import__(lookup_m_name, fromlist=[''])
+    experimental_m_mod = __import__(experimental_m_name, fromlist=[''])
+    if not os.path.isdir(conf_path):
+        os.mkdir(conf_path)
+    dht = pymdht.Pymdht(node_, conf_path,
+                        routing_m_mod, lookup_m_mod, experimental_m_mod,
+                        private_dht_name, debug_level)
+
+    def on_peers_found(lookup_key, peers, node_):
+        if node_:
+            node_addr = node_.addr
+        else:
+            node_addr = None
+        result_queue.put((lookup_key, peers, node_addr))
+
+    while True:
+        request = request_queue.get()
+        if request[0] == STOP:
+            break
+        _, lookup_key, bin_info_hash, bt_port, use_cache = request
+        dht.get_peers(lookup_key, Id(bin_info_hash), on_peers_found,
+                      bt_port, use_cache)
+    dht.stop()
+
+
+class PymdhtFarm(object):
+    """
+    Create 'num_workers' Pymdht nodes (one per process). The rest of the
+    parameters have the same meaning as in Pymdht, but the plug-ins are
+    given as module names (e.g., 'plugins.routing_nice_rtt'). Worker i uses
+    port my_addr[1] + i and keeps its files in conf_path/worker<i>.
+
+    """
+    def __init__(self, my_addr, conf_path,
+                 routing_m_name, lookup_m_name,
+                 experimental_m_name,
+                 private_dht_name,
+                 debug_level,
+                 num_workers):
+        self.worker_ids = get_worker_ids(num_workers)
+        self._lock = threading.RLock()
+        self._lookups = {} # lookup_key: (lookup_id, callback_f)
+        self._next_lookup_key = 0
+        self._result_queue = multiprocessing.Queue()
+        self._request_queues = []
+        self._workers = []
+        for i, worker_id in enumerate(self.worker_ids):
+            worker_node = Node((my_addr[0], my_addr[1] + i), worker_id,
+                               version=pymdht.VERSION_LABEL)
+            request_queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=_run_worker,
+                name='PymdhtWorker%d' % i,
+                args=(worker_node,
+                      os.path.join(conf_path, 'worker%d' % i),
+                      routing_m_name, lookup_m_name, experimental_m_name,
+                      private_dht_name, debug_level,
+                      request_queue, self._result_queue))
+            worker.daemon = True
+            worker.start()
+            self._request_queues.append(request_queue)
+            self._workers.append(worker)
+        self._dispatcher = threading.Thread(target=self._dispatch_results,
+                                            name='PymdhtFarmDispatcher')
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def get_peers(self, lookup_id, info_hash, callback_f,
+                  bt_port=0, use_cache=False):
+        """
+        Start a get peers lookup on the worker closest to info_hash. See
+        Pymdht.get_peers. The callback is called from the farm's dispatcher
+        thread. The third callback argument is the responding node's address
+        (not a Node object).
+
+        """
+        worker_index = get_closest_worker(self.worker_ids, info_hash)
+        self._lock.acquire()
+        try:
+            lookup_key = self._next_lookup_key
+            self._next_lookup_key += 1
+            self._lookups[lookup_key] = (lookup_id, callback_f)
+        finally:
+            self._lock.release()
+        self._request_queues[worker_index].put(
+            (GET_PEERS, lookup_key, info_hash.bin_id, bt_port, use_cache))
+        return worker_index
+
+    def stop(self):
+        """Stop all the workers."""
+        for request_queue in self._request_queues:
+            request_queue.put((STOP,))
+        for worker in self._workers:
+            worker.join(JOIN_TIMEOUT)
+            if worker.is_alive():
+                logger.warning('%s still alive. Terminating...', worker.name)
+                worker.terminate()
+        self._result_queue.put(None) # stop dispatcher
+        self._dispatcher.join(JOIN_TIMEOUT)
+
+    def _dispatch_results(self):
+        while True:
+            result = self._result_queue.get()
+            if result is None:
+                break
+            lookup_key, peers, node_addr = result
+            self._lock.acquire()
+            try:
+                if peers is None:
+                    # End of lookup
+                    lookup_id, callback_f = self._lookups.pop(
+                        lookup_key, (None, None))
+                else:
+                    lookup_id, callback_f = self._lookups.get(
+                        lookup_key, (None, None))
+            finally:
+                self._lock.release()
+            if callback_f and callable(callback_f):
+                callback_f(lookup_id, peers, node_addr)
@@ -18,6 +18,8 @@ with.
 
 """
 import sys
+import heapq
+import struct
 
 import logging
 
@@ -27,7 +29,111 @@ import ptime as time
 
 logger = logging.getLogger('dht')
 
-TIMEOUT_DELAY = 2
+TIMEOUT_DELAY = 2 # before any RTT sample (and maximum RTO)
+TID_SIZE = 2 # bytes
+MIN_TID_SIZE = 2
+MAX_TID_SIZE = 4
+# Little-endian counter (truncated to the TID size)
+_TID_STRUCTS = {2: struct.Struct('<H'),
+                3: struct.Struct('<I'),
+                4: struct.Struct('<I')}
+MIN_RTO = .5
+MAX_RTO = TIMEOUT_DELAY
+RTT_ALPHA = 1 / 8.
+RTT_BETA = 1 / 4.
+RTT_K = 4
+MAX_RTT_ENTRIES = 10000
+# Upper bounds for the RTO histogram in get_stats
+RTO_HISTOGRAM_BOUNDS = (.5, .75, 1, 1.5, 2)
+
+
+class RTOEstimator(object):
+    """
+    Retransmission timeout estimator (as in TCP, RFC 6298): a smoothed RTT
+    and RTT variation per destination address. Addresses without samples
+    get the timeout estimated from all samples (TIMEOUT_DELAY before the
+    first sample). Timeouts are in [MIN_RTO, MAX_RTO] and a timeout
+    doubles the address' RTO.
+
+    At most 'max_entries' addresses are kept, in two generations (see
+    message_tools.NodePool).
+
+    """
+    def __init__(self, max_entries=MAX_RTT_ENTRIES):
+        self._max_generation_size = max(1, max_entries / 2)
+        self._current = {} # {addr: [srtt, rttvar, rto]}
+        self._old = {}
+        self._global = None
+        self.rto_histogram = [0] * len(RTO_HISTOGRAM_BOUNDS)
+
+    def get_rto(self, addr):
+        entry = self._get_entry(addr) or self._global
+        if entry is None:
+            rto = TIMEOUT_DELAY
+        else:
+            rto = entry[2]
+        for i, bound in enumerate(RTO_HISTOGRAM_BOUNDS):
+            if rto <= bound:
+                self.rto_histogram[i] += 1
+                break
+        return rto
+
+    def on_response(self, addr, rtt):
+        entry = self._get_entry(addr)
+        if entry is None:
+            entry = [rtt, rtt / 2, 0]
+            if len(self._current) >= self._max_generation_size:
+                self._old = self._current
+                self._current = {}
+            self._current[addr] = entry
+        else:
+            _update(entry, rtt)
+        entry[2] = _rto(entry)
+        if self._global is None:
+            self._global = [rtt, rtt / 2, 0]
+        else:
+            _update(self._global, rtt)
+        self._global[2] = _rto(self._global)
+
+    def on_timeout(self, addr):
+        entry = self._get_entry(addr)
+        if entry is not None:
+            entry[2] = min(entry[2] * 2, MAX_RTO)
+
+    def get_stats(self):
+        """
+        Return a dictionary with:
+        - srtt/rttvar/rto: global estimates (None before the first sample)
+        - num_addrs: addresses with RTT samples
+        - rto_histogram: [(upper_bound, number of timeouts set)]
+        """
+        if self._global is None:
+            srtt = rttvar = rto = None
+        else:
+            srtt, rttvar, rto = self._global
+        return {'srtt': srtt,
+                'rttvar': rttvar,
+                'rto': rto,
+                'num_addrs': len(self._current) + len(self._old),
+                'rto_histogram': zip(RTO_HISTOGRAM_BOUNDS,
+                                     self.rto_histogram),
+                }
+
+    def _get_entry(self, addr):
+        entry = self._current.get(addr)
+        if entry is None:
+            entry = self._old.pop(addr, None)
+            if entry is not None:
+                self._current[addr] = entry
+        return entry
+
+def _update(entry, rtt):
+    srtt, rttvar, _ = entry
+    entry[1] = (1 - RTT_BETA) * rttvar + RTT_BETA * abs(srtt - rtt)
+    entry[0] = (1 - RTT_ALPHA) * srtt + RTT_ALPHA * rtt
+
+def _rto(entry):
+    return min(max(entry[0] + RTT_K * entry[1], MIN_RTO), MAX_RTO)
 
     
 class Querier(object):
@@ -35,44 +141,75 @@ class Querier(object):
     A Querier object keeps a registry of sent queries while waiting for
     responses.
 
+    Pending queries are indexed by (destination address, tid). Each query
+    gets its own timeout (see RTOEstimator), kept in a heap.
+
+    Tids are 'tid_size' bytes long (MIN_TID_SIZE to MAX_TID_SIZE), taken
+    from a counter. A tid still pending for the same address is skipped
+    (and counted as a collision).
+
     """
-    def __init__(self):#, my_id):
+    def __init__(self, tid_size=TID_SIZE):#, my_id):
 #        self.my_id = my_id
-        self._pending = {}
+        if not MIN_TID_SIZE <= tid_size <= MAX_TID_SIZE:
+            raise ValueError, 'tid_size must be in [%d, %d]' % (
+                MIN_TID_SIZE, MAX_TID_SIZE)
+        self._pending = {} # {(addr, tid): query}
+        # (timeout_ts, seq_num, (addr, tid), query)
         self._timeouts = []
-        self._tid = [0, 0]
+        self._seq_num = 0
+        self._tid_size = tid_size
+        self._pack_tid = _TID_STRUCTS[tid_size].pack
+        self._num_tids = 256 ** tid_size
+        self._tid_counter = 0
+        self.num_tid_collisions = 0
+        self.num_unmatched_responses = 0
+        # Queries sent and still waiting for a response (or timeout)
+        self.num_in_flight = 0
+        self.rto_estimator = RTOEstimator()
 
     def _next_tid(self):
-        #TODO: move to message?
-        current_tid_str = ''.join([chr(c) for c in self._tid])
-        self._tid[0] = (self._tid[0] + 1) % 256
-        if self._tid[0] == 0:
-            self._tid[1] = (self._tid[1] + 1) % 256
-        return current_tid_str # raul: yield created trouble
+        # (slicing to the whole length does not copy the string)
+        tid = self._pack_tid(self._tid_counter)[:self._tid_size]
+        self._tid_counter = (self._tid_counter + 1) % self._num_tids
+        return tid
 
     def register_queries(self, queries):
         """
         A Querier object keeps a registry of sent queries while waiting for
         responses.
 
+        Return the earliest timeout timestamp and the datagrams to be sent.
+
         """
         assert len(queries)
         datagrams = []
         current_ts = time.time()
-        timeout_ts = current_ts + TIMEOUT_DELAY
+        first_timeout_ts = None
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
         for i, query in enumerate(queries):
             msg = query
             tid = self._next_tid()
-            logger.debug('registering query %d to node: %r\n%r' % (i,
-                                                                   query.dst_node,
-                                                                   msg))
-            self._timeouts.append((timeout_ts, msg))
-            # if node is not in the dictionary, it will create an empty list
-            self._pending.setdefault(query.dst_node.addr, []).append(msg)
+            addr = query.dst_node.addr
+            while (addr, tid) in self._pending:
+                self.num_tid_collisions += 1
+                tid = self._next_tid()
+            if debug_enabled:
+                logger.debug('registering query %d to node: %r\n%r', i,
+                             query.dst_node, msg)
+            timeout_ts = current_ts + self.rto_estimator.get_rto(addr)
+            if first_timeout_ts is None or timeout_ts < first_timeout_ts:
+                first_timeout_ts = timeout_ts
+            key = (addr, tid)
+            heapq.heappush(self._timeouts,
+                           (timeout_ts, self._seq_num, key, msg))
+            self._seq_num += 1
+            self._pending[key] = msg
+            self.num_in_flight += 1
             datagrams.append(message.Datagram(
                     msg.stamp(tid),
-                    query.dst_node.addr))
-        return timeout_ts, datagrams
+                    query.dst_node.addr, True))
+        return first_timeout_ts, datagrams
 
     def get_related_query(self, response_msg):
         """
@@ -82,17 +219,17 @@ class Querier(object):
         """
         # message already sanitized by IncomingMsg
         if response_msg.type == message.RESPONSE:
-            logger.debug('response received: %s' % repr(response_msg))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('response received: %r', response_msg)
         elif response_msg.type == message.ERROR:
-            logger.warning('Error message received:\n%s\nSource: %s',
-                           `response_msg`,
-                           `response_msg.src_addr`)
+            logger.warning('Error message received:\n%r\nSource: %r',
+                           response_msg, response_msg.src_addr)
         else:
             raise Exception, 'response_msg must be response or error'
         related_query = self._find_related_query(response_msg)
         if not related_query:
-            logger.warning('No query for this response\n%s\nsource: %s' % (
-                    response_msg, response_msg.src_addr))
+            logger.warning('No query for this response\n%s\nsource: %s',
+                           response_msg, response_msg.src_addr)
         return related_query
 
     def get_timeout_queries(self):
@@ -104,38 +241,60 @@ class Querier(object):
         """
         current_ts = time.time()
         timeout_queries = []
-        while self._timeouts:
-            timeout_ts, query = self._timeouts[0]
+        timeouts = self._timeouts
+        pending = self._pending
+        while timeouts:
+            timeout_ts, _, key, query = timeouts[0]
             if current_ts < timeout_ts:
                 next_timeout_ts = timeout_ts
                 break
-            self._timeouts = self._timeouts[1:]
-            addr_query_list = self._pending[query.dst_node.addr]
-            popped_query = addr_query_list.pop(0)
-            assert query == popped_query
-            if not addr_query_list:
-                # The list is empty. Remove the whole list.
-                del self._pending[query.dst_node.addr]
+            heapq.heappop(timeouts)
+            if pending.get(key) is query:
+                # (a newer query may have reused the tid)
+                del pending[key]
             if not query.got_response:
+                self.num_in_flight -= 1
+                self.rto_estimator.on_timeout(key[0])
                 timeout_queries.append(query)
         if not self._timeouts:
             next_timeout_ts = current_ts + TIMEOUT_DELAY
         return next_timeout_ts, timeout_queries
 
+    def get_stats(self):
+        """
+        Return a dictionary with the RTO estimator's stats (see
+        RTOEstimator.get_stats) and these counters:
+        - num_pending: queries registered (until they time out)
+        - num_in_flight: queries waiting for a response (or timeout)
+        - num_tid_collisions: tids skipped because they were still pending
+        - num_unmatched_responses: responses/errors with no pending query
+        (unsolicited, late or wrong tid)
+        """
+        stats = self.rto_estimator.get_stats()
+        stats['num_pending'] = len(self._pending)
+        stats['num_in_flight'] = self.num_in_flight
+        stats['num_tid_collisions'] = self.num_tid_collisions
+        stats['num_unmatched_responses'] = self.num_unmatched_responses
+        return stats
+
     def _find_related_query(self, msg):
         addr = msg.src_addr
-        try:
-            addr_query_list = self._pending[addr]
-        except (KeyError):
-            logger.warning('No pending queries for %s', addr)
+        related_query = self._pending.get((addr, msg.tid))
+        if related_query is None:
+            self.num_unmatched_responses += 1
+            logger.warning('No pending query for %s (tid %r)', addr, msg.tid)
             return # Ignore response
-        for related_query in addr_query_list:
-            if related_query.match_response(msg):
+        got_response = related_query.got_response
+        if related_query.match_response(msg):
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(
-                    'response node: %s, related query: (%s), delay %f s. %r' % (
-                        `addr`,
-                        `related_query.query`,
-                        time.time() - related_query.sending_ts,
-                        related_query.lookup_obj))
-                # Do not delete this query (the timeout will delete it)
-                return related_query
+                    'response node: %r, related query: (%r), delay %f s.'
+                    ' %r', addr, related_query.query,
+                    time.time() - related_query.sending_ts,
+                    related_query.lookup_obj)
+            if not got_response:
+                # (the first one, duplicates are not RTT samples)
+                self.num_in_flight -= 1
+                self.rto_estimator.on_response(addr, related_query.rtt)
+            # Do not delete this query (the timeout will delete it)
+            return related_query
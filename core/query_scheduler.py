@@ -0,0 +1,139 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+The 'query_scheduler' module sits between the plug-ins (which decide which
+queries to send) and the querier (which registers the queries being sent).
+
+Each lookup decides its own parallelism. With many concurrent lookups, the
+node would send more queries than its uplink (and the remote nodes) can
+handle. The scheduler puts a global cap on the number of queries in flight
+(sent, waiting for a response or timeout). The queries beyond the cap wait
+in a queue and are sent as queries in flight get responses or time out:
+- by priority: user lookups (and their announcements) first, then
+  maintenance lookups and, last, routing maintenance (pings, etc)
+- within a priority, lookups take turns (round robin): a lookup with many
+  queries waiting does not delay the others.
+
+Lookup queries are never dropped (lookups count the queries they have sent
+in order to know when they are done). Routing maintenance queries are
+dropped when there are too many of them waiting.
+
+"""
+
+import weakref
+from collections import deque
+
+import logging
+
+import message
+
+logger = logging.getLogger('dht')
+
+MAX_IN_FLIGHT = 512
+MAX_QUEUED_MAINTENANCE = 1000
+
+# Priorities (lower goes first)
+LOOKUP = 0
+MAINTENANCE_LOOKUP = 1
+MAINTENANCE = 2
+PRIORITIES = (LOOKUP, MAINTENANCE_LOOKUP, MAINTENANCE)
+PRIORITY_NAMES = ('lookup', 'maintenance_lookup', 'maintenance')
+
+
+class QueryScheduler(object):
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        # Per priority: {lookup_obj: deque of queries} and the lookups with
+        # queued queries, in turn order
+        self._queues = [{} for _ in PRIORITIES]
+        self._turns = [deque() for _ in PRIORITIES]
+        self._num_queued = [0] * len(PRIORITIES)
+        self._maintenance_lookups = weakref.WeakKeyDictionary()
+        self.num_queued = 0 # queries which had to wait
+        self.num_dropped = 0
+        self.max_queue_len = 0
+
+    def add_maintenance_lookup(self, lookup_obj):
+        """Queries from this lookup get MAINTENANCE_LOOKUP priority."""
+        self._maintenance_lookups[lookup_obj] = True
+
+    def schedule(self, queries, num_in_flight):
+        """
+        Queue 'queries' and return the queries (these or previously queued
+        ones) to be sent now, given 'num_in_flight' queries in flight.
+
+        """
+        if (not any(self._num_queued) and
+            num_in_flight + len(queries) <= self.max_in_flight):
+            # Fast path: nothing waiting and room for all of them
+            return queries
+        for query in queries:
+            self._add(query)
+        queries_to_send = []
+        room = self.max_in_flight - num_in_flight
+        for priority in PRIORITIES:
+            if room <= 0:
+                break
+            queues = self._queues[priority]
+            turns = self._turns[priority]
+            while turns and room > 0:
+                lookup_obj = turns.popleft()
+                queue = queues[lookup_obj]
+                queries_to_send.append(queue.popleft())
+                self._num_queued[priority] -= 1
+                room -= 1
+                if queue:
+                    turns.append(lookup_obj)
+                else:
+                    del queues[lookup_obj]
+        queue_len = sum(self._num_queued)
+        if queue_len > self.max_queue_len:
+            self.max_queue_len = queue_len
+        return queries_to_send
+
+    def get_stats(self):
+        """
+        Return a dictionary with:
+        - max_in_flight: the cap on queries in flight
+        - queue_len: queries waiting, per priority name
+        - queued_lookups: lookups with queries waiting, per priority name
+        - num_queued: queries which had to wait (since start)
+        - max_queue_len: longest queue (all priorities)
+        - num_dropped: maintenance queries dropped (queue full)
+        """
+        return {'max_in_flight': self.max_in_flight,
+                'queue_len': dict(zip(PRIORITY_NAMES, self._num_queued)),
+                'queued_lookups': dict(zip(
+                    PRIORITY_NAMES, [len(q) for q in self._queues])),
+                'num_queued': self.num_queued,
+                'max_queue_len': self.max_queue_len,
+                'num_dropped': self.num_dropped,
+                }
+
+    def _add(self, query):
+        lookup_obj = query.lookup_obj
+        if lookup_obj is None:
+            if query.query == message.ANNOUNCE_PEER:
+                # Last step of a user lookup
+                priority = LOOKUP
+            else:
+                priority = MAINTENANCE
+                if self._num_queued[priority] >= MAX_QUEUED_MAINTENANCE:
+                    self.num_dropped += 1
+                    logger.debug('Maintenance query dropped: %r', query)
+                    return
+        elif lookup_obj in self._maintenance_lookups:
+            priority = MAINTENANCE_LOOKUP
+        else:
+            priority = LOOKUP
+        queues = self._queues[priority]
+        queue = queues.get(lookup_obj)
+        if queue is None:
+            queue = queues[lookup_obj] = deque()
+            self._turns[priority].append(lookup_obj)
+        queue.append(query)
+        self._num_queued[priority] += 1
+        self.num_queued += 1
@@ -21,7 +21,7 @@ class Responder(object):
         self._routing_m = routing_m
         self.msg_f = msg_f
         self.bootstrap_mode = bootstrap_mode
-        self._tracker = tracker.Tracker()
+        self._tracker = tracker.CompactTracker()
         self._token_m = token_manager.TokenManager()
 
     def get_response(self, msg):
@@ -30,25 +30,24 @@ class Responder(object):
                 return
             return self.msg_f.outgoing_ping_response(msg.src_node)
         elif msg.query == message.FIND_NODE:
-            log_distance = msg.target.distance(self._my_id).log
+            log_distance = msg.target.log_distance(self._my_id)
             rnodes = self._routing_m.get_closest_rnodes(log_distance,
-                                                        NUM_NODES, False)
-            #TODO: return the closest rnodes to the target instead of the 8
-            #first in the bucket.
+                                                        NUM_NODES, False,
+                                                        msg.target)
             return self.msg_f.outgoing_find_node_response(
                 msg.src_node, rnodes)
         elif msg.query == message.GET_PEERS:
             token = self._token_m.get(msg.src_node.ip)
-            log_distance = msg.info_hash.distance(self._my_id).log
+            log_distance = msg.info_hash.log_distance(self._my_id)
             rnodes = self._routing_m.get_closest_rnodes(log_distance,
-                                                        NUM_NODES, False)
-            #TODO: return the closest rnodes to the target instead of the 8
-            #first in the bucket.
-            peers = self._tracker.get(msg.info_hash)
-            if peers:
-                logger.debug('RESPONDING with PEERS:\n%r' % peers)
+                                                        NUM_NODES, False,
+                                                        msg.info_hash)
+            # Peers are stored in compact form, ready to be sent
+            c_peers = self._tracker.get_compact(msg.info_hash)
+            if c_peers:
+                logger.debug('RESPONDING with PEERS:\n%r', c_peers)
             return self.msg_f.outgoing_get_peers_response(
-                msg.src_node, token, nodes=rnodes, peers=peers)
+                msg.src_node, token, nodes=rnodes, c_peers=c_peers)
         elif msg.query == message.ANNOUNCE_PEER:
             if msg.token and self._token_m.check(msg.src_node.ip, msg.token):
                 peer_addr = (msg.src_addr[0], msg.bt_port)
@@ -58,5 +57,5 @@ class Responder(object):
                 logger.warning('BAD TOKEN!')
                 return
         else:
-            logger.debug('Invalid QUERY: %r' % (msg.query))
+            logger.debug('Invalid QUERY: %r', msg.query)
             #TODO: maybe send an error back?
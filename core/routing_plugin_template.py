@@ -80,7 +80,7 @@ class RoutingManager(object):
 
         This method will be called for every response received.
         """
-        log_distance = self.my_node.distance(node_).log
+        log_distance = self.my_node.log_distance(node_)
         sbucket = self.table.get_sbucket(log_distance)
         rnode = node_.get_rnode(log_distance)
         rnode.rtt = rtt
@@ -103,15 +103,17 @@ class RoutingManager(object):
 
         This method will be called for every timeout triggered.
         """
-        log_distance = self.my_node.distance(node_).log
+        log_distance = self.my_node.log_distance(node_)
         sbucket = self.table.get_sbucket(log_distance)
         sbucket.main.remove(node_)
         queries_to_send = []
         return queries_to_send
             
-    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself):
+    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself,
+                           target=None):
         return self.table.get_closest_rnodes(log_distance,
-                                             num_nodes, exclude_myself)
+                                             num_nodes, exclude_myself,
+                                             target)
 
     def get_main_rnodes(self):
         return self.table.get_main_rnodes()
@@ -4,10 +4,29 @@
 
 import ptime as time
 import logging
+import heapq
+import struct
 from message import version_repr
+from identifier import Id
+from node import Node
+import message_tools
 
 logger = logging.getLogger('dht')
 
+# Snapshot: header + one entry per rnode (main and replacement buckets)
+SNAPSHOT_MAGIC = 'PMRT'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAX_AGE = 24 * 3600 # older snapshots are not loaded
+# magic, version, snapshot_ts, my_id, num_entries
+_SNAPSHOT_HEADER = struct.Struct('!4sBd20sI')
+# id, compact_addr, in_main, rtt, creation_ts, last_seen,
+# num_queries, num_responses, num_timeouts
+_SNAPSHOT_ENTRY = struct.Struct('!20s6s?fddIII')
+
+
+class SnapshotError(Exception):
+    pass
+
 
 class SuperBucket(object):
     def __init__(self, index, max_nodes, ips_in_main, 
@@ -24,28 +43,32 @@ class Bucket(object):
         self.max_rnodes = max_rnodes
         self.ips_in_table = ips_in_table
         self.rnodes = []
+        # Index {(addr, bin_id): rnode} kept in sync by add/remove. Do not
+        # add/remove rnodes to/from self.rnodes directly (sorting is OK).
+        self._rnodes_by_key = {}
         self.last_maintenance_ts = time.time()
         self.last_changed_ts = 0
 
     def get_rnode(self, node_):
-        i = self._find(node_)
-        if i >= 0:
-            return self.rnodes[i]
         # return None when node is not found
+        return self._rnodes_by_key.get(_node_key(node_))
         
     def add(self, rnode):
         assert len(self.rnodes) < self.max_rnodes
         rnode.bucket_insertion_ts = time.time()
         self.rnodes.append(rnode)
+        self._rnodes_by_key[_node_key(rnode)] = rnode
         if self.ips_in_table is not None:
             self.ips_in_table.add(rnode.ip)
         #self.last_changed_ts = time.time()
 
     def remove(self, node_):
-        i = self._find(node_)
-        assert 0 <= i < len(self.rnodes)
-        assert self.rnodes[i].ip == node_.ip
-        del self.rnodes[i]
+        rnode = self._rnodes_by_key.pop(_node_key(node_))
+        # Compare identities (list.remove would call RoutingNode.__eq__)
+        for i, bucket_rnode in enumerate(self.rnodes):
+            if bucket_rnode is rnode:
+                del self.rnodes[i]
+                break
         if self.ips_in_table is not None:
             self.ips_in_table.remove(node_.ip)
         
@@ -109,14 +132,21 @@ class Bucket(object):
 #                 highest_rtt_rnode = rnode
 #         return highest_rtt_rnode
     
-    def _find(self, node_):
-        for i, rnode in enumerate(self.rnodes):
-            if rnode == node_:
-                return i
-        return -1 # not found
+
+def _node_key(node_):
+    # Same equality as Node.__eq__ (nodes without id are equal if their
+    # addresses are)
+    if node_.id is None:
+        return node_.addr, None
+    return node_.addr, node_.id.bin_id
+
+def _sort_by_distance(rnodes, target_long):
+    """Return a list with rnodes sorted by XOR distance to target_long."""
+    decorated = [(rnode.id.long ^ target_long, rnode) for rnode in rnodes]
+    decorated.sort()
+    return [rnode for _, rnode in decorated]
 
 
-    
 NUM_SBUCKETS = 160 # log_distance returns a number in range [-1,159]
 NUM_NODES = 8
 class RoutingTable(object):
@@ -145,7 +175,22 @@ class RoutingTable(object):
             self.sbuckets[index] = sbucket
         return sbucket
         
-    def get_closest_rnodes(self, log_distance, max_rnodes, exclude_myself):
+    def get_closest_rnodes(self, log_distance, max_rnodes, exclude_myself,
+                           target=None):
+        """
+        Return up to max_rnodes rnodes (in main buckets) close to the
+        target, which is at log_distance from my node. Include my node unless
+        exclude_myself is True.
+
+        When target (an Id) is given, the rnodes returned are the
+        max_rnodes closest to the target (by XOR distance), sorted by
+        distance. Otherwise, nodes are picked bucket by bucket, in the order
+        they are in the buckets.
+
+        """
+        if target is not None and max_rnodes > 0:
+            return self._get_xor_closest_rnodes(target, log_distance,
+                                                max_rnodes, exclude_myself)
         result = []
         index = log_distance
         for i in range(index, 0, -1):
@@ -168,8 +213,62 @@ class RoutingTable(object):
                 break
         return result 
 
+    def _get_xor_closest_rnodes(self, target, log_distance, max_rnodes,
+                                exclude_myself):
+        # Let L be log_distance (target to my node). The distance between
+        # the target and a node in bucket i is:
+        # - in [0, 2^L) when i == L
+        # - in [2^L, 2^(L+1)) when i < L (my node is there too)
+        # - in [2^i, 2^(i+1)) when i > L
+        target_long = target.long
+        my_distance = target_long ^ self.my_node.id.long
+        result = []
+        if log_distance < 0:
+            # I am the target
+            if not exclude_myself:
+                result.append(self.my_node)
+        elif self.sbuckets[log_distance]:
+            result = _sort_by_distance(
+                self.sbuckets[log_distance].main.rnodes,
+                target_long)[:max_rnodes]
+        num_missing = max_rnodes - len(result)
+        if num_missing > 0 and log_distance >= 0:
+            # Buckets below L (closest first). The bits above i in the
+            # distance to a node in bucket i are the ones in my_distance.
+            # That gives a lower bound which grows as i decreases: stop as
+            # soon as the bound is not better than the worst rnode in the
+            # heap.
+            heap = [] # (-distance, rnode) max-heap of the closest rnodes
+            for sbucket in reversed(filter(None,
+                                           self.sbuckets[:log_distance])):
+                if len(heap) == num_missing:
+                    shift = sbucket.index + 1
+                    if -heap[0][0] <= my_distance >> shift << shift:
+                        break
+                for rnode in sbucket.main.rnodes:
+                    distance = rnode.id.long ^ target_long
+                    if len(heap) < num_missing:
+                        heapq.heappush(heap, (-distance, rnode))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, rnode))
+            if not exclude_myself:
+                if len(heap) < num_missing:
+                    heapq.heappush(heap, (-my_distance, self.my_node))
+                elif my_distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-my_distance, self.my_node))
+            heap.sort(reverse=True)
+            result.extend([rnode for _, rnode in heap])
+        if len(result) < max_rnodes:
+            for sbucket in filter(None, self.sbuckets[log_distance + 1:]):
+                result.extend(_sort_by_distance(sbucket.main.rnodes,
+                                                target_long)[
+                        :max_rnodes - len(result)])
+                if len(result) == max_rnodes:
+                    break
+        return result
+
     def find_next_bucket_with_room_index(self, node_=None, log_distance=None):
-        index = log_distance or node_.distance(self.my_node).log
+        index = log_distance or node_.log_distance(self.my_node)
         for i in range(index + 1, NUM_SBUCKETS):
             # exclude node's bucket
             sbucket = self.sbuckets[i]
@@ -185,6 +284,86 @@ class RoutingTable(object):
                 rnodes.extend(sbucket.main.rnodes)
         return rnodes
 
+    def get_snapshot(self):
+        """
+        Return a binary snapshot of the rnodes in main and replacement
+        buckets (see load_snapshot).
+
+        """
+        entries = []
+        for sbucket in filter(None, self.sbuckets):
+            for bucket, in_main in ((sbucket.main, True),
+                                    (sbucket.replacement, False)):
+                for rnode in bucket.rnodes:
+                    entries.append(_SNAPSHOT_ENTRY.pack(
+                            rnode.id.bin_id, rnode.compact_addr, in_main,
+                            rnode.rtt, rnode.creation_ts, rnode.last_seen,
+                            rnode.num_queries, rnode.num_responses,
+                            rnode.num_timeouts))
+        header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                       time.time(), self.my_node.id.bin_id,
+                                       len(entries))
+        return header + ''.join(entries)
+
+    def load_snapshot(self, data):
+        """
+        Add the rnodes in the snapshot (see get_snapshot) to the table and
+        return the number of rnodes added to main buckets. Raise
+        SnapshotError when the snapshot is invalid or too old.
+
+        Rnodes are placed according to my node's id (which may be different
+        from the one in the snapshot) and only where there is room. They
+        keep their last_seen, which makes them stale rnodes to be refreshed
+        by the routing manager's maintenance (they are in quarantine).
+
+        """
+        if len(data) < _SNAPSHOT_HEADER.size:
+            raise SnapshotError, 'snapshot too short'
+        (magic, version, snapshot_ts, _,
+         num_entries) = _SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError, 'invalid snapshot header'
+        if len(data) != (_SNAPSHOT_HEADER.size +
+                         num_entries * _SNAPSHOT_ENTRY.size):
+            raise SnapshotError, 'invalid snapshot size'
+        if time.time() - snapshot_ts > SNAPSHOT_MAX_AGE:
+            raise SnapshotError, 'snapshot too old'
+        num_main_rnodes = 0
+        for offset in xrange(_SNAPSHOT_HEADER.size, len(data),
+                             _SNAPSHOT_ENTRY.size):
+            (bin_id, c_addr, in_main, rtt, creation_ts, last_seen,
+             num_queries, num_responses,
+             num_timeouts) = _SNAPSHOT_ENTRY.unpack_from(data, offset)
+            try:
+                addr = message_tools.uncompact_addr(c_addr)
+            except message_tools.AddrError:
+                continue
+            node_ = Node(addr, Id(bin_id))
+            log_distance = self.my_node.log_distance(node_)
+            if log_distance < 0:
+                continue # that's me
+            sbucket = self.get_sbucket(log_distance)
+            if (in_main and sbucket.main.there_is_room() and
+                node_.ip not in sbucket.main.ips_in_table):
+                bucket = sbucket.main
+                num_main_rnodes += 1
+            elif (sbucket.replacement.there_is_room() and
+                  not sbucket.replacement.get_rnode(node_) and
+                  not sbucket.main.get_rnode(node_)):
+                bucket = sbucket.replacement
+            else:
+                continue
+            rnode = node_.get_rnode(log_distance)
+            rnode.rtt = rtt
+            rnode.creation_ts = creation_ts
+            rnode.last_seen = last_seen
+            rnode.num_queries = num_queries
+            rnode.num_responses = num_responses
+            rnode.num_timeouts = num_timeouts
+            bucket.add(rnode)
+        self.num_rnodes += num_main_rnodes
+        return num_main_rnodes
+
     def print_stats(self):
         num_nodes = 0
         for i, sbucket in enumerate(self.sbuckets):
@@ -216,7 +395,7 @@ class RoutingTable(object):
             else:
                 rtt = rnode.rtt
             print data_format % (
-                self.my_node.id.distance(rnode.id).log,
+                self.my_node.id.log_distance(rnode.id),
                 rnode.id, version_repr(rnode.version),
                 rnode.addr[0], rnode.addr[1],
                 rtt * 1000,
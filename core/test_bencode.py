@@ -27,6 +27,11 @@ test_data = [
     (000, 'i0e'),
     (1234567890, 'i1234567890e'),
     (-1, 'i-1e'),
+    (10**30, 'i1' + '0' * 30 + 'e'), # 32 characters (with the 'e')
+    (10**31, 'i1' + '0' * 31 + 'e'),
+    (-10**31, 'i-1' + '0' * 31 + 'e'),
+    (10**100, 'i1' + '0' * 100 + 'e'),
+    (['A' * 40, 10**40], 'l40:' + 'A' * 40 + 'i1' + '0' * 40 + 'ee'),
     # lists
     ([], 'le'),
     ([[[[]]]], 'lllleeee'), # maximum recursivity depht
@@ -78,6 +83,7 @@ test_data_decode_error = [
     ('d', DecodeError), # open dict (no close)
     ('l', DecodeError), # open list (no close)
     ('i', DecodeError), # open int (no close)
+    ('i' + '1' * 40, DecodeError), # long open int (no close)
     ('2', DecodeError), # open srt (no close)
     ('2:', DecodeError), # open srt (no close)
     ('2:a', DecodeError), # open srt (no close)
@@ -159,6 +165,23 @@ class TestDecode(unittest.TestCase):
                 debug_print(i, bencoded, expected, 'NO EXCEPTION RAISED')
                 assert False
 
+    def test_decode_views(self):
+        # Receive buffers are larger than the datagram they hold
+        for i, (expected, bencoded) in enumerate(test_data):
+            recv_buffer = bytearray(bencoded + 'GARBAGE')
+            views = (buffer(recv_buffer, 0, len(bencoded)),
+                     recv_buffer[:len(bencoded)],
+                     memoryview(recv_buffer)[:len(bencoded)])
+            for view in views:
+                data = decode(view)
+                if data != expected:
+                    debug_print(i, bencoded, expected, data)
+                    assert False
+        for i, (bencoded, expected) in enumerate(test_data_decode_error):
+            recv_buffer = bytearray(bencoded + 'GARBAGE')
+            self.assertRaises(expected, decode,
+                              buffer(recv_buffer, 0, len(bencoded)))
+
     def test_decode_unexpected_error(self):
         self.assertRaises(DecodeError, decode, 'llee', 'z')
 
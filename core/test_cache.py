@@ -0,0 +1,121 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+import unittest
+
+import logging, logging_conf
+
+import ptime as time
+import test_const as tc
+import cache
+from cache import Cache
+
+logging_conf.testing_setup(__name__)
+logger = logging.getLogger('dht')
+
+VALIDITY_TIME = 10
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        time.mock_mode()
+        self.cache = Cache(VALIDITY_TIME, max_entries=3, max_peers=10)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get(tc.INFO_HASH), None)
+        self.cache.put(tc.INFO_HASH, tc.PEERS[:2])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.PEERS[:2])
+        # Duplicated peers are ignored
+        self.cache.put(tc.INFO_HASH, tc.PEERS[1:3])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.PEERS[:3])
+        # Callers get a copy
+        self.cache.get(tc.INFO_HASH).append(tc.PEERS[5])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.PEERS[:3])
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['num_peers'], 3)
+
+    def test_expiration(self):
+        self.cache.put(tc.INFO_HASH, tc.PEERS[:2])
+        time.sleep(VALIDITY_TIME / 2.)
+        # Adding peers does not extend the validity
+        self.cache.put(tc.INFO_HASH, tc.PEERS[2:4])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.PEERS[:4])
+        time.sleep(VALIDITY_TIME / 2. + .1)
+        self.assertEqual(self.cache.get(tc.INFO_HASH), None)
+        self.assertEqual(self.cache.get_stats()['expirations'], 1)
+        self.assertEqual(self.cache.get_stats()['num_peers'], 0)
+        # A fresh cached lookup
+        self.cache.put(tc.INFO_HASH, tc.PEERS[4:5])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.PEERS[4:5])
+
+    def test_lru_eviction(self):
+        info_hashes = [n.id for n in tc.NODES[:4]]
+        for info_hash in info_hashes[:3]:
+            self.cache.put(info_hash, tc.PEERS[:1])
+        # info_hashes[0] is used: info_hashes[1] is now the LRU
+        self.assertEqual(self.cache.get(info_hashes[0]), tc.PEERS[:1])
+        self.cache.put(info_hashes[3], tc.PEERS[:1])
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get(info_hashes[1]), None)
+        for info_hash in info_hashes[:1] + info_hashes[2:]:
+            self.assertEqual(self.cache.get(info_hash), tc.PEERS[:1])
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+
+    def test_max_peers(self):
+        info_hashes = [n.id for n in tc.NODES[:2]]
+        self.cache.put(info_hashes[0], tc.PEERS[:6])
+        self.cache.put(info_hashes[1], tc.PEERS[:6])
+        # Over max_peers: the LRU lookup is evicted
+        self.assertEqual(self.cache.get(info_hashes[0]), None)
+        self.assertEqual(self.cache.get(info_hashes[1]), tc.PEERS[:6])
+        self.assertEqual(self.cache.get_stats()['num_peers'], 6)
+        # Peers per cached lookup are bounded too
+        cached_lookup = cache.CachedLookup(tc.INFO_HASH)
+        self.assertEqual(cached_lookup.add_peers(tc.PEERS, 3), 3)
+        self.assertEqual(cached_lookup.peers, tc.PEERS[:3])
+
+    def tearDown(self):
+        time.normal_mode()
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        time.mock_mode()
+        self.cache = cache.NegativeCache(VALIDITY_TIME, max_entries=2)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get(tc.INFO_HASH), None)
+        self.cache.put(tc.INFO_HASH, tc.NODES[:2])
+        self.assertEqual(self.cache.get(tc.INFO_HASH), tc.NODES[:2])
+        # Peers found: the negative result is forgotten
+        self.cache.remove(tc.INFO_HASH)
+        self.assertEqual(self.cache.get(tc.INFO_HASH), None)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 0)
+
+    def test_expiration_and_eviction(self):
+        info_hashes = [n.id for n in tc.NODES[:3]]
+        self.cache.put(info_hashes[0], tc.NODES[:1])
+        time.sleep(VALIDITY_TIME + .1)
+        self.assertEqual(self.cache.get(info_hashes[0]), None)
+        self.assertEqual(self.cache.get_stats()['expirations'], 1)
+        for info_hash in info_hashes:
+            self.cache.put(info_hash, tc.NODES[:1])
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get(info_hashes[0]), None)
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+
+    def tearDown(self):
+        time.normal_mode()
+
+
+if __name__ == '__main__':
+    unittest.main()
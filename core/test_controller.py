@@ -2,6 +2,7 @@
 # Released under GNU LGPL 2.1
 # See LICENSE.txt for more information
 
+import os
 import logging
 
 import unittest
@@ -138,6 +139,136 @@ class TestController(unittest.TestCase):
         #FIXME: self.assertEqual(len(lookup_result), 1) # the node is tracking this info_hash
         #FIXME: self.assertEqual(lookup_result[0][0], tc.CLIENT_ADDR)
 
+    def test_coalesced_get_peers(self):
+        info_hash = identifier.Id('info_hash info_hash ')
+        self.controller._tracker.put(info_hash, tc.CLIENT_ADDR)
+        results = {}
+        def callback_f(lookup_id, peers, node_):
+            results.setdefault(lookup_id, []).append(peers)
+        self.controller.get_peers(1, info_hash, callback_f, 0, False)
+        self.assertEqual(results, {1: [[tc.CLIENT_ADDR]]})
+        running_lookup = self.controller._running_lookups[info_hash]
+        # Same info_hash: no new lookup. Peers found so far are reported.
+        self.assertEqual(
+            self.controller.get_peers(2, info_hash, callback_f, 0, False), [])
+        self.assertEqual(self.controller.get_lookup_stats(),
+                         {'num_running': 1, 'num_coalesced': 1})
+        self.assertEqual(results[2], [[tc.CLIENT_ADDR]])
+        # A lookup announcing to a different port cannot join
+        self.controller.get_peers(3, info_hash, callback_f, 1234, False)
+        self.assertEqual(self.controller.num_coalesced_lookups, 1)
+        assert self.controller._running_lookups[info_hash] is not \
+            running_lookup
+        # New peers and the end of the lookup go to both callers
+        running_lookup.on_peers(1, [tc.SERVER_ADDR], tc.SERVER_NODE)
+        running_lookup.on_peers(1, None, None)
+        for lookup_id in (1, 2):
+            self.assertEqual(results[lookup_id],
+                             [[tc.CLIENT_ADDR], [tc.SERVER_ADDR], None])
+        # The lookup with port 1234 is still running
+        assert info_hash in self.controller._running_lookups
+        # The running lookup is too old to join
+        time.sleep(controller.MAX_COALESCING_PERIOD)
+        self.controller.get_peers(4, info_hash, callback_f, 0, False)
+        self.assertEqual(self.controller.num_coalesced_lookups, 1)
+
+    def test_purge_running_lookups(self):
+        info_hashes = [identifier.Id(c * 20) for c in 'ab']
+        def get_peers(*args):
+            lookup_obj = lookup_m_mod.GetPeersLookup(
+                self.controller.msg_f, self.my_id, *args)
+            lookup_obj.start = lambda rnodes, bootstrapper: []
+            return lookup_obj
+        self.controller._lookup_m.get_peers = get_peers
+        # No routing table maintenance (the template's is not complete)
+        self.controller._next_maintenance_ts = time.time() + 1000
+        self.controller.get_peers(1, info_hashes[0], None, 0, False)
+        self.controller.get_peers(2, info_hashes[1], None, 0, False)
+        time.sleep(controller.MAX_COALESCING_PERIOD / 2.)
+        # Replaced by a lookup announcing to another port (goes last)
+        self.controller.get_peers(3, info_hashes[0], None, 1234, False)
+        time.sleep(controller.MAX_COALESCING_PERIOD / 2. + .1)
+        # The lookups never end but the old ones are no longer kept
+        self.controller.main_loop()
+        self.assertEqual(self.controller._running_lookups.keys(),
+                         info_hashes[:1])
+        self.assertEqual(self.controller._running_lookups[
+                info_hashes[0]].bt_port, 1234)
+        time.sleep(controller.MAX_COALESCING_PERIOD / 2.)
+        self.controller.main_loop()
+        self.assertEqual(self.controller.get_lookup_stats()['num_running'], 0)
+
+    def test_main_loop_on_time_for_timeouts(self):
+        self.controller.main_loop()
+        # Nodes respond fast: MIN_RTO
+        for node_ in tc.NODES[:2]:
+            self.controller._routing_m.on_response_received(node_, .01, [])
+            self.controller._querier.rto_estimator.on_response(node_.addr,
+                                                               .01)
+        self.controller._register_queries(
+            [self.controller.msg_f.outgoing_ping_query(tc.NODES[0])])
+        time.sleep(.3)
+        self.controller._register_queries(
+            [self.controller.msg_f.outgoing_ping_query(tc.NODES[1])])
+        second_timeout_ts = time.time() + querier.MIN_RTO
+        time.sleep(querier.MIN_RTO - .3)
+        # The first query times out. main_loop is to be called for the
+        # second one's timeout (before 1 second).
+        ts, _ = self.controller.main_loop()
+        assert_almost_equal(ts, second_timeout_ts)
+        self.assertEqual(self.controller._querier.num_in_flight, 2)
+        time.sleep(ts - time.time())
+        self.controller.main_loop()
+        self.assertEqual(self.controller._querier.num_in_flight, 1)
+
+    def test_negative_cache(self):
+        info_hash = identifier.Id('info_hash info_hash ')
+        results = {}
+        def callback_f(lookup_id, peers, node_):
+            results.setdefault(lookup_id, []).append(peers)
+        bootstrap_rnodes = []
+        def get_peers(*args):
+            lookup_obj = lookup_m_mod.GetPeersLookup(
+                self.controller.msg_f, self.my_id, *args)
+            lookup_obj.get_closest_responded_nodes = lambda: tc.NODES[:2]
+            def start(rnodes, bootstrapper):
+                bootstrap_rnodes.append(rnodes)
+                return []
+            lookup_obj.start = start
+            return lookup_obj
+        self.controller._lookup_m.get_peers = get_peers
+        self.controller.get_peers(1, info_hash, callback_f, 0, False)
+        # The lookup ends without peers
+        self.controller._running_lookups[info_hash].on_peers(1, None, None)
+        self.assertEqual(results, {1: [None]})
+        # Cached: the lookup is done right away
+        self.assertEqual(
+            self.controller.get_peers(2, info_hash, callback_f, 0, True), [])
+        self.assertEqual(results[2], [None])
+        assert info_hash not in self.controller._running_lookups
+        # Announcing: restart from the closest nodes (the announce goes out)
+        self.controller.get_peers(5, info_hash, callback_f, 1234, True)
+        self.assertEqual(bootstrap_rnodes[-1], tc.NODES[:2])
+        assert 5 not in results
+        self.controller._running_lookups[info_hash].on_peers(5, None, None)
+        self.assertEqual(results[5], [None])
+        # Without cache: restart from the closest nodes
+        self.controller.get_peers(3, info_hash, callback_f, 0, False)
+        self.assertEqual(bootstrap_rnodes[-1], tc.NODES[:2])
+        self.assertEqual(len(bootstrap_rnodes), 3)
+        stats = self.controller.get_negative_cache_stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['num_restarted_lookups'], 2)
+        # Peers found: no longer in the negative cache
+        self.controller._running_lookups[info_hash].on_peers(
+            3, [tc.SERVER_ADDR], tc.SERVER_NODE)
+        self.controller._cache_peers(info_hash, [tc.SERVER_ADDR])
+        self.controller._running_lookups[info_hash].on_peers(3, None, None)
+        self.assertEqual(results[3], [[tc.SERVER_ADDR], None])
+        self.controller.get_peers(4, info_hash, callback_f, 0, True)
+        self.assertEqual(results[4], [[tc.SERVER_ADDR], None])
+        self.assertEqual(self.controller.get_negative_cache_stats()['size'], 0)
+
     def test_retry_get_peers(self):
         ts, datagrams = self.controller.main_loop()
         ping_timeout_ts =  ts
@@ -171,6 +302,18 @@ class TestController(unittest.TestCase):
             message.Datagram('aa', tc.CLIENT_ADDR))
         assert not datagrams
 
+    def test_batch_datagrams_received(self):
+        # A ping from SERVER_NODE and a broken datagram
+        ping_data = self.servers_msg_f.outgoing_ping_query(
+            tc.CLIENT_NODE).stamp(tc.TID)
+        ts, datagrams = self.controller.on_datagrams_received(
+            [message.Datagram(ping_data, tc.SERVER_ADDR),
+             message.Datagram('aa', tc.SERVER_ADDR),
+             message.Datagram(ping_data, tc.SERVER2_ADDR)])
+        # Both pings are responded, in order
+        self.assertEqual([d.addr for d in datagrams],
+                         [tc.SERVER_ADDR, tc.SERVER2_ADDR])
+
     def test_query_received(self):
         #TODO
         pass
@@ -182,6 +325,29 @@ class TestController(unittest.TestCase):
     def test_complete(self):
         self.controller.print_routing_table_stats()
 
+    def test_warm_restart(self):
+        table = self.controller._routing_m.table
+        for node_ in tc.NODES:
+            log_distance = self.controller._my_node.log_distance(node_)
+            table.get_sbucket(log_distance).main.add(
+                node_.get_rnode(log_distance))
+            table.num_rnodes += 1
+        self.controller.on_stop()
+        try:
+            controller2 = controller.Controller(VERSION_LABEL,
+                                                tc.CLIENT_NODE,
+                                                'test_logs',
+                                                routing_m_mod,
+                                                lookup_m_mod,
+                                                exp_m_mod,
+                                                None, False)
+        finally:
+            os.remove(self.controller._routing_table_filename)
+        key = lambda n: n.id
+        self.assertEqual(
+            sorted(controller2._routing_m.get_main_rnodes(), key=key),
+            sorted(tc.NODES, key=key))
+
     def _old(self):
         # controller.start() starts reactor (we don't want to use reactor in
         # tests), sets _running, and calls main_loop
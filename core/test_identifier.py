@@ -70,6 +70,36 @@ class TestId(unittest.TestCase):
         assert id2.distance(id1).bin_id == dist1_2.bin_id 
         #assert id1.distance(id1).bin_id == ZeroId().bin_id
 
+    def test_forms(self):
+        for id_ in (Id(BIN_ID1), Id(HEX_ID1), Id(long(HEX_ID1, 16)),
+                    Id(BIN_ID2).distance(Id(DIST1_2))):
+            self.assertEqual(id_.long, long(HEX_ID1, 16))
+            self.assertEqual(id_.bin_id, BIN_ID1)
+            self.assertEqual(id_.hex.lower(), HEX_ID1)
+            self.assertEqual(id_.bin_str, '00000001' * ID_SIZE_BYTES)
+            self.assertEqual(hash(id_), hash(Id(BIN_ID1)))
+        self.assertEqual(Id(0).bin_id, BIN_ID0)
+        self.assertRaises(IdError, Id, -1)
+        self.assertRaises(IdError, Id, 1 << ID_SIZE_BITS)
+        self.assertRaises(IdError, Id, '-' + '1' * 39)
+
+    def test_log(self):
+        self.assertEqual(Id(0).log, -1)
+        self.assertEqual(Id(1).log, 0)
+        self.assertEqual(Id(BIN_ID1).log, ID_SIZE_BITS - 8)
+        self.assertEqual(identifier.MAX_ID.log, ID_SIZE_BITS - 1)
+
+    def test_slots(self):
+        for id_ in (Id(BIN_ID1), RandomId(), Id(BIN_ID1).distance(Id(0))):
+            self.assertRaises(AttributeError, getattr, id_, '__dict__')
+
+    def test_pickle(self):
+        import pickle
+        for protocol in (0, 2):
+            id_ = pickle.loads(pickle.dumps(Id(BIN_ID1), protocol))
+            self.assertEqual(id_, Id(BIN_ID1))
+            self.assertEqual(id_.bin_id, BIN_ID1)
+
     def test_log_distance(self):
         id0 = Id(BIN_ID0)
         id1 = Id(BIN_ID1)
@@ -0,0 +1,126 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+import unittest
+import threading
+import time
+import logging
+
+import logging_conf
+from logging_conf import AsyncHandler
+
+
+class _ListHandler(logging.Handler):
+    """Keep the messages. Block while 'unblocked' is not set."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.msgs = []
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def emit(self, record):
+        self.unblocked.wait()
+        self.msgs.append(self.format(record))
+
+
+def _wait(condition_f):
+    for _ in xrange(500):
+        if condition_f():
+            return
+        time.sleep(.01)
+
+
+class TestAsyncHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.target = _ListHandler()
+        self.logger = logging.getLogger('test_async_handler')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        self.target.unblocked.set()
+
+    def test_write(self):
+        handler = AsyncHandler(self.target, 10)
+        self.logger.addHandler(handler)
+        for i in xrange(5):
+            self.logger.debug('msg %d', i)
+        handler.close()
+        self.assertEqual(self.target.msgs, ['msg %d' % i for i in xrange(5)])
+        self.assertEqual(handler.get_stats(),
+                         {'queued': 5, 'written': 5, 'dropped': 0,
+                          'queue_len': 0})
+
+    def test_formatted_when_logged(self):
+        handler = AsyncHandler(self.target, 10)
+        self.logger.addHandler(handler)
+        self.target.unblocked.clear()
+        items = [1]
+        self.logger.debug('%r', items)
+        items.append(2)
+        self.target.unblocked.set()
+        handler.close()
+        self.assertEqual(self.target.msgs, ['[1]'])
+
+    def test_exception(self):
+        handler = AsyncHandler(self.target, 10)
+        self.logger.addHandler(handler)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            self.logger.exception('oops')
+        handler.close()
+        self.assertEqual(len(self.target.msgs), 1)
+        assert self.target.msgs[0].startswith('oops\nTraceback')
+        assert 'ZeroDivisionError' in self.target.msgs[0]
+
+    def test_drop_when_full(self):
+        handler = AsyncHandler(self.target, 3)
+        self.logger.addHandler(handler)
+        self.target.unblocked.clear()
+        self.logger.debug('msg 0')
+        # The writer gets the first record and blocks
+        _wait(lambda: handler.get_stats()['queue_len'] == 0)
+        for i in xrange(1, 20):
+            self.logger.debug('msg %d', i)
+        # Three records fit in the queue
+        stats = handler.get_stats()
+        self.assertEqual(stats['queued'], 4)
+        self.assertEqual(stats['dropped'], 16)
+        self.target.unblocked.set()
+        _wait(lambda: handler.get_stats()['written'] == 4)
+        self.logger.debug('last')
+        handler.close()
+        self.assertEqual(self.target.msgs,
+                         ['msg 0', '16 log records dropped (queue full)',
+                          'msg 1', 'msg 2', 'msg 3', 'last'])
+        self.assertEqual(handler.get_stats()['written'], 5)
+
+
+class TestSetup(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('dht')
+        self.handlers = list(self.logger.handlers)
+        self.level = self.logger.level
+
+    def tearDown(self):
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+        self.logger.setLevel(self.level)
+
+    def test_async(self):
+        logging_conf.setup('test_logs', logging.DEBUG, 100)
+        self.logger.debug('async %s', 'logging')
+        stats = logging_conf.get_stats()
+        self.assertEqual(stats['queued'], 1)
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        logging_conf.close()
+        assert 'async logging' in open('test_logs/pymdht.log').read()
+        self.assertEqual(logging_conf.get_stats(), None)
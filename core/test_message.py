@@ -306,6 +306,19 @@ class TestEvilIncomingQueries(unittest.TestCase): #aka invalid bencode messages
             assert p1[0] == p2[0]
             assert p1[1] == p2[1]
 
+    def test_get_peers_compact_peers(self):
+        outgoing_response = servers_msg_f.outgoing_get_peers_response(
+            tc.CLIENT_NODE, tc.TOKEN, tc.NODES, tc.PEERS)
+        c_outgoing_response = servers_msg_f.outgoing_get_peers_response(
+            tc.CLIENT_NODE, tc.TOKEN, tc.NODES,
+            c_peers=mt.compact_peers(tc.PEERS))
+        self.assertEqual(c_outgoing_response.stamp(tc.TID),
+                         outgoing_response.stamp(tc.TID))
+        # No peers and no nodes
+        self.assertRaises(AssertionError,
+                          servers_msg_f.outgoing_get_peers_response,
+                          tc.CLIENT_NODE, tc.TOKEN, c_peers=[])
+
     def test_get_peers_peers_error(self):
         assert 1
 
@@ -601,5 +614,129 @@ class TestPrivateDHT(unittest.TestCase):
                       Datagram(bencoded_private2, tc.CLIENT_ADDR))
 
 
+class _GenericIncomingMsg(m.IncomingMsg):
+    # Always take the generic path (bencode.decode + sanitize functions)
+    def _sanitize_krpc(self):
+        raise m.ShapeError
+
+
+class TestDecodeKRPC(unittest.TestCase):
+
+    def setUp(self):
+        gp_r = clients_msg_f.outgoing_get_peers_response(tc.SERVER_NODE,
+                                                         peers=tc.PEERS)
+        gp_r._dict[m.RESPONSE][m.NODES2] = mt.compact_nodes2(tc.NODES)
+        self.bencoded_msgs = [b_ping_q, b_fn_q, b_gp_q, b_ap_q,
+                              b_ping_r, b_fn2_r, b_gp_r, b_ap_r,
+                              gp_r.stamp(tc.TID)]
+
+    def test_same_as_generic(self):
+        for bencoded in self.bencoded_msgs:
+            self.assertEqual(m.decode_krpc(bencoded), bencode.decode(bencoded))
+            datagram = Datagram(bencoded, tc.CLIENT_ADDR)
+            msg = m.IncomingMsg(None, datagram)
+            generic_msg = _GenericIncomingMsg(None, datagram)
+            self.assertEqual(vars(msg), vars(generic_msg))
+
+    def test_unknown_shape(self):
+        # Unknown key
+        msg_d = bencode.decode(b_ping_q)
+        msg_d['zz'] = {'unknown': ['value']}
+        bencoded = bencode.encode(msg_d)
+        self.assertRaises(m.ShapeError, m.decode_krpc, bencoded)
+        msg = servers_msg_f.incoming_msg(Datagram(bencoded, tc.CLIENT_ADDR))
+        self.assertEqual(msg.query, m.PING)
+        # Unexpected value type
+        msg_d = bencode.decode(b_fn_q)
+        msg_d[m.ARGS][m.TARGET] = 1
+        bencoded = bencode.encode(msg_d)
+        self.assertRaises(m.ShapeError, m.decode_krpc, bencoded)
+        self.assertRaises(m.MsgError, servers_msg_f.incoming_msg,
+                          Datagram(bencoded, tc.CLIENT_ADDR))
+        # Error messages take the generic path
+        bencoded = clients_msg_f.outgoing_error(
+            tc.SERVER_NODE, m.GENERIC_E).stamp(tc.TID)
+        self.assertRaises(m.ShapeError, m.decode_krpc, bencoded)
+        msg = servers_msg_f.incoming_msg(Datagram(bencoded, tc.SERVER_ADDR))
+        self.assertEqual(msg.error, m.GENERIC_E)
+        # Truncated and extra data
+        for bencoded in (b_gp_r[:-1], b_gp_r[:-30], b_gp_r + 'e'):
+            self.assertRaises(m.ShapeError, m.decode_krpc, bencoded)
+            self.assertRaises(m.MsgError, servers_msg_f.incoming_msg,
+                              Datagram(bencoded, tc.SERVER_ADDR))
+
+    def test_buffer(self):
+        recv_buffer = bytearray(b_gp_r + 'GARBAGE')
+        datagram = Datagram(buffer(recv_buffer, 0, len(b_gp_r)),
+                            tc.SERVER_ADDR)
+        msg = servers_msg_f.incoming_msg(datagram)
+        self.assertEqual(msg.peers, tc.PEERS)
+        self.assertEqual(msg.token, tc.TOKEN)
+
+
+class TestResponseTemplate(unittest.TestCase):
+
+    def _generic_response(self, msg_f, dst_node, token=None, nodes=None,
+                          peers=None, query=m.GET_PEERS):
+        msg = m.OutgoingMsg(msg_f.version_label, dst_node,
+                            msg_f.private_dht_name)
+        msg.make_response(msg_f.src_id)
+        if query == m.FIND_NODE:
+            msg.find_node_response(nodes)
+        elif query == m.GET_PEERS:
+            msg.get_peers_response(token, nodes, peers)
+        return msg
+
+    def test_same_as_generic(self):
+        for private_dht_name in (None, 'private'):
+            msg_f = m.MsgFactory(VERSION_LABEL, tc.CLIENT_ID,
+                                 private_dht_name)
+            for tid in ('a', tc.TID, 'x' * 12):
+                pairs = [
+                    (msg_f.outgoing_ping_response(tc.SERVER_NODE),
+                     self._generic_response(msg_f, tc.SERVER_NODE,
+                                            query=m.PING)),
+                    (msg_f.outgoing_announce_peer_response(tc.SERVER_NODE),
+                     self._generic_response(msg_f, tc.SERVER_NODE,
+                                            query=m.ANNOUNCE_PEER)),
+                    ]
+                for nodes in ([], tc.NODES[:1], tc.NODES):
+                    pairs.append(
+                        (msg_f.outgoing_find_node_response(tc.SERVER_NODE,
+                                                           nodes),
+                         self._generic_response(msg_f, tc.SERVER_NODE,
+                                                nodes=nodes,
+                                                query=m.FIND_NODE)))
+                for token in (None, tc.TOKEN):
+                    for nodes, peers in ((tc.NODES, None),
+                                         (None, tc.PEERS),
+                                         (tc.NODES, tc.PEERS)):
+                        pairs.append(
+                            (msg_f.outgoing_get_peers_response(
+                                    tc.SERVER_NODE, token, nodes, peers),
+                             self._generic_response(msg_f, tc.SERVER_NODE,
+                                                    token, nodes, peers)))
+                for response, generic_response in pairs:
+                    self.assertEqual(response.stamp(tid),
+                                     generic_response.stamp(tid))
+                    self.assertEqual(response.tid, tid)
+                    self.assertEqual(response._dict, generic_response._dict)
+
+    def test_stamp_twice(self):
+        response = clients_msg_f.outgoing_ping_response(tc.SERVER_NODE)
+        response.stamp(tc.TID)
+        self.assertRaises(m.MsgError, response.stamp, tc.TID)
+        self.assertEqual(response._dict[m.TID], tc.TID)
+        self.assertRaises(m.MsgError, response.stamp, tc.TID)
+
+    def test_modified_dict(self):
+        response = clients_msg_f.outgoing_get_peers_response(tc.SERVER_NODE,
+                                                             peers=tc.PEERS)
+        response._dict[m.RESPONSE][m.NODES2] = mt.compact_nodes2(tc.NODES)
+        msg = servers_msg_f.incoming_msg(
+            Datagram(response.stamp(tc.TID), tc.CLIENT_ADDR))
+        self.assertEqual(msg.nodes2, tc.NODES)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -95,7 +95,61 @@ class TestMsgTools(unittest.TestCase):
         self.assertRaises(mt.AddrError, mt.uncompact_addr, c_addr[:-1])
         self.assertRaises(mt.AddrError, mt.uncompact_addr, c_addr[1:])
         self.assertRaises(mt.AddrError, mt.uncompact_addr, c_addr+'X')
-        
+
+    def test_views(self):
+        c_nodes = mt.compact_nodes(tc.NODES)
+        recv_buffer = bytearray('XX' + c_nodes + 'GARBAGE')
+        views = (buffer(recv_buffer, 2, len(c_nodes)),
+                 recv_buffer[2:2 + len(c_nodes)],
+                 memoryview(recv_buffer)[2:2 + len(c_nodes)])
+        for view in views:
+            self.assertEqual(mt.uncompact_nodes(view), tc.NODES)
+        c_addr = mt.compact_addr(('1.2.3.4', 1234))
+        self.assertEqual(mt.uncompact_addr(buffer(c_addr)),
+                         ('1.2.3.4', 1234))
+
+
+class TestNodePool(unittest.TestCase):
+
+    def setUp(self):
+        self.c_nodes = [n.compact() for n in tc.NODES]
+
+    def test_same_objects(self):
+        pool = mt.NodePool()
+        nodes = [pool.get(c_node) for c_node in self.c_nodes]
+        self.assertEqual(nodes, tc.NODES)
+        for c_node, node_ in zip(self.c_nodes, nodes):
+            assert pool.get(c_node) is node_
+        stats = pool.get_stats()
+        self.assertEqual(stats['hits'], len(tc.NODES))
+        self.assertEqual(stats['misses'], len(tc.NODES))
+        self.assertEqual(stats['hit_rate'], .5)
+
+    def test_uncompact_nodes(self):
+        c_nodes = mt.compact_nodes(tc.NODES)
+        nodes = mt.uncompact_nodes(c_nodes)
+        for node1, node2 in zip(nodes, mt.uncompact_nodes(c_nodes)):
+            assert node1 is node2
+
+    def test_bounded(self):
+        pool = mt.NodePool(4)
+        nodes = [pool.get(c_node) for c_node in self.c_nodes[:3]]
+        # Node 0 is moved to the current generation
+        assert pool.get(self.c_nodes[0]) is nodes[0]
+        for c_node in self.c_nodes[3:]:
+            pool.get(c_node)
+            assert len(pool) <= 4
+        # Nodes 1 and 2 were discarded. Node 0 was not.
+        assert pool.get(self.c_nodes[1]) is not nodes[1]
+        assert pool.get(self.c_nodes[1]) == nodes[1]
+        self.assertEqual(pool.get_stats()['size'], len(pool))
+
+    def test_invalid_addr(self):
+        pool = mt.NodePool()
+        c_node = tc.CLIENT_ID.bin_id + mt.compact_addr(('1.2.3.4', 0))
+        self.assertRaises(mt.AddrError, pool.get, c_node)
+        self.assertEqual(len(pool), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,7 @@
 from __future__ import with_statement
 
 import logging
+import os
 import sys
 import threading
 import socket
@@ -100,6 +101,47 @@ class TestMinitwisted(unittest.TestCase):
             self.reactor.run_one_step()
             self.assertEqual(self.callback_values, range(i + 1))
     
+    def test_call_asap_drained(self):
+        for i in xrange(500):
+            self.reactor.call_asap(self._callback, i)
+        self.reactor.run_one_step()
+        # All queued callbacks are called in a single step, in order
+        self.assertEqual(self.callback_values, range(500))
+
+    def test_call_later(self):
+        self.reactor.call_later(tc.TASK_INTERVAL * 2, self._callback, 1)
+        cancelled_call = self.reactor.call_later(tc.TASK_INTERVAL,
+                                                 self._callback, 2)
+        self.reactor.call_later(tc.TASK_INTERVAL, self._callback, 3)
+        self.assertTrue(cancelled_call.active())
+        cancelled_call.cancel()
+        self.assertFalse(cancelled_call.active())
+        self.reactor.run_one_step()
+        self.assertEqual(self.callback_values, [])
+        time.sleep(tc.TASK_INTERVAL)
+        self.reactor.run_one_step()
+        self.assertEqual(self.callback_values, [3])
+        time.sleep(tc.TASK_INTERVAL)
+        self.reactor.run_one_step()
+        self.assertEqual(self.callback_values, [3, 1])
+        time.sleep(tc.TASK_INTERVAL * 10)
+        self.reactor.run_one_step()
+        # The cancelled call is never called
+        self.assertEqual(self.callback_values, [3, 1])
+
+    def test_main_loop_rescheduled(self):
+        self.reactor.run_one_step()
+        self.assertEqual(self.main_loop_call_counter, 1)
+        # The datagram handler asks for main_loop to be called in 100 secs
+        self.reactor.s.put_datagram_received(DATAGRAM1)
+        self.reactor.run_one_step()
+        time.sleep(self.main_loop_delay)
+        self.reactor.run_one_step()
+        self.assertEqual(self.main_loop_call_counter, 1)
+        time.sleep(100)
+        self.reactor.run_one_step()
+        self.assertEqual(self.main_loop_call_counter, 2)
+
     def test_minitwisted_crashed(self):
         self.reactor.call_asap(self._crashing_callback)
         self.assertRaises(CrashError, self.reactor.run_one_step)
@@ -115,6 +157,30 @@ class TestMinitwisted(unittest.TestCase):
         self.assertEqual(len(self.datagrams_received), 1)
         self.assertEqual(self.datagrams_received[0], datagram)
 
+    def test_zero_copy_recv(self):
+        batches = []
+        def on_datagrams_received(datagrams):
+            # Data is only valid now (the buffers are reused)
+            batches.append([(type(d.data), str(d.data), d.addr)
+                            for d in datagrams])
+            return time.time() + MAIN_LOOP_DELAY, []
+        self.reactor = ThreadedReactor(
+            self._main_loop, tc.CLIENT_PORT,
+            self._on_datagram_received,
+            task_interval=tc.TASK_INTERVAL,
+            on_datagrams_received_f=on_datagrams_received,
+            recv_batch_size=2,
+            zero_copy_recv=True)
+        self.reactor.s = _SocketMock()
+        for datagram in (DATAGRAM1, DATAGRAM2, DATAGRAM3):
+            self.reactor.s.put_datagram_received(datagram)
+        self.reactor.run_one_step()
+        self.reactor.run_one_step()
+        self.assertEqual(batches,
+                         [[(buffer, DATAGRAM1.data, DATAGRAM1.addr),
+                           (buffer, DATAGRAM2.data, DATAGRAM2.addr)],
+                          [(buffer, DATAGRAM3.data, DATAGRAM3.addr)]])
+
     def test_block_flood(self):
         from floodbarrier import MAX_PACKETS_PER_PERIOD as FLOOD_LIMIT
         for i in xrange(FLOOD_LIMIT * 2):
@@ -157,6 +223,82 @@ class TestMinitwisted(unittest.TestCase):
         time.normal_mode()
 
 
+class TestBatchReceive(unittest.TestCase):
+
+    def _main_loop(self):
+        return time.time() + MAIN_LOOP_DELAY, []
+
+    def _on_datagram_received(self, datagram):
+        self.datagrams_received.append(datagram)
+        return time.time() + MAIN_LOOP_DELAY, []
+
+    def _on_datagrams_received(self, datagrams):
+        self.batches_received.append(datagrams)
+        return time.time() + MAIN_LOOP_DELAY, [DATAGRAM3]
+
+    def setUp(self):
+        time.mock_mode()
+        self.datagrams_received = []
+        self.batches_received = []
+        self.reactor = ThreadedReactor(
+            self._main_loop, tc.CLIENT_PORT,
+            self._on_datagram_received,
+            task_interval=tc.TASK_INTERVAL,
+            on_datagrams_received_f=self._on_datagrams_received,
+            recv_batch_size=4)
+        self.reactor.s = _SocketMock()
+
+    def test_drain_socket(self):
+        for _ in xrange(6):
+            self.reactor.s.put_datagram_received(DATAGRAM1)
+        self.reactor.run_one_step()
+        # A full batch is handed over in one go
+        self.assertEqual(self.batches_received, [[DATAGRAM1] * 4])
+        self.assertEqual(self.datagrams_received, [])
+        self.assertEqual(self.reactor.s.get_datagrams_sent(), [DATAGRAM3])
+        self.reactor.run_one_step()
+        self.assertEqual(self.batches_received[1], [DATAGRAM1] * 2)
+        # Nothing to read: the handler is not called
+        self.reactor.run_one_step()
+        self.assertEqual(len(self.batches_received), 2)
+
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['recv_batch_size'], 4)
+        self.assertEqual(stats['recv_batches'], 2)
+        self.assertEqual(stats['datagrams_received'], 6)
+        self.assertEqual(stats['full_recv_batches'], 1)
+        self.assertEqual(stats['max_recv_batch_len'], 4)
+        self.assertEqual(stats['avg_recv_batch_len'], 3.)
+
+    def test_no_batch_handler(self):
+        self.reactor._on_datagrams_received_f = None
+        self.reactor.s.put_datagram_received(DATAGRAM1)
+        self.reactor.s.put_datagram_received(DATAGRAM3)
+        self.reactor.run_one_step()
+        # The single-datagram handler is called for each datagram
+        self.assertEqual(self.batches_received, [])
+        self.assertEqual(self.datagrams_received, [DATAGRAM1, DATAGRAM3])
+
+    def test_block_flood(self):
+        from floodbarrier import MAX_PACKETS_PER_PERIOD as FLOOD_LIMIT
+        for i in xrange(FLOOD_LIMIT * 2):
+            self.reactor.s.put_datagram_received(DATAGRAM1)
+        for i in xrange(FLOOD_LIMIT * 2 / 4):
+            self.reactor.run_one_step()
+        num_datagrams = sum([len(b) for b in self.batches_received])
+        self.assertEqual(num_datagrams, FLOOD_LIMIT)
+        # Blocked datagrams are counted as received anyway
+        self.assertEqual(self.reactor.get_stats()['datagrams_received'],
+                         FLOOD_LIMIT * 2)
+
+    def test_kernel_drops(self):
+        kernel_drops = minitwisted.get_kernel_drops(tc.CLIENT_PORT)
+        assert kernel_drops is None or kernel_drops >= 0
+
+    def tearDown(self):
+        time.normal_mode()
+
+
 class TestMinitwistedRealThreading(unittest.TestCase):
 
     def _main_loop(self):
@@ -183,6 +325,80 @@ class TestMinitwistedRealThreading(unittest.TestCase):
 
 
 
+class TestWakeUp(unittest.TestCase):
+
+    def _main_loop(self):
+        return time.time() + 100, []
+
+    def _on_datagram_received(self, datagram):
+        return time.time() + 100, []
+
+    def _callback(self, value):
+        self.callback_values.append(value)
+        return []
+
+    def _on_extra_datagram_received(self, datagram):
+        return [Datagram('re: ' + datagram.data, datagram.addr)]
+
+    def setUp(self):
+        self.callback_values = []
+        # The reactor would block for 10 seconds if nothing woke it up
+        self.reactor = ThreadedReactor(self._main_loop,
+                                       tc.CLIENT_PORT,
+                                       self._on_datagram_received,
+                                       task_interval=10)
+
+    def test_call_asap_wakes_up(self):
+        self.reactor.start()
+        time.sleep(.05)
+        start_ts = time.time()
+        self.reactor.call_asap(self._callback, 1)
+        while not self.callback_values and time.time() < start_ts + 2:
+            time.sleep(.001)
+        self.assertEqual(self.callback_values, [1])
+        assert time.time() - start_ts < 1
+        self.reactor.stop() # stop wakes up the reactor as well
+        self.assertTrue(not self.reactor.running)
+
+    def test_wakeup_while_draining(self):
+        os_shim = _OsShim(self.reactor._wakeup)
+        minitwisted.os = os_shim
+        try:
+            self.reactor.start()
+            time.sleep(.05)
+            # Another thread calls _wakeup while the pipe is being drained
+            self.reactor.call_asap(self._callback, 1)
+            start_ts = time.time()
+            while not self.callback_values and time.time() < start_ts + 2:
+                time.sleep(.001)
+            self.assertTrue(os_shim.woken_up)
+            # A later call_asap still wakes the reactor up right away
+            time.sleep(.05)
+            start_ts = time.time()
+            self.reactor.call_asap(self._callback, 2)
+            while (len(self.callback_values) < 2 and
+                   time.time() < start_ts + 2):
+                time.sleep(.001)
+            self.assertEqual(self.callback_values, [1, 2])
+            assert time.time() - start_ts < 1
+        finally:
+            minitwisted.os = os
+            self.reactor.stop()
+
+    def test_listen_udp(self):
+        extra_port = tc.CLIENT_PORT + 100
+        self.reactor.listen_udp(extra_port, self._on_extra_datagram_received)
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        client.sendto('hello', ('127.0.0.1', extra_port))
+        self.reactor.start()
+        data, addr = client.recvfrom(100)
+        self.assertEqual(data, 're: hello')
+        self.assertEqual(addr[1], extra_port)
+        self.reactor.stop()
+        client.close()
+
+
 class TestSend(unittest.TestCase):
     
     def _main_loop(self):
@@ -262,6 +478,147 @@ class TestSend(unittest.TestCase):
         self.assertEqual(captured_msgs[2][3], DATAGRAM3.data)
         
         
+class TestSendQueue(unittest.TestCase):
+
+    def _main_loop(self):
+        return time.time() + MAIN_LOOP_DELAY, [DATAGRAM1] * 3
+
+    def _callback(self, value):
+        return [DATAGRAM2] * value
+
+    def _on_datagram_received(self, datagram):
+        return time.time() + MAIN_LOOP_DELAY, [DATAGRAM3]
+
+    def setUp(self):
+        time.mock_mode()
+        # 100 datagrams/s and 10 ms steps: 1 datagram per step
+        self.reactor = ThreadedReactor(self._main_loop,
+                                       tc.CLIENT_PORT,
+                                       self._on_datagram_received,
+                                       task_interval=tc.TASK_INTERVAL,
+                                       max_send_rate=100)
+        self.reactor.s = _SocketMock()
+
+    def test_pacing(self):
+        self.reactor.run_one_step()
+        # main_loop returns three datagrams but only one can be sent
+        self.assertEqual(self.reactor.s.get_datagrams_sent(), [DATAGRAM1])
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['maintenance_send_queue_len'], 2)
+        self.assertEqual(stats['datagrams_sent'], 1)
+        self.reactor.run_one_step()
+        # no time has passed (mock time): nothing is sent
+        self.assertEqual(self.reactor.s.get_datagrams_sent(), [DATAGRAM1])
+        time.sleep(tc.TASK_INTERVAL)
+        self.reactor.run_one_step()
+        self.assertEqual(self.reactor.s.get_datagrams_sent(), [DATAGRAM1] * 2)
+
+    def test_maintenance_does_not_starve_others(self):
+        self.reactor.run_one_step()
+        self.assertEqual(self.reactor.s.get_datagrams_sent(), [DATAGRAM1])
+        # Maintenance datagrams are still queued, but the datagram triggered
+        # by the incoming datagram goes first.
+        self.reactor.s.put_datagram_received(DATAGRAM1)
+        self.reactor.run_one_step()
+        self.assertEqual(self.reactor.get_stats()['send_queue_len'], 1)
+        time.sleep(tc.TASK_INTERVAL)
+        self.reactor.run_one_step()
+        self.assertEqual(self.reactor.s.get_datagrams_sent(),
+                         [DATAGRAM1, DATAGRAM3])
+        time.sleep(tc.TASK_INTERVAL * 2)
+        self.reactor.run_one_step()
+        self.assertEqual(self.reactor.s.get_datagrams_sent(),
+                         [DATAGRAM1, DATAGRAM3, DATAGRAM1])
+
+    def test_burst(self):
+        self.reactor.run_one_step()
+        # Idle for a long time: the budget is capped (burst)
+        time.sleep(10)
+        self.reactor.call_asap(self._callback, 5)
+        self.reactor.run_one_step()
+        self.assertEqual(len(self.reactor.s.get_datagrams_sent()), 2)
+
+    def test_queue_full(self):
+        self.reactor.run_one_step()
+        self.reactor.call_asap(self._callback, minitwisted.MAX_SEND_QUEUE_LEN)
+        self.reactor.run_one_step()
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['send_queue_len'],
+                         minitwisted.MAX_SEND_QUEUE_LEN)
+        self.assertEqual(stats['send_queue_drops'], 0)
+        self.reactor.call_asap(self._callback, 3)
+        self.reactor.run_one_step()
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['send_queue_len'],
+                         minitwisted.MAX_SEND_QUEUE_LEN)
+        self.assertEqual(stats['send_queue_drops'], 3)
+
+    def test_queue_full_keeps_queries(self):
+        self.reactor.run_one_step()
+        self.reactor.call_asap(self._callback, minitwisted.MAX_SEND_QUEUE_LEN)
+        queries = [Datagram(DATA1, tc.SERVER_ADDR, True) for _ in range(3)]
+        self.reactor.call_asap(lambda: queries)
+        self.reactor.run_one_step()
+        stats = self.reactor.get_stats()
+        # Responses are dropped to make room for the queries
+        self.assertEqual(stats['send_queue_len'],
+                         minitwisted.MAX_SEND_QUEUE_LEN)
+        self.assertEqual(stats['send_queue_drops'], 3)
+        self.assertEqual(list(self.reactor._send_queue)[-3:], queries)
+        # Queries are never dropped (even over the limit)
+        self.reactor.call_asap(lambda: queries)
+        self.reactor.run_one_step()
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['send_queue_len'],
+                         minitwisted.MAX_SEND_QUEUE_LEN)
+        self.assertEqual(stats['send_queue_drops'], 6)
+        self.reactor.call_asap(lambda: queries * 400)
+        self.reactor.run_one_step()
+        # All the responses are dropped, the queue only has queries
+        send_queue = list(self.reactor._send_queue)
+        self.assertEqual(len(send_queue), 6 + 1200)
+        for datagram in send_queue:
+            self.assertTrue(datagram.is_query)
+
+    def tearDown(self):
+        time.normal_mode()
+
+
+class TestSendQueueNoPacing(unittest.TestCase):
+
+    def _main_loop(self):
+        return time.time() + MAIN_LOOP_DELAY, []
+
+    def _callback(self, value):
+        return [DATAGRAM2] * value
+
+    def _on_datagram_received(self, datagram):
+        return time.time() + MAIN_LOOP_DELAY, []
+
+    def setUp(self):
+        time.mock_mode()
+        self.reactor = ThreadedReactor(self._main_loop,
+                                       tc.CLIENT_PORT,
+                                       self._on_datagram_received,
+                                       task_interval=tc.TASK_INTERVAL)
+        self.reactor.s = _SocketMock()
+
+    def test_no_queue_limit(self):
+        self.reactor.run_one_step()
+        num_datagrams = minitwisted.MAX_SEND_QUEUE_LEN + 500
+        self.reactor.call_asap(self._callback, num_datagrams)
+        self.reactor.run_one_step()
+        # Everything is sent in this step, nothing is dropped
+        self.assertEqual(len(self.reactor.s.get_datagrams_sent()),
+                         num_datagrams)
+        stats = self.reactor.get_stats()
+        self.assertEqual(stats['send_queue_drops'], 0)
+        self.assertEqual(stats['send_queue_len'], 0)
+
+    def tearDown(self):
+        time.normal_mode()
+
+
 class TestSocketError(unittest.TestCase):
 
     def _main_loop(self):
@@ -383,6 +740,26 @@ class _TestSocketErrors():#unittest.TestCase):
         self.r.sendto('z'*12345, tc.NO_ADDR)
 
 
+class _OsShim(object):
+    """os for minitwisted: the first read (wake-up pipe) calls wakeup_f from
+    another thread before reading."""
+
+    def __init__(self, wakeup_f):
+        self._wakeup_f = wakeup_f
+        self.woken_up = False
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def read(self, fd, size):
+        if not self.woken_up:
+            self.woken_up = True
+            thread = threading.Thread(target=self._wakeup_f)
+            thread.start()
+            thread.join()
+        return os.read(fd, size)
+
+
 class _SocketMock(object):
 
     def __init__(self):
@@ -396,6 +773,11 @@ class _SocketMock(object):
         self.raise_error_on_sendto = False
         self.raise_error_on_recvfrom = False
         self.raise_timeout = False
+        # The reactor polls this pipe: one byte per datagram received
+        self._pipe_r, self._pipe_w = os.pipe()
+
+    def fileno(self):
+        return self._pipe_r
         
     def sendto(self, data, addr):
         if self.raise_error_on_sendto:
@@ -414,16 +796,23 @@ class _SocketMock(object):
             raise socket.error
         if self.datagrams_received:
             datagram_received = self.datagrams_received.pop(0)
+            os.read(self._pipe_r, 1)
         if datagram_received:
             return (datagram_received.data, datagram_received.addr)
         # nothing to do, raise timeout
         self.raise_timeout_on_next_recvfrom = False
         self.num_recvfrom_timeouts += 1
         raise socket.timeout
+
+    def recvfrom_into(self, recv_buffer):
+        data, addr = self.recvfrom(len(recv_buffer))
+        recv_buffer[:len(data)] = data
+        return len(data), addr
         
     def put_datagram_received(self, datagram, delay=0):
         with self.lock:
             self.datagrams_received.append(datagram)
+            os.write(self._pipe_w, '*')
 
     def get_datagrams_sent(self):
         with self.lock:
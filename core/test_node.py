@@ -122,7 +122,31 @@ class TestRoutingNode(unittest.TestCase):
         self.assertEqual(rnode.timeouts_in_a_row(), 0)
         self.assertEqual(rnode.timeouts_in_a_row(True), 0)
         self.assertEqual(rnode.timeouts_in_a_row(False), 0)
-        
+
+    def test_last_events(self):
+        rnode = RoutingNode(tc.NODES[0], 1)
+        self.assertEqual(rnode.last_events, [])
+        for i in xrange(3):
+            rnode.add_event(i, node.QUERY)
+        self.assertEqual(rnode.last_events,
+                         [(i, node.QUERY) for i in xrange(3)])
+        # Only the newest events are kept
+        for i in xrange(3, 25):
+            rnode.add_event(i, node.TIMEOUT)
+        self.assertEqual(rnode.last_events,
+                         [(i, node.TIMEOUT) for i in xrange(
+                        25 - node.MAX_LAST_EVENTS, 25)])
+        # Timeouts are counted beyond the last events kept
+        self.assertEqual(rnode.timeouts_in_a_row(), 22)
+        self.assertEqual(rnode.timeouts_in_a_row(False), 22)
+
+    def test_slots(self):
+        rnode = RoutingNode(tc.NODES[0], 1)
+        self.assertRaises(AttributeError, getattr, rnode, '__dict__')
+        self.assertRaises(AttributeError, setattr, rnode, 'foo', 1)
+        assert rnode.compact_addr is tc.NODES[0].compact_addr
+        self.assertEqual(rnode.questionable, False)
+
     def test_repr(self):
         rnode = repr(RoutingNode(tc.CLIENT_NODE, 1))
 
@@ -0,0 +1,61 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+import unittest
+import logging
+
+import test_const as tc
+import identifier
+from identifier import Id, ID_SIZE_BITS
+
+import pymdht_farm
+
+import routing_plugin_template as routing_m_mod
+import lookup_plugin_template as lookup_m_mod
+import exp_plugin_template as exp_m_mod
+
+
+class TestWorkerIds(unittest.TestCase):
+
+    def test_spread(self):
+        for num_workers in (1, 2, 3, 8):
+            ids = pymdht_farm.get_worker_ids(num_workers)
+            self.assertEqual(len(ids), num_workers)
+            slice_size = (1 << ID_SIZE_BITS) / num_workers
+            for i, id_ in enumerate(ids):
+                self.assertEqual(id_.long / slice_size, i)
+
+    def test_closest_worker(self):
+        ids = [Id(chr(0) * 20), Id(chr(0x80) * 20), Id(chr(0xff) * 20)]
+        self.assertEqual(pymdht_farm.get_closest_worker(ids, ids[0]), 0)
+        self.assertEqual(
+            pymdht_farm.get_closest_worker(ids, Id(chr(0x7f) * 20)), 0)
+        self.assertEqual(
+            pymdht_farm.get_closest_worker(ids, Id(chr(0x90) * 20)), 1)
+        self.assertEqual(
+            pymdht_farm.get_closest_worker(ids, Id(chr(0xf0) * 20)), 2)
+        for _ in xrange(100):
+            info_hash = identifier.RandomId()
+            closest = min(ids, key=lambda id_: id_.distance(info_hash))
+            self.assertEqual(pymdht_farm.get_closest_worker(ids, info_hash),
+                             ids.index(closest))
+
+
+class TestPymdhtFarm(unittest.TestCase):
+
+    def test_start_and_stop(self):
+        farm = pymdht_farm.PymdhtFarm(tc.CLIENT_ADDR, 'test_logs',
+                                      routing_m_mod.__name__,
+                                      lookup_m_mod.__name__,
+                                      exp_m_mod.__name__,
+                                      None, logging.DEBUG, 2)
+        worker_index = farm.get_peers(None, farm.worker_ids[1], None)
+        self.assertEqual(worker_index, 1)
+        farm.stop()
+        for worker in farm._workers:
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
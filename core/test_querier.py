@@ -58,6 +58,50 @@ class TestQuerier(unittest.TestCase):
             self.assertEqual(self.querier._next_tid(),
                 chr(i%256)+chr((i/256)%256))
 
+    def test_num_in_flight(self):
+        msgs = [clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
+                for _ in xrange(3)]
+        self.querier.register_queries(msgs)
+        self.assertEqual(self.querier.num_in_flight, 3)
+        ping_r_msg_out = servers_msg_f.outgoing_ping_response(tc.CLIENT_NODE)
+        bencoded_r = ping_r_msg_out.stamp(msgs[0].tid)
+        for _ in xrange(2):
+            # The duplicated response does not count
+            ping_r_in = clients_msg_f.incoming_msg(
+                Datagram(bencoded_r, tc.SERVER_ADDR))
+            self.querier.get_related_query(ping_r_in)
+            self.assertEqual(self.querier.num_in_flight, 2)
+        time.sleep(querier.TIMEOUT_DELAY)
+        self.assertEqual(len(self.querier.get_timeout_queries()[1]), 2)
+        self.assertEqual(self.querier.num_in_flight, 0)
+
+    def test_tid_size(self):
+        for tid_size in (3, 4):
+            q = Querier(tid_size)
+            tids = [q._next_tid() for _ in xrange(1000)]
+            self.assertEqual(set([len(tid) for tid in tids]), set([tid_size]))
+            self.assertEqual(len(set(tids)), 1000)
+            self.assertEqual(tids[257], '\x01\x01' + '\0' * (tid_size - 2))
+        self.assertRaises(ValueError, Querier, 1)
+        self.assertRaises(ValueError, Querier, 5)
+
+    def test_tid_collision(self):
+        msg = clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
+        self.querier.register_queries([msg])
+        # The counter wraps around while msg is still pending
+        self.querier._tid_counter = 0
+        msg2 = clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
+        self.querier.register_queries([msg2])
+        self.assertEqual(msg2.tid, '\x01\0')
+        # Another address can use the same tid
+        self.querier._tid_counter = 0
+        msg3 = clients_msg_f.outgoing_ping_query(tc.NODES[0])
+        self.querier.register_queries([msg3])
+        self.assertEqual(msg3.tid, '\0\0')
+        stats = self.querier.get_stats()
+        self.assertEqual(stats['num_tid_collisions'], 1)
+        self.assertEqual(stats['num_pending'], 3)
+
     def test_ping_with_reponse(self):
         # Client creates a query
         ping_msg = clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
@@ -118,6 +162,8 @@ class TestQuerier(unittest.TestCase):
                     Datagram(bencoded_r, tc.SERVER_ADDR))
         related_query = self.querier.get_related_query(ping_r_in)
         assert related_query is None
+        self.assertEqual(self.querier.get_stats()['num_unmatched_responses'],
+                         1)
         
     def test_error_received(self):
         # Client creates a query
@@ -186,9 +232,108 @@ class TestQuerier(unittest.TestCase):
             timeout_queries[1], expected_msgs):
             assert related_query is expected_msg
 
+    def test_full_tid_match(self):
+        # 300 queries: the first byte of the tid is repeated
+        msgs = [clients_msg_f.outgoing_ping_query(
+                tc.SERVER_NODE) for i in xrange(300)]
+        self.querier.register_queries(msgs)
+        self.assertEqual(msgs[3].tid[0], msgs[259].tid[0])
+        ping_r_msg_out = servers_msg_f.outgoing_ping_response(tc.CLIENT_NODE)
+        bencoded_r = ping_r_msg_out.stamp(msgs[259].tid)
+        ping_r_in = clients_msg_f.incoming_msg(
+                        Datagram(bencoded_r, tc.SERVER_ADDR))
+        assert self.querier.get_related_query(ping_r_in) is msgs[259]
+        assert not msgs[3].got_response
+        # Same tid, different address
+        ping_r_in = clients_msg_f.incoming_msg(
+                        Datagram(bencoded_r, tc.SERVER2_ADDR))
+        assert self.querier.get_related_query(ping_r_in) is None
+
+    def test_burst_of_timeouts(self):
+        # Three batches of 1000 queries, sent .5 seconds apart
+        for batch in xrange(3):
+            nodes = [node.Node(('1.2.%d.%d' % divmod(i, 256), 1000 + batch),
+                               tc.SERVER_ID) for i in xrange(1000)]
+            self.querier.register_queries(
+                [clients_msg_f.outgoing_ping_query(n) for n in nodes])
+            time.sleep(.5)
+        time.sleep(querier.TIMEOUT_DELAY - .75)
+        # The first two batches timed out
+        next_ts, timeout_queries = self.querier.get_timeout_queries()
+        self.assertEqual(len(timeout_queries), 2000)
+        self.assertEqual(len(self.querier._pending), 1000)
+        time.sleep(next_ts - time.time())
+        next_ts, timeout_queries = self.querier.get_timeout_queries()
+        self.assertEqual(len(timeout_queries), 1000)
+        self.assertEqual(self.querier._pending, {})
+        assert next_ts <= time.time() + querier.TIMEOUT_DELAY
+
+    def test_adaptive_timeout(self):
+        # No RTT samples yet: TIMEOUT_DELAY
+        ping_msg = clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
+        timeout_ts, _ = self.querier.register_queries([ping_msg])
+        assert timeout_ts > time.time() + querier.MIN_RTO
+        time.sleep(.1)
+        ping_r_msg_out = servers_msg_f.outgoing_ping_response(tc.CLIENT_NODE)
+        ping_r_in = clients_msg_f.incoming_msg(
+            Datagram(ping_r_msg_out.stamp(ping_msg.tid), tc.SERVER_ADDR))
+        assert self.querier.get_related_query(ping_r_in) is ping_msg
+        # The server is fast: the next query times out after MIN_RTO
+        ping_msg2 = clients_msg_f.outgoing_ping_query(tc.SERVER_NODE)
+        timeout_ts, _ = self.querier.register_queries([ping_msg2])
+        time.sleep(querier.MIN_RTO + .05)
+        timeout_queries = self.querier.get_timeout_queries()[1]
+        self.assertEqual(timeout_queries, [ping_msg2])
+        # The first query (responded) is still pending
+        assert ping_msg.got_response
+        self.assertEqual(self.querier.get_stats()['num_pending'], 1)
+
     def tearDown(self):
         time.normal_mode()
 
 
+class TestRTOEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.rto = querier.RTOEstimator(4)
+
+    def test_unknown_addrs(self):
+        self.assertEqual(self.rto.get_rto(tc.SERVER_ADDR),
+                         querier.TIMEOUT_DELAY)
+        # The global estimation is used for unknown addrs
+        self.rto.on_response(tc.SERVER_ADDR, .2)
+        self.assertAlmostEqual(self.rto.get_rto(tc.SERVER2_ADDR),
+                               .2 + querier.RTT_K * .1)
+        stats = self.rto.get_stats()
+        self.assertAlmostEqual(stats['srtt'], .2)
+        self.assertAlmostEqual(stats['rttvar'], .1)
+        self.assertEqual(stats['num_addrs'], 1)
+        self.assertEqual(stats['rto_histogram'],
+                         [(.5, 0), (.75, 1), (1, 0), (1.5, 0), (2, 1)])
+
+    def test_clamps_and_backoff(self):
+        for _ in xrange(20):
+            self.rto.on_response(tc.SERVER_ADDR, .01)
+        self.assertEqual(self.rto.get_rto(tc.SERVER_ADDR), querier.MIN_RTO)
+        self.rto.on_timeout(tc.SERVER_ADDR)
+        self.assertEqual(self.rto.get_rto(tc.SERVER_ADDR),
+                         2 * querier.MIN_RTO)
+        for _ in xrange(5):
+            self.rto.on_timeout(tc.SERVER_ADDR)
+        self.assertEqual(self.rto.get_rto(tc.SERVER_ADDR), querier.MAX_RTO)
+        self.rto.on_response(tc.SERVER2_ADDR, 10)
+        self.assertEqual(self.rto.get_rto(tc.SERVER2_ADDR), querier.MAX_RTO)
+        # Timeouts from unknown addrs are ignored
+        self.rto.on_timeout(tc.CLIENT_ADDR)
+        self.assertEqual(self.rto.get_stats()['num_addrs'], 2)
+
+    def test_bounded(self):
+        for addr in tc.ADDRS:
+            self.rto.on_response(addr, .6)
+            assert self.rto.get_stats()['num_addrs'] <= 4
+        self.assertAlmostEqual(self.rto.get_rto(tc.ADDRS[-1]),
+                               .6 + querier.RTT_K * .3)
+
+
 if __name__ == '__main__':
     unittest.main()
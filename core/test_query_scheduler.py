@@ -0,0 +1,105 @@
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+import unittest
+
+import logging, logging_conf
+
+import test_const as tc
+import message
+import query_scheduler
+from query_scheduler import QueryScheduler
+
+logging_conf.testing_setup(__name__)
+logger = logging.getLogger('dht')
+
+msg_f = message.MsgFactory('NS\0\0', tc.CLIENT_ID)
+
+
+class _Lookup(object):
+    pass
+
+
+class TestQueryScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = QueryScheduler(4)
+
+    def _get_peers_queries(self, lookup_obj, num_queries):
+        return [msg_f.outgoing_get_peers_query(tc.NODES[i], tc.INFO_HASH,
+                                               lookup_obj)
+                for i in xrange(num_queries)]
+
+    def test_room(self):
+        queries = self._get_peers_queries(_Lookup(), 3)
+        self.assertEqual(self.scheduler.schedule(queries, 0), queries)
+        self.assertEqual(self.scheduler.schedule([], 3), [])
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['num_queued'], 0)
+        self.assertEqual(stats['queue_len']['lookup'], 0)
+
+    def test_cap(self):
+        queries = self._get_peers_queries(_Lookup(), 6)
+        self.assertEqual(self.scheduler.schedule(queries, 0), queries[:4])
+        self.assertEqual(self.scheduler.get_stats()['queue_len']['lookup'], 2)
+        # No room
+        self.assertEqual(self.scheduler.schedule([], 4), [])
+        # Two queries got a response
+        self.assertEqual(self.scheduler.schedule([], 2), queries[4:])
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['queue_len']['lookup'], 0)
+        self.assertEqual(stats['queued_lookups']['lookup'], 0)
+        self.assertEqual(stats['num_queued'], 6)
+        self.assertEqual(stats['max_queue_len'], 2)
+
+    def test_fair_share(self):
+        lookup1_queries = self._get_peers_queries(_Lookup(), 8)
+        lookup2_queries = self._get_peers_queries(_Lookup(), 2)
+        self.assertEqual(self.scheduler.schedule(lookup1_queries, 4), [])
+        # Lookup2 does not wait for all lookup1's queries
+        self.assertEqual(self.scheduler.schedule(lookup2_queries, 0),
+                         [lookup1_queries[0], lookup2_queries[0],
+                          lookup1_queries[1], lookup2_queries[1]])
+        self.assertEqual(self.scheduler.get_stats()['queued_lookups'],
+                         {'lookup': 1, 'maintenance_lookup': 0,
+                          'maintenance': 0})
+        self.assertEqual(self.scheduler.schedule([], 0), lookup1_queries[2:6])
+
+    def test_priorities(self):
+        maintenance_lookup = _Lookup()
+        self.scheduler.add_maintenance_lookup(maintenance_lookup)
+        pings = [msg_f.outgoing_ping_query(n) for n in tc.NODES[:2]]
+        m_lookup_queries = self._get_peers_queries(maintenance_lookup, 2)
+        lookup_queries = self._get_peers_queries(_Lookup(), 2)
+        announce = msg_f.outgoing_announce_peer_query(
+            tc.SERVER_NODE, tc.INFO_HASH, 1234, 'token')
+        self.assertEqual(
+            self.scheduler.schedule(
+                pings + m_lookup_queries + lookup_queries + [announce], 4),
+            [])
+        self.assertEqual(self.scheduler.get_stats()['queue_len'],
+                         {'lookup': 3, 'maintenance_lookup': 2,
+                          'maintenance': 2})
+        self.assertEqual(self.scheduler.schedule([], 0),
+                         [lookup_queries[0], announce, lookup_queries[1],
+                          m_lookup_queries[0]])
+        self.assertEqual(self.scheduler.schedule([], 0),
+                         m_lookup_queries[1:] + pings)
+
+    def test_maintenance_queue_full(self):
+        pings = [msg_f.outgoing_ping_query(tc.SERVER_NODE) for _ in
+                 xrange(query_scheduler.MAX_QUEUED_MAINTENANCE + 10)]
+        self.assertEqual(self.scheduler.schedule(pings, 4), [])
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['num_dropped'], 10)
+        self.assertEqual(stats['queue_len']['maintenance'],
+                         query_scheduler.MAX_QUEUED_MAINTENANCE)
+        # Lookup queries are never dropped
+        lookup_queries = self._get_peers_queries(_Lookup(), 8)
+        self.assertEqual(self.scheduler.schedule(lookup_queries, 4), [])
+        self.assertEqual(self.scheduler.get_stats()['queue_len']['lookup'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@ import test_const as tc
 import node
 
 from routing_table import *
+import routing_table
 
 logging_conf.testing_setup(__name__)
 logger = logging.getLogger('dht')
@@ -131,20 +132,43 @@ class TestBucket(unittest.TestCase):
         self.assertTrue(b1 != b2)
 
         b3 = Bucket(2, set())
-        b3.add(tc.CLIENT_NODE)
+        b3.add(tc.CLIENT_NODE.get_rnode(1))
         self.assertNotEqual(b1, b3)
         self.assertTrue(b1 != b3)
         
         b4 = Bucket(2, set())
-        b4.add(tc.SERVER_NODE)
+        b4.add(tc.SERVER_NODE.get_rnode(1))
         self.assertEqual(b1, b4)
         self.assertFalse(b1 != b4)
         
         b5 = Bucket(3, set())
-        b3.add(tc.SERVER_NODE)
+        b3.add(tc.SERVER_NODE.get_rnode(1))
         self.assertNotEqual(b1, b5)
         self.assertTrue(b1 != b5)
 
+    def test_index(self):
+        b = Bucket(NODES_PER_BUCKET, set())
+        rnodes = [n.get_rnode(1) for n in tc.NODES[:NODES_PER_BUCKET]]
+        for rnode in rnodes:
+            b.add(rnode)
+        # Equal nodes (not the same object) find the rnode
+        for n, rnode in zip(tc.NODES, rnodes):
+            assert b.get_rnode(node.Node(n.addr, n.id)) is rnode
+        # Same address but different id (and vice versa) is not found
+        n = tc.NODES[0]
+        self.assertEqual(b.get_rnode(node.Node(n.addr, tc.CLIENT_ID)), None)
+        self.assertEqual(b.get_rnode(node.Node(tc.CLIENT_ADDR, n.id)), None)
+        self.assertRaises(KeyError, b.remove,
+                          node.Node(n.addr, tc.CLIENT_ID))
+        # Sorting the rnodes in place (as routing plugins do) is OK
+        b.rnodes.sort(key=lambda rnode: rnode.addr, reverse=True)
+        b.remove(tc.NODES[1])
+        self.assertEqual(b.get_rnode(tc.NODES[1]), None)
+        self.assertEqual(len(b), NODES_PER_BUCKET - 1)
+        assert rnodes[1] not in b.rnodes
+        for rnode in rnodes[:1] + rnodes[2:]:
+            assert b.get_rnode(rnode) is rnode
+
         
 
 class TestRoutingTable(unittest.TestCase):
@@ -173,7 +197,7 @@ class TestRoutingTable(unittest.TestCase):
         self.assertEqual(self.rt.get_main_rnodes(), [])
 
         # Add server_node to main bucket
-        m_bucket.add(tc.SERVER_NODE)
+        m_bucket.add(tc.SERVER_NODE.get_rnode(1))
         self.rt.num_rnodes += 1
         self.assertTrue(m_bucket.there_is_room())
         self.assertTrue(not m_bucket.there_is_room(MAX_RNODES))
@@ -190,7 +214,7 @@ class TestRoutingTable(unittest.TestCase):
         # Let's add a node to the same bucket
         new_node = node.Node(tc.SERVER_NODE.addr,
                              tc.SERVER_NODE.id.generate_close_id(1))
-        m_bucket.add(new_node)
+        m_bucket.add(new_node.get_rnode(1))
         self.rt.num_rnodes += 1
         # full bucket
         self.assertTrue(not m_bucket.there_is_room())
@@ -315,6 +339,113 @@ class TestRoutingTable(unittest.TestCase):
         # complete coverage
         self.rt.print_stats()
 
+    def test_get_xor_closest_rnodes(self):
+        import random
+        import identifier
+        # Many nodes in the buckets close to my node (and a few far away)
+        rnodes = []
+        for i in xrange(200):
+            log_distance = random.choice(range(150, 160) + [3, 40, 90])
+            node_ = node.Node(
+                ('1.%d.%d.1' % divmod(i, 256), 1000 + i),
+                self.my_node.id.generate_close_id(log_distance))
+            sbucket = self.rt.get_sbucket(log_distance)
+            if sbucket.main.there_is_room() and \
+                    node_.id not in [r.id for r in rnodes]:
+                # Unique ids: no ties in distances
+                rnode = node_.get_rnode(log_distance)
+                sbucket.main.add(rnode)
+                rnodes.append(rnode)
+        targets = [identifier.RandomId() for _ in xrange(50)]
+        targets += [self.my_node.id,
+                    self.my_node.id.generate_close_id(0),
+                    rnodes[0].id]
+        for target in targets:
+            log_distance = target.log_distance(self.my_node.id)
+            for exclude_myself in (True, False):
+                candidates = list(rnodes)
+                if not exclude_myself:
+                    candidates.append(self.my_node)
+                for max_rnodes in (1, 8, 500):
+                    expected = sorted(
+                        candidates,
+                        key=lambda n: n.id.distance(target))[:max_rnodes]
+                    self.assertEqual(
+                        self.rt.get_closest_rnodes(log_distance, max_rnodes,
+                                                   exclude_myself, target),
+                        expected)
+
+    def _fill_table(self, rt):
+        rnodes = []
+        for i in xrange(20):
+            log_distance = 150 + i % 10
+            node_ = node.Node(('1.2.3.%d' % i, 1000 + i),
+                              rt.my_node.id.generate_close_id(log_distance))
+            sbucket = rt.get_sbucket(log_distance)
+            rnode = node_.get_rnode(log_distance)
+            rnode.rtt = .25
+            rnode.num_responses = i
+            if i < 10:
+                sbucket.main.add(rnode)
+                rt.num_rnodes += 1
+            else:
+                sbucket.replacement.add(rnode)
+            rnodes.append(rnode)
+        return rnodes
+
+    def test_snapshot(self):
+        rnodes = self._fill_table(self.rt)
+        snapshot = self.rt.get_snapshot()
+
+        rt2 = RoutingTable(self.my_node, [MAX_RNODES] * 160)
+        self.assertEqual(rt2.load_snapshot(snapshot), 10)
+        self.assertEqual(rt2.num_rnodes, 10)
+        self.assertEqual(rt2.get_main_rnodes(), self.rt.get_main_rnodes())
+        for rnode in rnodes:
+            sbucket = rt2.get_sbucket(rnode.log_distance_to_me)
+            if rnode in self.rt.get_main_rnodes():
+                rnode2 = sbucket.main.get_rnode(rnode)
+            else:
+                rnode2 = sbucket.replacement.get_rnode(rnode)
+            self.assertEqual(rnode2.rtt, rnode.rtt)
+            self.assertEqual(rnode2.creation_ts, rnode.creation_ts)
+            self.assertEqual(rnode2.last_seen, rnode.last_seen)
+            self.assertEqual(rnode2.num_responses, rnode.num_responses)
+            assert rnode2.in_quarantine
+        # Loading the snapshot again does not add duplicates
+        self.assertEqual(rt2.load_snapshot(snapshot), 0)
+        header_size = routing_table._SNAPSHOT_HEADER.size
+        self.assertEqual(rt2.get_snapshot()[header_size:],
+                         snapshot[header_size:])
+
+    def test_snapshot_different_id(self):
+        self._fill_table(self.rt)
+        my_node = node.Node(tc.CLIENT_ADDR, tc.SERVER_ID)
+        rt2 = RoutingTable(my_node, [MAX_RNODES] * 160)
+        num_rnodes = rt2.load_snapshot(self.rt.get_snapshot())
+        self.assertEqual(rt2.num_rnodes, num_rnodes)
+        self.assertEqual(len(rt2.get_main_rnodes()), num_rnodes)
+        for i, sbucket in enumerate(rt2.sbuckets):
+            for rnode in (sbucket and
+                          sbucket.main.rnodes + sbucket.replacement.rnodes
+                          or []):
+                self.assertEqual(rnode.log_distance_to_me, i)
+                self.assertEqual(my_node.log_distance(rnode), i)
+
+    def test_snapshot_errors(self):
+        self._fill_table(self.rt)
+        snapshot = self.rt.get_snapshot()
+        for data in ('', 'garbage' * 10, 'X' + snapshot[1:],
+                     snapshot[:-1], snapshot + 'X'):
+            self.assertRaises(SnapshotError, self.rt.load_snapshot, data)
+        time.mock_mode()
+        try:
+            snapshot = self.rt.get_snapshot()
+            time.sleep(SNAPSHOT_MAX_AGE + 1)
+            self.assertRaises(SnapshotError, self.rt.load_snapshot, snapshot)
+        finally:
+            time.normal_mode()
+
     def test_get_sbucket_error(self):
         self.assertRaises(IndexError, self.rt.get_sbucket, -2)
         self.assertRaises(IndexError, self.rt.get_sbucket, -1)
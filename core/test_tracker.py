@@ -5,6 +5,7 @@
 import unittest
 
 import ptime as time
+import message_tools as mt
 import tracker
 
 import logging, logging_conf
@@ -14,7 +15,7 @@ logger = logging.getLogger('dht')
 
 
 VALIDITY_PERIOD = 30
-CLEANUP_COUNTER = 5
+EXPIRE_PER_PUT = 2
 KEYS = ('0','1','2')
 PEERS = [('1.2.3.4', i) for i in range(0, 10)]
 
@@ -23,7 +24,7 @@ class TestTracker(unittest.TestCase):
 
     def setUp(self):
         time.mock_mode()
-        self.t = tracker.Tracker(VALIDITY_PERIOD, CLEANUP_COUNTER)
+        self.t = tracker.Tracker(VALIDITY_PERIOD, EXPIRE_PER_PUT)
 
     def test_put(self):
         self.assertEqual(self.t.num_keys, 0)
@@ -43,20 +44,24 @@ class TestTracker(unittest.TestCase):
         self.assertEqual(self.t.get(KEYS[0]), PEERS[0:2])
 
     def test_does_not_leak_memory(self):
-        for i in range(CLEANUP_COUNTER - 1):
+        for i in range(4):
             self.t.put(KEYS[0], PEERS[i])
         self.assertEqual(self.t.num_keys, 1)
-        self.assertEqual(self.t.num_peers, CLEANUP_COUNTER - 1)
+        self.assertEqual(self.t.num_peers, 4)
         # This sleep makes all entries expired
         time.sleep(30)
         # But does not trigger any cleaning up
         self.assertEqual(self.t.num_keys, 1)
-        self.assertEqual(self.t.num_peers, CLEANUP_COUNTER - 1)
-        # This put triggers a clean up
+        self.assertEqual(self.t.num_peers, 4)
+        # Each put removes a few expired entries
         self.t.put(KEYS[1], PEERS[0])
-        # The expired entries are no more
+        self.assertEqual(self.t.num_keys, 2)
+        self.assertEqual(self.t.num_peers, 4 - EXPIRE_PER_PUT + 1)
+        # expire removes the rest of the expired entries
+        self.assertEqual(self.t.expire(), 4 - EXPIRE_PER_PUT)
         self.assertEqual(self.t.num_keys, 1)
         self.assertEqual(self.t.num_peers, 1)
+        self.assertEqual(self.t.expire(), 0)
         
     def test_get_nonempty_key(self):
         self.t.put(KEYS[0], PEERS[0])
@@ -69,7 +74,7 @@ class TestTracker(unittest.TestCase):
         self.assertEqual(self.t.num_peers, 1)
         time.sleep(30)
         self.assertEqual(self.t.get(KEYS[0]), [])
-        #self.assertEqual(self.t.num_keys, 0)
+        self.assertEqual(self.t.num_keys, 0)
         self.assertEqual(self.t.num_peers, 0)
 
     def test_many_puts_and_gets(self):
@@ -93,73 +98,140 @@ class TestTracker(unittest.TestCase):
         # 80
         self.assertEqual(self.t.get(KEYS[0]), [])
 
-    def test_hundred_puts(self):
-        # test > 5 puts
+    def test_expire_announced_again(self):
+        self.t.put(KEYS[0], PEERS[0])
+        time.sleep(20)
+        # The peer announces again: valid for 30 more seconds
+        self.t.put(KEYS[0], PEERS[0])
+        time.sleep(20)
+        self.assertEqual(self.t.expire(), 0)
+        self.assertEqual(self.t.get(KEYS[0]), [PEERS[0]])
+        time.sleep(20)
+        self.assertEqual(self.t.expire(), 1)
+        self.assertEqual(self.t.num_keys, 0)
         self.assertEqual(self.t.num_peers, 0)
 
-        time.sleep(0)
+    def test_expire_after_get(self):
+        self.t.put(KEYS[0], PEERS[0])
+        self.t.put(KEYS[0], PEERS[1])
+        time.sleep(30)
+        # get removes the key's expired peers
+        self.assertEqual(self.t.get(KEYS[0]), [])
         self.assertEqual(self.t.num_peers, 0)
+        # Their queued announcements are skipped
+        self.assertEqual(self.t.expire(), 0)
+        self.t.put(KEYS[0], PEERS[2])
+        self.assertEqual(self.t.get(KEYS[0]), [PEERS[2]])
+
+    def test_max_peers(self):
+        peers = [('1.2.3.4', i) for i in range(tracker.MAX_PEERS + 10)]
+        for peer in peers:
+            self.t.put(KEYS[0], peer)
+        # The most recent announcements
+        self.assertEqual(self.t.get(KEYS[0]), peers[-tracker.MAX_PEERS:])
 
-        self.t.put(1,1)
-        self.assertEqual(self.t.num_peers, 1)
+    def tearDown(self):
+        time.normal_mode()
 
-        time.sleep(25)
-        self.assertEqual(self.t.num_peers, 1)
 
-        self.t.put(2,2)
-        self.assertEqual(self.t.num_peers, 2)
+class TestCompactTracker(unittest.TestCase):
 
-        time.sleep(1)
-        self.assertEqual(self.t.num_peers, 2)
+    def setUp(self):
+        time.mock_mode()
+        self.t = tracker.CompactTracker(VALIDITY_PERIOD, EXPIRE_PER_PUT)
 
-        self.t.put(3,3)
-        self.assertEqual(self.t.num_peers, 3)
+    def test_put_get(self):
+        self.assertEqual(self.t.get(KEYS[0]), [])
+        self.t.put(KEYS[0], PEERS[0])
+        self.t.put(KEYS[0], PEERS[1])
+        # Announced again: it goes to the end
+        self.t.put(KEYS[0], PEERS[0])
+        self.assertEqual(self.t.num_keys, 1)
+        self.assertEqual(self.t.num_peers, 2)
+        self.assertEqual(self.t.get(KEYS[0]), [PEERS[1], PEERS[0]])
+        self.assertEqual(self.t.get_compact(KEYS[0]),
+                         mt.compact_peers([PEERS[1], PEERS[0]]))
+        self.assertEqual(self.t.get_stats()['num_bytes'],
+                         tracker.KEY_SIZE + 2 * tracker.PEER_SIZE)
+        # Invalid peers are ignored
+        self.t.put(KEYS[0], ('1.2.3.4', 2**16))
+        self.t.put(KEYS[0], ('1.2.3.4.5', 1))
+        self.assertEqual(self.t.num_peers, 2)
 
-        time.sleep(1)
+    def test_max_peers(self):
+        peers = [('1.2.3.4', i) for i in range(tracker.MAX_PEERS + 10)]
+        for peer in peers:
+            self.t.put(KEYS[0], peer)
+        # The most recent announcements
+        self.assertEqual(self.t.get(KEYS[0]), peers[-tracker.MAX_PEERS:])
+
+    def test_max_peers_per_key(self):
+        peers = [('1.2.3.4', i) for i in range(tracker.MAX_PEERS_PER_KEY + 10)]
+        for peer in peers:
+            self.t.put(KEYS[0], peer)
+        # The oldest announcements are dropped
+        self.assertEqual(self.t.num_peers, tracker.MAX_PEERS_PER_KEY)
+        self.assertEqual(self.t.get_stats()['num_bytes'],
+                         tracker.KEY_SIZE +
+                         tracker.MAX_PEERS_PER_KEY * tracker.PEER_SIZE)
+        packed_peers = self.t._tracker_dict[KEYS[0]]
+        self.assertEqual(len(packed_peers.c_peers),
+                         tracker.MAX_PEERS_PER_KEY * mt.ADDR4_SIZE)
+        self.assertEqual(packed_peers.get_compact(1),
+                         mt.compact_peers(peers[-1:]))
+        # A dropped peer announcing again is added (at the end)
+        self.t.put(KEYS[0], peers[0])
+        self.assertEqual(self.t.num_peers, tracker.MAX_PEERS_PER_KEY)
+        self.assertEqual(self.t.get(KEYS[0]),
+                         peers[-tracker.MAX_PEERS + 1:] + peers[:1])
+
+    def test_expiration(self):
+        self.t.put(KEYS[0], PEERS[0])
+        self.t.put(KEYS[1], PEERS[0])
+        time.sleep(20)
+        self.t.put(KEYS[1], PEERS[1])
+        time.sleep(12)
+        # KEYS[1]'s expired peers are removed when it is used
         self.assertEqual(self.t.num_peers, 3)
-
-        self.t.put(4,4)
-        self.assertEqual(self.t.num_peers, 4)
-
-        time.sleep(3)
-        self.assertEqual(self.t.num_peers, 4)
-
-        self.t.put(5,5)
-        # cleaning... 1 out
-        self.assertEqual(self.t.num_peers, 4)
-
-        time.sleep(.0)
-        self.assertEqual(self.t.num_peers, 4)
-
-        self.t.put(6,6)
-        self.assertEqual(self.t.num_peers, 5)
-
-        time.sleep(.00)
-        self.assertEqual(self.t.num_peers, 5)
-
-        self.t.put(7,7)
-        self.assertEqual(self.t.num_peers, 6)
-
+        self.assertEqual(self.t.get(KEYS[1]), [PEERS[1]])
+        self.assertEqual(self.t.num_peers, 2)
+        # KEYS[0]'s last announcement expired: the key is removed
+        self.assertEqual(self.t.expire(), 1)
+        self.assertEqual(self.t.num_keys, 1)
+        self.assertEqual(self.t.get(KEYS[0]), [])
         time.sleep(20)
-        self.assertEqual(self.t.num_peers, 6)
-
-        self.t.put(8,8)
-        self.assertEqual(self.t.num_peers, 7)
-
-        time.sleep(.00)
-        self.assertEqual(self.t.num_peers, 7)
+        self.assertEqual(self.t.get(KEYS[1]), [])
+        self.assertEqual(self.t.get_stats()['num_bytes'], 0)
 
-        self.t.put(9,9)
-        self.assertEqual(self.t.num_peers, 8)
-
-        time.sleep(10)
-        self.assertEqual(self.t.num_peers, 8)
-
-        self.t.put(0,0)
-        # cleaning ... 2,3,4,5,6,7 out
-        self.assertEqual(self.t.num_peers, 3)
+    def test_memory_budget(self):
+        self.t = tracker.CompactTracker(
+            VALIDITY_PERIOD, EXPIRE_PER_PUT,
+            2 * tracker.KEY_SIZE + 3 * tracker.PEER_SIZE)
+        self.t.put(KEYS[0], PEERS[0])
+        self.t.put(KEYS[1], PEERS[0])
+        self.t.put(KEYS[1], PEERS[1])
+        self.assertEqual(self.t.num_keys, 2)
+        # Over budget: the least recently announced key is evicted
+        self.t.put(KEYS[2], PEERS[0])
+        self.assertEqual(self.t.get(KEYS[0]), [])
+        self.t.put(KEYS[1], PEERS[2])
+        self.assertEqual(self.t.get(KEYS[2]), [])
+        self.assertEqual(self.t.get(KEYS[1]), PEERS[0:3])
+        stats = self.t.get_stats()
+        self.assertEqual(stats['num_evicted_keys'], 2)
+        self.assertEqual(stats['num_bytes'],
+                         tracker.KEY_SIZE + 3 * tracker.PEER_SIZE)
+
+    def test_remove_aligned(self):
+        packed_peers = tracker._PackedPeers()
+        packed_peers.append('abcdef', 1)
+        packed_peers.append('ghijkl', 2)
+        # Matches across two peers do not count
+        self.assertFalse(packed_peers.remove('efghij'))
+        self.assertTrue(packed_peers.remove('ghijkl'))
+        self.assertEqual(packed_peers.get_compact(10), ['abcdef'])
+        self.assertEqual(list(packed_peers.tss), [1])
 
-            
     def tearDown(self):
         time.normal_mode()
 
@@ -2,62 +2,305 @@
 # Released under GNU LGPL 2.1
 # See LICENSE.txt for more information
 
+"""
+Peers announced to this node, per key (info_hash).
+
+Each key has an ordered dictionary {peer: ts} (oldest announcement first,
+a peer announcing again goes to the end). All the announcements are also
+queued in announcement order. Since they are all valid for the same
+period, the head of the queue is always the next one to expire. Expired
+announcements are removed from the head a few at a time (on each put and
+each expire call), so that there are no long clean-up sweeps.
+
+CompactTracker offers the same interface with much less memory per peer.
+Each key's peers are packed (6-byte compact addresses and integer
+timestamps in two buffers) and the total size is bounded: when it goes
+over max_bytes, the least recently announced keys are evicted. Each key
+keeps up to MAX_PEERS_PER_KEY peers (the most recent). Responder
+gets the peers in compact form (get_compact), ready to be sent.
+
+"""
+
+import socket
+from socket import inet_ntoa
+from array import array
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from itertools import islice
+import logging
+
 import ptime as time
+import message_tools as mt
+
+logger = logging.getLogger('dht')
 
 VALIDITY_PERIOD = 30 * 60 #30 minutes
-CLEANUP_COUNTER = 100
+# Expired announcements removed on each put (more than 1 so that the
+# expiration queue does not grow beyond one validity period)
+EXPIRE_PER_PUT = 4
+# Expired announcements removed on each expire call (by default)
+MAX_EXPIRE_PER_CALL = 10000
 
 MAX_PEERS = 50 # Avoids way too long get_peers respoonses (longer than UDP
+# CompactTracker's peers per key (the oldest announcement is dropped). It
+# bounds the cost of finding an announcing peer in its key's buffer.
+MAX_PEERS_PER_KEY = 4 * MAX_PEERS
+
+# CompactTracker's memory budget. Each peer takes PEER_SIZE bytes
+# (compact address plus timestamp) and each key about KEY_SIZE bytes
+# (key, buffers, dictionary entries).
+MAX_BYTES = 64 * 2**20 # 64 MB
+PEER_SIZE = mt.ADDR4_SIZE + 4
+KEY_SIZE = 500
 
 #TODO: avoid tracking several ports from the same IP address!
 
 class Tracker(object):
 
     def __init__(self, validity_period=VALIDITY_PERIOD,
-                 cleanup_counter=CLEANUP_COUNTER):
-        self._tracker_dict = {}
+                 expire_per_put=EXPIRE_PER_PUT):
+        self._tracker_dict = {} # {k: OrderedDict({peer: ts})}
+        self._expiration_queue = deque() # (ts, k, peer)
         self.validity_period = validity_period
-        self.cleanup_counter = cleanup_counter
-        self._put_counter = 0
+        self.expire_per_put = expire_per_put
         self.num_keys = 0
         self.num_peers = 0
-        
+
     def put(self, k, peer):
-        #Clean up every n puts
-        self._put_counter += 1
-        if self._put_counter == self.cleanup_counter:
-            self._put_counter = 0
-            for k_ in self._tracker_dict.keys():
-                ts_peers = self._tracker_dict[k_]
-                self._cleanup_key(k_)
-                if not ts_peers: #empty list. Delete key
-                    del self._tracker_dict[k_]
-                    self.num_keys -= 1
-        
-        ts_peers = self._tracker_dict.setdefault(k,[])
-        if not ts_peers:
+        ts_peers = self._tracker_dict.get(k)
+        if ts_peers is None:
+            ts_peers = self._tracker_dict[k] = OrderedDict()
             self.num_keys += 1
-        else:
-            # let's see whether the peer is already there
-            for i in range(len(ts_peers)):
-                if ts_peers[i][1] == peer:
-                    self.num_peers -= 1
-                    del ts_peers[i]
-                    break
-        ts_peers.append((time.time(), peer))
+        elif ts_peers.pop(peer, None) is not None:
+            # The peer was already there: it goes to the end
+            self.num_peers -= 1
+        ts = time.time()
+        ts_peers[peer] = ts
         self.num_peers += 1
+        self._expiration_queue.append((ts, k, peer))
+        self.expire(self.expire_per_put)
 
     def get(self, k):
-        ts_peers = self._tracker_dict.get(k, [])
-        self._cleanup_key(k)
-        return [ts_peer[1] for ts_peer in ts_peers[-MAX_PEERS:]]
+        ts_peers = self._tracker_dict.get(k)
+        if not ts_peers:
+            return []
+        self._cleanup_key(k, ts_peers)
+        # The last MAX_PEERS peers (oldest first)
+        peers = list(islice(reversed(ts_peers), MAX_PEERS))
+        peers.reverse()
+        return peers
+
+    def get_compact(self, k):
+        """Same as get but peers are in compact form."""
+        return mt.compact_peers(self.get(k))
 
-    def _cleanup_key(self, k):
+    def get_stats(self):
+        return {'num_keys': self.num_keys,
+                'num_peers': self.num_peers,
+                }
+
+    def expire(self, max_entries=MAX_EXPIRE_PER_CALL):
+        """
+        Remove up to 'max_entries' expired announcements. Return how many
+        announcements were removed.
+
+        """
+        oldest_valid_ts = time.time() - self.validity_period
+        queue = self._expiration_queue
+        num_expired = 0
+        while (queue and queue[0][0] < oldest_valid_ts and
+               num_expired < max_entries):
+            ts, k, peer = queue.popleft()
+            ts_peers = self._tracker_dict.get(k)
+            if ts_peers is None or ts_peers.get(peer) != ts:
+                # Already removed or announced again
+                continue
+            del ts_peers[peer]
+            self.num_peers -= 1
+            num_expired += 1
+            if not ts_peers:
+                del self._tracker_dict[k]
+                self.num_keys -= 1
+        return num_expired
+
+    def _cleanup_key(self, k, ts_peers):
         '''
-        Clean up the list as side effect.
+        Remove the expired peers (the oldest ones) from k's dictionary
+        (their queued announcements are skipped when they reach the head).
         '''
-        ts_peers = self._tracker_dict.get(k, None)
         oldest_valid_ts = time.time() - self.validity_period
-        while ts_peers and  ts_peers[0][0] < oldest_valid_ts:
-            del ts_peers[0]
+        while ts_peers:
+            peer = next(iter(ts_peers))
+            if ts_peers[peer] >= oldest_valid_ts:
+                break
+            del ts_peers[peer]
             self.num_peers -= 1
+        if not ts_peers:
+            del self._tracker_dict[k]
+            self.num_keys -= 1
+
+
+class CompactTracker(object):
+
+    def __init__(self, validity_period=VALIDITY_PERIOD,
+                 expire_per_put=EXPIRE_PER_PUT, max_bytes=MAX_BYTES):
+        # {k: _PackedPeers} least recently announced first
+        self._tracker_dict = OrderedDict()
+        self.validity_period = validity_period
+        self.expire_per_put = expire_per_put
+        self.max_bytes = max_bytes
+        self.num_keys = 0
+        self.num_peers = 0
+        self.num_bytes = 0
+        self.num_evicted_keys = 0
+
+    def put(self, k, peer):
+        try:
+            c_peer = mt.compact_addr(peer)
+        except (socket.error, ValueError):
+            logger.debug('Invalid peer: %r', peer)
+            return
+        packed_peers = self._tracker_dict.pop(k, None)
+        if packed_peers is None:
+            packed_peers = _PackedPeers()
+            self.num_keys += 1
+            self.num_bytes += KEY_SIZE
+        else:
+            self._remove_peers(packed_peers.remove_expired(
+                    self._get_oldest_valid_ts()))
+            if packed_peers.remove(c_peer):
+                # The peer was already there: it goes to the end
+                self._remove_peers(1)
+        packed_peers.append(c_peer, int(time.time()))
+        self.num_peers += 1
+        self.num_bytes += PEER_SIZE
+        if len(packed_peers) > MAX_PEERS_PER_KEY:
+            self._remove_peers(packed_peers.remove_oldest(
+                    len(packed_peers) - MAX_PEERS_PER_KEY))
+        # Most recently announced
+        self._tracker_dict[k] = packed_peers
+        self.expire(self.expire_per_put)
+        while (self.num_bytes > self.max_bytes and
+               len(self._tracker_dict) > 1):
+            _, evicted = self._tracker_dict.popitem(last=False)
+            self._remove_key(evicted)
+            self.num_evicted_keys += 1
+
+    def get(self, k):
+        return [(inet_ntoa(c_peer[:mt.IP4_SIZE]),
+                 mt.bin_to_int(c_peer[mt.IP4_SIZE:]))
+                for c_peer in self.get_compact(k)]
+
+    def get_compact(self, k):
+        """Same as get but peers are in compact form."""
+        packed_peers = self._tracker_dict.get(k)
+        if packed_peers is None:
+            return []
+        self._remove_peers(packed_peers.remove_expired(
+                self._get_oldest_valid_ts()))
+        if not packed_peers:
+            del self._tracker_dict[k]
+            self._remove_key(packed_peers)
+            return []
+        return packed_peers.get_compact(MAX_PEERS)
+
+    def expire(self, max_entries=MAX_EXPIRE_PER_CALL):
+        """
+        Remove the keys whose last announcement expired (up to about
+        'max_entries' peers). Return how many peers were removed.
+
+        """
+        oldest_valid_ts = self._get_oldest_valid_ts()
+        tracker_dict = self._tracker_dict
+        num_expired = 0
+        while tracker_dict and num_expired < max_entries:
+            k = next(iter(tracker_dict))
+            packed_peers = tracker_dict[k]
+            if packed_peers.last_ts() >= oldest_valid_ts:
+                break
+            del tracker_dict[k]
+            num_expired += len(packed_peers)
+            self._remove_key(packed_peers)
+        return num_expired
+
+    def get_stats(self):
+        """
+        Return a dictionary with:
+        - num_keys/num_peers: keys and peers being tracked
+        - num_bytes: estimated memory used (see PEER_SIZE and KEY_SIZE)
+        - max_bytes: memory budget
+        - num_evicted_keys: keys evicted to stay within the budget
+        """
+        return {'num_keys': self.num_keys,
+                'num_peers': self.num_peers,
+                'num_bytes': self.num_bytes,
+                'max_bytes': self.max_bytes,
+                'num_evicted_keys': self.num_evicted_keys,
+                }
+
+    def _get_oldest_valid_ts(self):
+        # Timestamps are integers (1 second resolution)
+        return int(time.time()) - self.validity_period
+
+    def _remove_peers(self, num_peers):
+        self.num_peers -= num_peers
+        self.num_bytes -= num_peers * PEER_SIZE
+
+    def _remove_key(self, packed_peers):
+        self._remove_peers(len(packed_peers))
+        self.num_keys -= 1
+        self.num_bytes -= KEY_SIZE
+
+
+class _PackedPeers(object):
+    """
+    A key's peers (compact addresses) and their announcement timestamps,
+    oldest first.
+
+    """
+    __slots__ = ('c_peers', 'tss')
+
+    def __init__(self):
+        self.c_peers = bytearray()
+        self.tss = array('I')
+
+    def __len__(self):
+        return len(self.tss)
+
+    def append(self, c_peer, ts):
+        self.c_peers.extend(c_peer)
+        self.tss.append(ts)
+
+    def remove(self, c_peer):
+        """Remove c_peer (if there). Return whether it was there."""
+        pos = self.c_peers.find(c_peer)
+        while pos != -1 and pos % mt.ADDR4_SIZE:
+            # Not aligned: it is the end of a peer and the start of another
+            pos = self.c_peers.find(c_peer, pos + 1)
+        if pos == -1:
+            return False
+        del self.c_peers[pos:pos + mt.ADDR4_SIZE]
+        del self.tss[pos / mt.ADDR4_SIZE]
+        return True
+
+    def remove_expired(self, oldest_valid_ts):
+        """Remove the peers announced before oldest_valid_ts. Return how
+        many."""
+        return self.remove_oldest(bisect_left(self.tss, oldest_valid_ts))
+
+    def remove_oldest(self, num_peers):
+        """Remove the 'num_peers' oldest peers. Return how many."""
+        if num_peers:
+            del self.c_peers[:num_peers * mt.ADDR4_SIZE]
+            del self.tss[:num_peers]
+        return num_peers
+
+    def last_ts(self):
+        return self.tss[-1]
+
+    def get_compact(self, max_peers):
+        """The last (most recent) 'max_peers' peers in compact form."""
+        start = max(0, len(self.tss) - max_peers) * mt.ADDR4_SIZE
+        data = str(self.c_peers[start:])
+        return [data[i:i + mt.ADDR4_SIZE]
+                for i in xrange(0, len(data), mt.ADDR4_SIZE)]
@@ -27,12 +27,20 @@ MARK_INDEX = 2
 
 ANNOUNCE_REDUNDANCY = 3
 
+# Nodes kept when the lookup finds no peers (see get_closest_responded_nodes)
+NUM_CLOSEST_NODES = 8
+
 class _QueuedNode(object):
 
     def __init__(self, node_, distance, token):
         self.node = node_
         self.distance = distance
         self.token = token
+        # Sorting on longs is much faster than calling __cmp__
+        if distance is None:
+            self.sort_key = -1
+        else:
+            self.sort_key = distance.long
 
     def __cmp__(self, other):
         # nodes without log_distance (bootstrap) go first
@@ -48,7 +56,6 @@ class _LookupQueue(object):
     def __init__(self, info_hash, queue_size):
         self.info_hash = info_hash
         self.queue_size = queue_size
-        self.queue = [_QueuedNode(None, identifier.ID_SIZE_BITS+1, None)]
         # *_ips is used to prevent that many Ids are
         # claimed from a single IP address.
         self.queued_ips = set()
@@ -110,7 +117,7 @@ class _LookupQueue(object):
         
     def _add_responded_qnode(self, qnode):
         self.responded_qnodes.append(qnode)
-        self.responded_qnodes.sort(key=attrgetter('distance'))
+        self.responded_qnodes.sort(key=attrgetter('sort_key'))
         del self.responded_qnodes[self.max_responded_qnodes:]
 
     def _add_queued_qnodes(self, qnodes, do_sort=True):
@@ -123,7 +130,7 @@ class _LookupQueue(object):
             # We do not want to sort nodes coming from bootstrapper.
             # Bootstrapper relies on nodes being contacted in the same order as
             # the given list. See bootstrapper.report_unreachable.
-            self.queued_qnodes.sort()
+            self.queued_qnodes.sort(key=attrgetter('sort_key'))
 
     def _pop_nodes_to_query(self, max_nodes):
         if len(self.responded_qnodes) > MARK_INDEX:
@@ -164,7 +171,7 @@ class GetPeersLookup(object):
         self.slowdown_m = 1
         
         self.start_ts = time.time()
-        logger.debug('New lookup (info_hash: %r) %d' % (info_hash, bt_port))
+        logger.debug('New lookup (info_hash: %r) %d', info_hash, bt_port)
         self._my_id = my_id
         self.lookup_id = lookup_id
         self.callback_f = callback_f
@@ -216,8 +223,8 @@ class GetPeersLookup(object):
         return queries_to_send
         
     def on_response_received(self, response_msg, node_):
-        logger.debug('response from %r\n%r' % (node_,
-                                                response_msg))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('response from %r\n%r', node_, response_msg)
         if self.bootstrapper:
             self.bootstrapper.report_reachable(node_.addr, 0)
         self._num_parallel_queries -= 1
@@ -237,7 +244,8 @@ class GetPeersLookup(object):
                 lookup_done)
 
     def on_timeout(self, node_):
-        logger.debug('TIMEOUT node: %r' % node_)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('TIMEOUT node: %r', node_)
         if self.bootstrapper:
             self.bootstrapper.report_unreachable(node_.addr)
         self._num_parallel_queries -= 1
@@ -252,7 +260,7 @@ class GetPeersLookup(object):
                 lookup_done)
     
     def on_error_received(self, error_msg, node_addr):
-        logger.debug('Got error from node addr: %r' % node_addr)
+        logger.debug('Got error from node addr: %r', node_addr)
         self._num_parallel_queries -= 1
         self.num_errors += 1
 
@@ -293,7 +301,7 @@ class GetPeersLookup(object):
         '''
         queries_to_send = []
         for qnode in nodes_to_announce:
-            logger.debug('announcing to %r' % qnode.node)
+            logger.debug('announcing to %r', qnode.node)
             query = self.msg_f.outgoing_announce_peer_query(
                 qnode.node, self.info_hash, self._bt_port, qnode.token)
             queries_to_send.append(query)
@@ -302,6 +310,11 @@ class GetPeersLookup(object):
     def get_closest_responded_hexids(self):
         return ['%r' % qnode.node.id for
                 qnode in self._lookup_queue.get_closest_responded_qnodes()]
+
+    def get_closest_responded_nodes(self, num_nodes=NUM_CLOSEST_NODES):
+        """Closest nodes which responded (with or without token)."""
+        return [qnode.node for qnode in
+                self._lookup_queue.responded_qnodes[:num_nodes]]
     
             
 class MaintenanceLookup(GetPeersLookup):
@@ -296,11 +296,12 @@ class RoutingManager(object):
                 self.table.num_rnodes += 0
         return []
         
-    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself):
+    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself,
+                           target=None):
         if not num_nodes:
             num_nodes = NODES_PER_BUCKET[log_distance]
         return self.table.get_closest_rnodes(log_distance, num_nodes,
-                                             exclude_myself)
+                                             exclude_myself, target)
 
     def get_main_rnodes(self):
         return self.table.get_main_rnodes()
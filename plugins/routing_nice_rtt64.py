@@ -219,7 +219,8 @@ class RoutingManager(object):
             logger.debug('nodes found: %r', nodes)
         self._found_nodes_queue.add(nodes)
 
-        logger.debug('on response received %f', rtt)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('on response received %f', rtt)
         log_distance = self.my_node.log_distance(node_)
         try:
             sbucket = self.table.get_sbucket(log_distance)
@@ -330,11 +331,12 @@ class RoutingManager(object):
             self._update_rnode_on_timeout(rnode)
         return []
             
-    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself):
+    def get_closest_rnodes(self, log_distance, num_nodes, exclude_myself,
+                           target=None):
         if not num_nodes:
             num_nodes = NODES_PER_BUCKET[log_distance]
         return self.table.get_closest_rnodes(log_distance, num_nodes,
-                                             exclude_myself)
+                                             exclude_myself, target)
 
     def get_main_rnodes(self):
         return self.table.get_main_rnodes()
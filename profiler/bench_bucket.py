@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: Bucket.get_rnode and Bucket.add/remove (dict index) vs a linear
+scan of the bucket's rnodes (what Bucket did before the index).
+
+Usage:
+  python bench_bucket.py
+
+Each message received from a node in the routing table triggers a
+get_rnode on its bucket. Buckets are small (8 rnodes) in the standard
+table, but routing plugins can use much larger buckets (e.g.,
+routing_nice_rtt's first buckets).
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.identifier as identifier
+from core.node import Node
+from core.routing_table import Bucket
+
+BUCKET_SIZES = (8, 64, 128, 512)
+NUM_OPS = 100000
+
+
+def _linear_find(bucket, node_):
+    for rnode in bucket.rnodes:
+        if rnode == node_:
+            return rnode
+
+def bench(max_rnodes):
+    bucket = Bucket(max_rnodes, set())
+    nodes = [Node(('1.2.%d.%d' % divmod(i, 256), 1024 + i),
+                  identifier.RandomId()) for i in xrange(max_rnodes)]
+    for node_ in nodes:
+        bucket.add(node_.get_rnode(1))
+    # Equal nodes, but not the same objects (as when a message is received)
+    queries = [Node(n.addr, n.id) for n in
+               [random.choice(nodes) for _ in xrange(NUM_OPS)]]
+
+    start_ts = time.time()
+    for node_ in queries:
+        _linear_find(bucket, node_)
+    linear_time = time.time() - start_ts
+
+    start_ts = time.time()
+    for node_ in queries:
+        bucket.get_rnode(node_)
+    index_time = time.time() - start_ts
+
+    # Replace a node (remove + add) as the routing manager does
+    start_ts = time.time()
+    for node_ in queries[:NUM_OPS / 10]:
+        rnode = bucket.get_rnode(node_)
+        bucket.remove(node_)
+        bucket.add(rnode)
+    replace_time = time.time() - start_ts
+
+    print '%4d rnodes: get_rnode %6.3f us (linear scan %6.3f us),' \
+        ' remove+add %6.3f us' % (
+        max_rnodes, index_time / NUM_OPS * 1e6, linear_time / NUM_OPS * 1e6,
+        replace_time / (NUM_OPS / 10) * 1e6)
+
+def main():
+    random.seed(0)
+    for max_rnodes in BUCKET_SIZES:
+        bench(max_rnodes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: cached peer lookups in a list of (ts, info_hash, peers) tuples
+(linear scan) vs cache.Cache (dict indexed, LRU).
+
+Usage:
+  python bench_cache.py
+
+The cache is filled with NUM_INFO_HASHES lookups, then GET_CALLS random
+info_hashes (half of them cached) are looked up.
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.identifier as identifier
+import core.cache as cache
+
+NUM_INFO_HASHES = 30000
+GET_CALLS = 2000
+PEERS_PER_LOOKUP = 20
+VALIDITY_TIME = 5 * 60
+
+
+def _peers(i):
+    return [('1.%d.%d.1' % divmod(i % 65536, 256), 1024 + j)
+            for j in xrange(PEERS_PER_LOOKUP)]
+
+def bench_list(info_hashes, targets):
+    cached_lookups = []
+    for i, info_hash in enumerate(info_hashes):
+        cached_lookups.append((time.time(), info_hash, _peers(i)))
+    start_ts = time.time()
+    num_hits = 0
+    for target in targets:
+        oldest_valid_ts = time.time() - VALIDITY_TIME
+        for ts, info_hash, peers in cached_lookups:
+            if ts > oldest_valid_ts and info_hash == target:
+                num_hits += 1
+                break
+    return time.time() - start_ts, num_hits
+
+def bench_cache(info_hashes, targets):
+    c = cache.Cache(VALIDITY_TIME)
+    for i, info_hash in enumerate(info_hashes):
+        c.put(info_hash, _peers(i))
+    start_ts = time.time()
+    for target in targets:
+        c.get(target)
+    return time.time() - start_ts, c.get_stats()['hits']
+
+def main():
+    random.seed(0)
+    info_hashes = [identifier.RandomId() for _ in xrange(NUM_INFO_HASHES)]
+    targets = random.sample(info_hashes, GET_CALLS / 2)
+    targets += [identifier.RandomId() for _ in xrange(GET_CALLS / 2)]
+    random.shuffle(targets)
+    print '%d cached lookups, %d get calls' % (NUM_INFO_HASHES, GET_CALLS)
+    for label, bench in (('list scan', bench_list),
+                         ('Cache', bench_cache)):
+        elapsed, num_hits = bench(info_hashes, targets)
+        print '%-10s %10.2f us/get %5d hits' % (
+            label, elapsed / GET_CALLS * 1e6, num_hits)
+
+
+if __name__ == '__main__':
+    main()
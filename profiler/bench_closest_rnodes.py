@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: RoutingTable.get_closest_rnodes picking nodes bucket by bucket
+(no target) vs picking the nodes closest to the target by XOR distance.
+
+Usage:
+  python bench_closest_rnodes.py
+
+The routing table is filled as in a node which has been running for a while
+(routing_nice_rtt's bucket sizes): the buckets far from my node are full,
+the ones closer to my node are partially filled. For each selection, the
+report shows the time per call and the quality of the answer: how many of
+the nodes returned are among the NUM_NODES closest nodes in the table, and
+the average log distance between the target and the closest node returned.
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.identifier as identifier
+from core.node import Node
+from core.routing_table import RoutingTable
+import plugins.routing_nice_rtt as routing_nice_rtt
+
+NUM_NODES = 8 # as in responder
+NUM_TARGETS = 5000
+FULL_BUCKETS = range(150, 160)
+PARTIAL_BUCKETS = range(135, 150)
+
+
+def _fill_table(rt):
+    my_id = rt.my_node.id
+    i = 0
+    for log_distance in FULL_BUCKETS + PARTIAL_BUCKETS:
+        sbucket = rt.get_sbucket(log_distance)
+        if log_distance in FULL_BUCKETS:
+            num_rnodes = sbucket.main.max_rnodes
+        else:
+            num_rnodes = random.randint(0, sbucket.main.max_rnodes)
+        for _ in xrange(num_rnodes):
+            node_ = Node(('1.%d.%d.1' % divmod(i, 256), 1024 + i),
+                         my_id.generate_close_id(log_distance))
+            sbucket.main.add(node_.get_rnode(log_distance))
+            i += 1
+    return rt.get_main_rnodes()
+
+def bench(label, rt, targets, use_target, all_rnodes):
+    my_id = rt.my_node.id
+    log_distances = [target.log_distance(my_id) for target in targets]
+    start_ts = time.time()
+    results = []
+    for target, log_distance in zip(targets, log_distances):
+        if use_target:
+            results.append(rt.get_closest_rnodes(log_distance, NUM_NODES,
+                                                 False, target))
+        else:
+            results.append(rt.get_closest_rnodes(log_distance, NUM_NODES,
+                                                 False))
+    elapsed = time.time() - start_ts
+    num_in_closest = 0
+    sum_log_distance = 0
+    candidates = all_rnodes + [rt.my_node]
+    for target, result in zip(targets, results):
+        closest = sorted(candidates,
+                         key=lambda n: n.id.distance(target))[:NUM_NODES]
+        num_in_closest += len([n for n in result if n in closest])
+        sum_log_distance += min([n.id.log_distance(target)
+                                 for n in result])
+    print '%-22s %7.2f us/call %5.2f/%d in closest, closest ld %6.2f' % (
+        label, elapsed / len(targets) * 1e6,
+        float(num_in_closest) / len(targets), NUM_NODES,
+        float(sum_log_distance) / len(targets))
+
+def main():
+    random.seed(0)
+    my_node = Node(('127.0.0.1', 7000), identifier.RandomId())
+    rt = RoutingTable(my_node, routing_nice_rtt.NODES_PER_BUCKET)
+    all_rnodes = _fill_table(rt)
+    print '%d rnodes in the table' % len(all_rnodes)
+    # Lookup targets are random. Some targets are close to my node (e.g.,
+    # nodes doing lookups on my neighborhood)
+    targets = [identifier.RandomId() for _ in xrange(NUM_TARGETS / 2)]
+    targets += [my_node.id.generate_close_id(
+            random.choice(FULL_BUCKETS + PARTIAL_BUCKETS))
+                for _ in xrange(NUM_TARGETS / 2)]
+    bench('bucket order', rt, targets, False, all_rnodes)
+    bench('XOR closest', rt, targets, True, all_rnodes)
+
+
+if __name__ == '__main__':
+    main()
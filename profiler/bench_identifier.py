@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Microbenchmark: identifier.Id in the hot paths (uncompacting nodes from
+responses, XOR/log distances, sorting lookup queues).
+
+'uncompact_nodes (popular)' uses responses drawn from a small population
+of nodes, where a few nodes show up in many responses (as popular nodes do
+in the DHT).
+
+Usage:
+  python bench_identifier.py
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+from logging import CRITICAL
+import core.logging_conf as lc
+lc.setup('.', CRITICAL)
+
+import core.identifier as identifier
+import core.message_tools as mt
+from core.node import Node
+import plugins.lookup_a4 as lookup_a4
+
+NUM_RESPONSES = 2000
+NODES_PER_RESPONSE = 8
+RESPONSES_PER_LOOKUP = 20
+NUM_POPULAR_NODES = 3000
+NUM_ROUNDS = 5
+
+
+def _random_node():
+    addr = ('%d.%d.%d.%d' % tuple([random.randint(1, 223)
+                                   for _ in xrange(4)]),
+            random.randint(1024, 65535))
+    return Node(addr, identifier.RandomId())
+
+def _c_nodes_list():
+    return [mt.compact_nodes([_random_node()
+                              for _ in xrange(NODES_PER_RESPONSE)])
+            for _ in xrange(NUM_RESPONSES)]
+
+def _popular_c_nodes_list():
+    population = [_random_node() for _ in xrange(NUM_POPULAR_NODES)]
+    c_nodes_list = []
+    for _ in xrange(NUM_RESPONSES):
+        # Skewed popularity: low indexes are picked much more often
+        nodes = [population[int(random.paretovariate(1)) %
+                            NUM_POPULAR_NODES]
+                 for _ in xrange(NODES_PER_RESPONSE)]
+        c_nodes_list.append(mt.compact_nodes(nodes))
+    return c_nodes_list
+
+def bench(label, f, num_ops):
+    start_ts = time.time()
+    for _ in xrange(NUM_ROUNDS):
+        f()
+    elapsed = (time.time() - start_ts) / NUM_ROUNDS
+    print '%-30s %8.2f us/op' % (label, elapsed / num_ops * 1e6)
+
+def main():
+    random.seed(0)
+    c_nodes_list = _c_nodes_list()
+    nodes_list = [mt.uncompact_nodes(c_nodes) for c_nodes in c_nodes_list]
+    all_nodes = [n for nodes in nodes_list for n in nodes]
+    num_nodes = len(all_nodes)
+    popular_c_nodes_list = _popular_c_nodes_list()
+    target = identifier.RandomId()
+
+    def uncompact():
+        for c_nodes in c_nodes_list:
+            mt.uncompact_nodes(c_nodes)
+
+    def uncompact_popular():
+        for c_nodes in popular_c_nodes_list:
+            mt.uncompact_nodes(c_nodes)
+
+    def distance():
+        for n in all_nodes:
+            n.id.distance(target)
+
+    def log_distance():
+        for n in all_nodes:
+            n.id.log_distance(target)
+
+    def distance_log():
+        # The idiom used by routing and responder
+        for n in all_nodes:
+            n.id.distance(target).log
+
+    def lookup_queue():
+        for i in xrange(NUM_RESPONSES):
+            if i % RESPONSES_PER_LOOKUP == 0:
+                queue = lookup_a4._LookupQueue(target, 8)
+                queue.bootstrap(nodes_list[i], 4, False)
+            queue.on_response(all_nodes[i], nodes_list[i], 'TOKEN', 4)
+
+    bench('uncompact_nodes (per node)', uncompact, num_nodes)
+    bench('uncompact_nodes (popular)', uncompact_popular, num_nodes)
+    bench('Id.distance', distance, num_nodes)
+    bench('Id.log_distance', log_distance, num_nodes)
+    bench('Id.distance().log', distance_log, num_nodes)
+    bench('lookup queue (per response)', lookup_queue, NUM_RESPONSES)
+    node_pool = getattr(mt, 'node_pool', None)
+    if node_pool:
+        print 'node pool: %(hit_rate).2f hit rate, %(size)d nodes' % (
+            node_pool.get_stats())
+
+
+if __name__ == '__main__':
+    main()
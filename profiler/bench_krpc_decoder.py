@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Microbenchmark: KRPC parser (message.decode_krpc) vs generic decoder
+(bencode.decode plus IncomingMsg's sanitize functions).
+
+Usage:
+  python bench_krpc_decoder.py [capture.pcap]
+
+Without a capture file, a synthetic mix of queries and responses (similar
+to what a node gets) is used. Reading pcap files requires dpkt.
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+from logging import CRITICAL
+import core.logging_conf as lc
+lc.setup('.', CRITICAL)
+
+import core.bencode as bencode
+import core.message as message
+import core.identifier as identifier
+from core.node import Node
+
+NUM_ROUNDS = 20
+SRC_ADDR = ('1.2.3.4', 1234)
+
+
+class GenericIncomingMsg(message.IncomingMsg):
+    # Always take the generic path
+    def _sanitize_krpc(self):
+        raise message.ShapeError
+
+
+def _random_node():
+    addr = ('%d.%d.%d.%d' % tuple([random.randint(1, 223)
+                                   for _ in xrange(4)]),
+            random.randint(1024, 65535))
+    return Node(addr, identifier.RandomId())
+
+def get_synthetic_traffic(num_datagrams=1000):
+    msg_f = message.MsgFactory('NS\0\1', identifier.RandomId())
+    dst_node = _random_node()
+    msgs = []
+    for _ in xrange(num_datagrams):
+        tid = chr(random.randint(0, 255)) * 2
+        nodes = [_random_node() for _ in xrange(8)]
+        r = random.random()
+        if r < .35:
+            msg = msg_f.outgoing_get_peers_response(
+                dst_node, 'TOKEN', nodes)
+        elif r < .45:
+            msg = msg_f.outgoing_get_peers_response(
+                dst_node, 'TOKEN', peers=[n.addr for n in nodes])
+        elif r < .60:
+            msg = msg_f.outgoing_find_node_response(dst_node, nodes)
+        elif r < .70:
+            msg = msg_f.outgoing_ping_response(dst_node)
+        elif r < .80:
+            msg = msg_f.outgoing_ping_query(dst_node)
+        elif r < .88:
+            msg = msg_f.outgoing_find_node_query(dst_node,
+                                                 identifier.RandomId())
+        elif r < .96:
+            msg = msg_f.outgoing_get_peers_query(dst_node,
+                                                 identifier.RandomId())
+        else:
+            msg = msg_f.outgoing_announce_peer_query(
+                dst_node, identifier.RandomId(), 6881, 'TOKEN')
+        msgs.append(msg.stamp(tid))
+    return msgs
+
+def get_captured_traffic(filename):
+    import dpkt
+    msgs = []
+    for ts, frame in dpkt.pcap.Reader(open(filename, 'rb')):
+        ip_packet = dpkt.ethernet.Ethernet(frame).data
+        if isinstance(ip_packet, dpkt.ip.IP) and ip_packet.p == 17:
+            msgs.append(ip_packet.data.data)
+    return msgs
+
+def bench(label, f, bencoded_msgs):
+    start_ts = time.time()
+    for _ in xrange(NUM_ROUNDS):
+        for bencoded in bencoded_msgs:
+            try:
+                f(bencoded)
+            except (bencode.DecodeError, message.MsgError,
+                    message.ShapeError):
+                pass
+    elapsed = time.time() - start_ts
+    num_msgs = NUM_ROUNDS * len(bencoded_msgs)
+    print '%-30s %8.2f us/msg %10d msg/s' % (label,
+                                           elapsed / num_msgs * 1e6,
+                                           num_msgs / elapsed)
+    return elapsed
+
+def main():
+    if len(sys.argv) > 1:
+        bencoded_msgs = get_captured_traffic(sys.argv[1])
+    else:
+        bencoded_msgs = get_synthetic_traffic()
+    num_krpc = 0
+    for bencoded in bencoded_msgs:
+        try:
+            message.decode_krpc(bencoded)
+        except (message.ShapeError):
+            pass
+        else:
+            num_krpc += 1
+    print '%d datagrams (%d handled by the KRPC parser)' % (
+        len(bencoded_msgs), num_krpc)
+
+    bench('bencode.decode', bencode.decode, bencoded_msgs)
+    bench('message.decode_krpc', message.decode_krpc, bencoded_msgs)
+    generic = bench(
+        'IncomingMsg (generic)',
+        lambda b: GenericIncomingMsg(None, message.Datagram(b, SRC_ADDR)),
+        bencoded_msgs)
+    krpc = bench(
+        'IncomingMsg (KRPC parser)',
+        lambda b: message.IncomingMsg(None, message.Datagram(b, SRC_ADDR)),
+        bencoded_msgs)
+    print 'Speed-up: %.2fx' % (generic / krpc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: per-packet time spent by the controller (decoding, routing,
+lookups, responder, querier) when logging at WARNING and at DEBUG level
+(with logs written by the caller and by a background thread).
+
+Usage:
+  python bench_logging.py [num_packets]
+
+Lookups are started on a controller and every query it sends gets a
+response with 8 random nodes. Incoming queries (ping, find_node,
+get_peers) are mixed in. Logs are written to a temporary directory.
+
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import time
+import logging
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.logging_conf as logging_conf
+import core.message as message
+import core.identifier as identifier
+import core.controller as controller
+from core.node import Node
+
+import plugins.routing_nice_rtt as routing_m_mod
+import plugins.lookup_a4 as lookup_m_mod
+import core.exp_plugin_template as exp_m_mod
+
+VERSION_LABEL = 'NS\0\1'
+NUM_PACKETS = 10000
+QUERY_RATIO = .3 # incoming queries / packets
+
+
+def _random_node():
+    first_octet = random.choice([i for i in xrange(1, 224) if i != 127])
+    addr = ('%d.%d.%d.%d' % (first_octet, random.randint(0, 255),
+                             random.randint(0, 255), random.randint(1, 254)),
+            random.randint(1024, 65535))
+    return Node(addr, identifier.RandomId())
+
+
+class Network(object):
+
+    """Fake remote nodes: they answer every query the controller sends."""
+
+    def __init__(self):
+        self.msg_f = message.MsgFactory(VERSION_LABEL,
+                                        identifier.RandomId())
+        self.pending = []
+
+    def add_datagrams(self, datagrams):
+        self.pending.extend(datagrams)
+
+    def next_datagram(self, my_node):
+        if self.pending and random.random() > QUERY_RATIO:
+            return self._response(self.pending.pop(0))
+        return self._query(my_node)
+
+    def _response(self, query_datagram):
+        query = self.msg_f.incoming_msg(query_datagram)
+        src_node = Node(query_datagram.addr, identifier.RandomId())
+        nodes = [_random_node() for _ in xrange(8)]
+        if query.query == message.GET_PEERS:
+            response = self.msg_f.outgoing_get_peers_response(
+                src_node, 'TOKEN', nodes)
+        elif query.query == message.FIND_NODE:
+            response = self.msg_f.outgoing_find_node_response(src_node,
+                                                              nodes)
+        else:
+            response = self.msg_f.outgoing_ping_response(src_node)
+        return message.Datagram(response.stamp(query.tid),
+                                query_datagram.addr)
+
+    def _query(self, my_node):
+        src_node = _random_node()
+        r = random.random()
+        if r < .4:
+            query = self.msg_f.outgoing_ping_query(my_node)
+        elif r < .7:
+            query = self.msg_f.outgoing_find_node_query(
+                my_node, identifier.RandomId())
+        else:
+            query = self.msg_f.outgoing_get_peers_query(
+                my_node, identifier.RandomId())
+        return message.Datagram(query.stamp('qq'), src_node.addr)
+
+
+def run(logs_level, async_queue_size, num_packets):
+    random.seed(0)
+    logs_path = tempfile.mkdtemp()
+    logging_conf.setup(logs_path, logs_level, async_queue_size)
+    logging.getLogger('dht').propagate = False # only to the file
+    my_node = _random_node()
+    ctrl = controller.Controller(VERSION_LABEL, my_node, logs_path,
+                                 routing_m_mod, lookup_m_mod, exp_m_mod,
+                                 None, False)
+    network = Network()
+    elapsed = 0.
+    for i in xrange(num_packets):
+        if i % 500 == 0:
+            # Keep a few lookups running
+            start_ts = time.time()
+            ctrl.get_peers(None, identifier.RandomId(), None, 0, False)
+            _, datagrams = ctrl.main_loop()
+            elapsed += time.time() - start_ts
+            network.add_datagrams(datagrams)
+        datagram = network.next_datagram(my_node)
+        start_ts = time.time()
+        _, datagrams = ctrl.on_datagram_received(datagram)
+        elapsed += time.time() - start_ts
+        network.add_datagrams(datagrams)
+        # Do not let the queue grow forever
+        del network.pending[:-500]
+    log_stats = logging_conf.get_stats()
+    logging_conf.close()
+    log_size = os.path.getsize(os.path.join(logs_path, 'pymdht.log'))
+    shutil.rmtree(logs_path)
+    return elapsed, log_size, log_stats
+
+
+def main():
+    if len(sys.argv) > 1:
+        num_packets = int(sys.argv[1])
+    else:
+        num_packets = NUM_PACKETS
+    print '%d packets per run' % num_packets
+    for level, async_queue_size in ((logging.WARNING, 0),
+                                    (logging.DEBUG, 0),
+                                    (logging.DEBUG,
+                                     logging_conf.ASYNC_QUEUE_SIZE)):
+        elapsed, log_size, log_stats = run(level, async_queue_size,
+                                           num_packets)
+        if log_stats:
+            label = logging.getLevelName(level) + ' (async)'
+            extra = ', %d records dropped' % log_stats['dropped']
+        else:
+            label = logging.getLevelName(level)
+            extra = ''
+        print '%-16s %8.2f us/packet (log: %d KB%s)' % (
+            label, elapsed / num_packets * 1e6, log_size / 1024, extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: querier.Querier with many queries in flight (register, match
+responses, expire timeouts).
+
+Usage:
+  python bench_querier.py
+
+For each number of queries in flight, NUM_IN_FLIGHT queries (to different
+nodes) are registered in one go, half of them get a response and then all
+of them expire at once (a burst of timeouts as in batch lookups). The
+report shows the time per query in each phase.
+
+Then, the RTO estimator gets RTT samples from a synthetic population of
+nodes (log-normal RTTs, median RTT_MEDIAN) and the report shows the
+timeouts it would set for known and unknown nodes (vs TIMEOUT_DELAY).
+
+Finally, QUERY_RATE queries per second are sent to a small set of
+NUM_POPULAR_ADDRS addresses for TRAFFIC_PERIOD seconds (mock time) and
+the report shows, for each tid size, the number of tid collisions (tids
+skipped because they were pending) and the number of pending queries a
+response would have matched if only the first tid byte was compared (as
+before full tids were used).
+
+"""
+
+import os
+import sys
+import logging
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.ptime as ptime
+import core.identifier as identifier
+import core.message as message
+import core.querier as querier
+from core.node import Node
+
+logging.getLogger('dht').setLevel(logging.CRITICAL)
+
+NUM_IN_FLIGHT = (500, 2000, 8000)
+NUM_NODES = 2000
+SAMPLES_PER_NODE = 3
+RTT_MEDIAN = .15
+RTT_SIGMA = .8
+QUERY_RATE = 5000
+TRAFFIC_PERIOD = 10
+NUM_POPULAR_ADDRS = 20
+
+
+def bench(num_queries, my_node, clients_msg_f, servers_msg_f):
+    nodes = [Node(('2.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255), 7000),
+                  identifier.RandomId()) for i in xrange(num_queries)]
+    queries = [clients_msg_f.outgoing_ping_query(n) for n in nodes]
+    q = querier.Querier()
+
+    start_ts = time.time()
+    q.register_queries(queries)
+    register_time = time.time() - start_ts
+
+    responses = []
+    for query in queries[::2]:
+        data = servers_msg_f.outgoing_ping_response(my_node).stamp(query.tid)
+        responses.append(clients_msg_f.incoming_msg(
+                message.Datagram(data, query.dst_node.addr)))
+    start_ts = time.time()
+    for response in responses:
+        q.get_related_query(response)
+    response_time = time.time() - start_ts
+
+    ptime.sleep(querier.TIMEOUT_DELAY)
+    start_ts = time.time()
+    _, timeout_queries = q.get_timeout_queries()
+    timeout_time = time.time() - start_ts
+    assert len(timeout_queries) == num_queries - len(responses)
+
+    print '%5d in flight: register %6.2f us, response %6.2f us,' \
+        ' timeout %8.2f us (per query)' % (
+        num_queries, register_time / num_queries * 1e6,
+        response_time / len(responses) * 1e6,
+        timeout_time / num_queries * 1e6)
+
+def rto_report():
+    random.seed(0)
+    estimator = querier.RTOEstimator()
+    addrs = [('3.%d.%d.1' % divmod(i, 256), 7000) for i in xrange(NUM_NODES)]
+    rtts = [RTT_MEDIAN * random.lognormvariate(0, RTT_SIGMA)
+            for _ in addrs]
+    for _ in xrange(SAMPLES_PER_NODE):
+        for addr, rtt in zip(addrs, rtts):
+            estimator.on_response(
+                addr, rtt * random.lognormvariate(0, RTT_SIGMA / 4))
+    known = sorted([estimator.get_rto(addr) for addr in addrs])
+    unknown = estimator.get_rto(('4.4.4.4', 7000))
+    print 'RTO: known nodes median %.2f s (p90 %.2f s), unknown %.2f s' \
+        ' (fixed timeout: %.2f s)' % (
+        known[len(known) / 2], known[len(known) * 9 / 10], unknown,
+        querier.TIMEOUT_DELAY)
+
+def tid_report(my_node, clients_msg_f):
+    random.seed(0)
+    nodes = [Node(('5.5.5.%d' % i, 7000), identifier.RandomId())
+             for i in xrange(1, NUM_POPULAR_ADDRS + 1)]
+    queries_per_step = QUERY_RATE / 10
+    for tid_size in range(querier.MIN_TID_SIZE, querier.MAX_TID_SIZE + 1):
+        q = querier.Querier(tid_size)
+        num_first_byte_matches = 0
+        num_responses = 0
+        for _ in xrange(TRAFFIC_PERIOD * 10):
+            queries = [clients_msg_f.outgoing_ping_query(
+                    random.choice(nodes)) for _ in xrange(queries_per_step)]
+            q.register_queries(queries)
+            # Responses to a few of them. How many pending queries to the
+            # same address share the first tid byte?
+            pending = {}
+            for addr, tid in q._pending:
+                key = (addr, tid[0])
+                pending[key] = pending.get(key, 0) + 1
+            for query in queries[::50]:
+                num_first_byte_matches += pending[(query.dst_node.addr,
+                                                   query.tid[0])]
+                num_responses += 1
+            ptime.sleep(.1)
+            q.get_timeout_queries()
+        print '%d-byte tids: %d collisions, %.2f first-byte matches' \
+            ' per response' % (tid_size, q.get_stats()['num_tid_collisions'],
+                               float(num_first_byte_matches) / num_responses)
+
+def main():
+    ptime.mock_mode()
+    my_node = Node(('1.1.1.1', 7000), identifier.RandomId())
+    clients_msg_f = message.MsgFactory('NS\0\0', my_node.id)
+    servers_msg_f = message.MsgFactory('NS\0\0', identifier.RandomId())
+    for num_queries in NUM_IN_FLIGHT:
+        bench(num_queries, my_node, clients_msg_f, servers_msg_f)
+    rto_report()
+    tid_report(my_node, clients_msg_f)
+
+
+if __name__ == '__main__':
+    main()
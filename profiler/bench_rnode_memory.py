@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Memory report: memory used by routing nodes (node.RoutingNode), including
+their event history.
+
+Usage:
+  python bench_rnode_memory.py [num_rnodes]
+
+Nodes are created first; then the routing nodes are created and each one
+gets EVENTS_PER_RNODE events (queries, responses, timeouts). The report
+shows the increase in the process' resident memory (Linux only) and the
+size of the objects as reported by sys.getsizeof.
+
+"""
+
+import os
+import sys
+import gc
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.identifier as identifier
+import core.node as node
+from core.node import Node, RoutingNode
+
+NUM_RNODES = 10000
+EVENTS_PER_RNODE = 20
+EVENTS = (node.QUERY, node.RESPONSE, node.RESPONSE, node.TIMEOUT)
+
+
+def _rss():
+    """Return the resident memory in bytes (None if not available)."""
+    try:
+        statm = open('/proc/self/statm').read().split()
+    except IOError:
+        return None
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def _sizeof(rnode):
+    """Size of rnode and the objects it owns (not the shared ones)."""
+    size = sys.getsizeof(rnode)
+    if hasattr(rnode, '__dict__'):
+        size += sys.getsizeof(rnode.__dict__)
+        attrs = rnode.__dict__.values()
+    else:
+        attrs = [getattr(rnode, name, None)
+                 for cls in type(rnode).__mro__
+                 for name in getattr(cls, '__slots__', ())]
+    shared = (rnode.id, rnode.addr, rnode.compact_addr, rnode.version)
+    for attr in attrs:
+        if attr is None or any(attr is s for s in shared) or \
+                isinstance(attr, (bool, str)):
+            continue
+        size += sys.getsizeof(attr)
+        if isinstance(attr, list):
+            for item in attr:
+                if isinstance(item, tuple):
+                    size += sys.getsizeof(item) + sys.getsizeof(item[0])
+    return size
+
+def main():
+    if len(sys.argv) > 1:
+        num_rnodes = int(sys.argv[1])
+    else:
+        num_rnodes = NUM_RNODES
+    random.seed(0)
+    nodes = [Node(('%d.%d.%d.%d' % tuple([random.randint(1, 223)
+                                          for _ in xrange(4)]),
+                   random.randint(1024, 65535)),
+                  identifier.RandomId())
+             for _ in xrange(num_rnodes)]
+    gc.collect()
+    rss_before = _rss()
+    rnodes = []
+    for n in nodes:
+        rnode = RoutingNode(n, 1)
+        for _ in xrange(EVENTS_PER_RNODE):
+            rnode.add_event(time.time(), random.choice(EVENTS))
+        rnodes.append(rnode)
+    gc.collect()
+    rss_after = _rss()
+    scale = 10000. / num_rnodes
+    print '%d rnodes, %d events each' % (num_rnodes, EVENTS_PER_RNODE)
+    if rss_before is not None:
+        print 'RSS increase:  %8.2f MB per 10k rnodes' % (
+            (rss_after - rss_before) * scale / 2 ** 20)
+    print 'sys.getsizeof: %8.2f MB per 10k rnodes (%d bytes per rnode)' % (
+        sum([_sizeof(r) for r in rnodes]) * scale / 2 ** 20,
+        _sizeof(rnodes[0]))
+
+
+if __name__ == '__main__':
+    main()
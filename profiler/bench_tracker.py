@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Benchmark: tracker.Tracker and tracker.CompactTracker holding NUM_PEERS
+announcements (NUM_KEYS info_hashes) vs the previous implementation (lists
+of (ts, peer) per key, full clean-up sweep every CLEANUP_COUNTER puts).
+
+Usage:
+  python bench_tracker.py
+
+The report shows the memory used (RSS growth, Linux only), the time per
+put (mean and worst: sweeps stall the reactor), the time per get (the
+responder's get_compact when available) and the time to expire all the
+announcements in main_loop-sized steps (expire calls).
+
+The hot key case announces HOT_KEY_PEERS different peers (and then
+re-announces some of them) to a single info_hash.
+
+"""
+
+import os
+import sys
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(this_dir)
+sys.path.append(root_dir)
+
+import core.ptime as ptime
+import core.tracker as tracker
+
+NUM_KEYS = 100000
+NUM_PEERS = 1000000
+PUT_CALLS = 2000
+GET_CALLS = 10000
+CLEANUP_COUNTER = 100
+HOT_KEY_PEERS = 100000
+
+
+class _ListTracker(object):
+    """The previous implementation (put and get)."""
+
+    def __init__(self, validity_period=tracker.VALIDITY_PERIOD,
+                 cleanup_counter=CLEANUP_COUNTER):
+        self._tracker_dict = {}
+        self.validity_period = validity_period
+        self.cleanup_counter = cleanup_counter
+        self._put_counter = 0
+
+    def put(self, k, peer):
+        self._put_counter += 1
+        if self._put_counter == self.cleanup_counter:
+            self._put_counter = 0
+            for k_ in self._tracker_dict.keys():
+                ts_peers = self._tracker_dict[k_]
+                self._cleanup_key(k_)
+                if not ts_peers:
+                    del self._tracker_dict[k_]
+        ts_peers = self._tracker_dict.setdefault(k, [])
+        for i in range(len(ts_peers)):
+            if ts_peers[i][1] == peer:
+                del ts_peers[i]
+                break
+        ts_peers.append((ptime.time(), peer))
+
+    def get(self, k):
+        ts_peers = self._tracker_dict.get(k, [])
+        self._cleanup_key(k)
+        return [ts_peer[1] for ts_peer in ts_peers[-tracker.MAX_PEERS:]]
+
+    def _cleanup_key(self, k):
+        ts_peers = self._tracker_dict.get(k, None)
+        oldest_valid_ts = ptime.time() - self.validity_period
+        while ts_peers and ts_peers[0][0] < oldest_valid_ts:
+            del ts_peers[0]
+
+
+def _peer(i):
+    return ('%d.%d.%d.1' % (1 + i / 65536, i / 256 % 256, i % 256),
+            1024 + i % 50000)
+
+def _rss_mb():
+    try:
+        num_pages = int(open('/proc/self/statm').read().split()[1])
+    except IOError:
+        return 0
+    return num_pages * os.sysconf('SC_PAGE_SIZE') / 2.**20
+
+def bench_puts(label, t, keys):
+    elapsed = []
+    for i in xrange(PUT_CALLS):
+        k = random.choice(keys)
+        peer = _peer(NUM_PEERS + i)
+        start_ts = time.time()
+        t.put(k, peer)
+        elapsed.append(time.time() - start_ts)
+    get = getattr(t, 'get_compact', t.get)
+    start_ts = time.time()
+    for k in random.sample(keys, GET_CALLS):
+        get(k)
+    get_elapsed = time.time() - start_ts
+    print '%-12s put %7.2f us (worst %9.2f us), get %6.2f us' % (
+        label, sum(elapsed) / PUT_CALLS * 1e6, max(elapsed) * 1e6,
+        get_elapsed / GET_CALLS * 1e6)
+
+def bench_expire(label, t):
+    ptime.sleep(tracker.VALIDITY_PERIOD + 1)
+    num_calls = 0
+    worst = 0
+    start_ts = time.time()
+    while t.num_peers:
+        call_ts = time.time()
+        t.expire()
+        worst = max(worst, time.time() - call_ts)
+        num_calls += 1
+    print '%-12s expire all: %.2f s, %d calls (worst %.2f ms)' % (
+        label, time.time() - start_ts, num_calls, worst * 1e3)
+
+def bench_hot_key(label, t):
+    k = os.urandom(20)
+    elapsed = []
+    for i in xrange(HOT_KEY_PEERS):
+        start_ts = time.time()
+        t.put(k, _peer(i))
+        elapsed.append(time.time() - start_ts)
+    for i in xrange(PUT_CALLS):
+        peer = _peer(random.randrange(HOT_KEY_PEERS))
+        start_ts = time.time()
+        t.put(k, peer)
+        elapsed.append(time.time() - start_ts)
+    print '%-12s hot key put %7.2f us (worst %9.2f us), %d peers kept' % (
+        label, sum(elapsed) / len(elapsed) * 1e6, max(elapsed) * 1e6,
+        t.num_peers)
+
+def fill(t, keys):
+    start_ts = time.time()
+    for i in xrange(NUM_PEERS):
+        t.put(keys[i % NUM_KEYS], _peer(i))
+    return time.time() - start_ts
+
+def main():
+    random.seed(0)
+    ptime.mock_mode()
+    keys = [os.urandom(20) for _ in xrange(NUM_KEYS)]
+    print '%d peers, %d keys' % (NUM_PEERS, NUM_KEYS)
+
+    # The smallest first (freed memory is not returned to the system)
+    for label, tracker_class in (('Compact', tracker.CompactTracker),
+                                 ('Tracker', tracker.Tracker)):
+        rss_mb = _rss_mb()
+        t = tracker_class()
+        elapsed = fill(t, keys)
+        print '%-12s fill %.2f us/put, RSS +%d MB' % (
+            label, elapsed / NUM_PEERS * 1e6, _rss_mb() - rss_mb)
+        bench_puts(label, t, keys)
+        bench_expire(label, t)
+        del t
+        bench_hot_key(label, tracker_class())
+
+    list_t = _ListTracker(cleanup_counter=NUM_PEERS + 1)
+    fill(list_t, keys)
+    list_t.cleanup_counter = CLEANUP_COUNTER
+    list_t._put_counter = 0
+    bench_puts('list sweep', list_t, keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+
+# Copyright (C) 2012 Raul Jimenez
+# Released under GNU LGPL 2.1
+# See LICENSE.txt for more information
+
+"""
+Run several Pymdht nodes (one per process). See core/pymdht_farm.py.
+"""
+
+import core.ptime as time
+import sys, os
+from optparse import OptionParser
+
+import logging
+
+import core.identifier as identifier
+import core.pymdht_farm as pymdht_farm
+
+
+def _on_peers_found(lookup_id, peers, node_addr):
+    if peers is None:
+        print 'end of lookup', lookup_id
+    else:
+        print 'lookup %s: got %d peers from %r' % (lookup_id, len(peers),
+                                                     node_addr)
+
+def main2(options, args):
+    if not os.path.isdir(options.path):
+        if os.path.exists(options.path):
+            print >>sys.stderr, 'FATAL:', options.path, 'must be a directory'
+            return
+        print >>sys.stderr, options.path, 'does not exist. Creating directory...'
+        os.mkdir(options.path)
+
+    if options.debug:
+        logs_level = logging.DEBUG # This generates HUGE (and useful) logs
+    else:
+        logs_level = logging.WARNING # This generates warning and error logs
+
+    print 'Using the following plug-ins:'
+    print '*', options.routing_m_file
+    print '*', options.lookup_m_file
+    print '*', options.experimental_m_file
+    print 'Path:', options.path
+    print 'Private DHT name:', options.private_dht_name
+    print 'debug mode:', options.debug
+    print 'Workers: %d (ports %d-%d)' % (
+        options.num_workers, options.port,
+        options.port + options.num_workers - 1)
+    routing_m_name = '.'.join(os.path.split(options.routing_m_file))[:-3]
+    lookup_m_name = '.'.join(os.path.split(options.lookup_m_file))[:-3]
+    experimental_m_name = '.'.join(
+        os.path.split(options.experimental_m_file))[:-3]
+
+    farm = pymdht_farm.PymdhtFarm((options.ip, options.port), options.path,
+                                  routing_m_name,
+                                  lookup_m_name,
+                                  experimental_m_name,
+                                  options.private_dht_name,
+                                  logs_level,
+                                  options.num_workers)
+    for i, worker_id in enumerate(farm.worker_ids):
+        print 'worker %d: %r' % (i, worker_id)
+    stop_timestamp = None
+    if options.ttl:
+        stop_timestamp = time.time() + options.ttl
+    next_lookup_ts = time.time() + options.lookup_delay
+    num_lookups = 0
+    while stop_timestamp is None or time.time() < stop_timestamp:
+        time.sleep(1)
+        if options.lookup_delay and time.time() > next_lookup_ts:
+            next_lookup_ts = time.time() + options.lookup_delay
+            target = identifier.RandomId()
+            worker_index = farm.get_peers(num_lookups, target,
+                                          _on_peers_found)
+            print 'lookup %d %r (worker %d)' % (num_lookups, target,
+                                                 worker_index)
+            num_lookups += 1
+    farm.stop()
+
+def main():
+    default_path = os.path.join(os.path.expanduser('~'), '.pymdht_farm')
+    parser = OptionParser()
+    parser.add_option("-a", "--address", dest="ip",
+                      metavar='IP', default='127.0.0.1',
+                      help="IP address to be used")
+    parser.add_option("-p", "--port", dest="port",
+                      metavar='INT', default=17000,
+                      help="port used by the first worker (worker i uses\
+    port+i)")
+    parser.add_option("-n", "--num-workers", dest="num_workers",
+                      metavar='INT', default=2,
+                      help="number of workers (processes)")
+    parser.add_option("--path", dest="path",
+                      metavar='PATH', default=default_path,
+                      help="location of the workers' files (one directory\
+    per worker)")
+    parser.add_option("-r", "--routing-plug-in", dest="routing_m_file",
+                      metavar='FILE', default='plugins/routing_nice_rtt.py',
+                      help="file containing the routing_manager code")
+    parser.add_option("-l", "--lookup-plug-in", dest="lookup_m_file",
+                      metavar='FILE', default='plugins/lookup_a4.py',
+                      help="file containing the lookup_manager code")
+    parser.add_option("-e", "--experimental-plug-in",dest="experimental_m_file",
+                      metavar='FILE', default='core/exp_plugin_template.py',
+                      help="file containing ping-manager code")
+    parser.add_option("-d", "--private-dht", dest="private_dht_name",
+                      metavar='STRING', default=None,
+                      help="private DHT name")
+    parser.add_option("--debug",dest="debug",
+                      action='store_true', default=False,
+                      help="DEBUG mode")
+    parser.add_option("--ttl", dest="ttl",
+                      default=0,
+                      help="Run for the specified time (in seconds). Default\
+    0, means run forever")
+    parser.add_option("--lookup-delay",dest="lookup_delay",
+                      metavar='INT', default=0,
+                      help="Perform a lookup (random target) every x seconds")
+
+    (options, args) = parser.parse_args()
+
+    options.port = int(options.port)
+    options.num_workers = int(options.num_workers)
+    options.ttl = int(options.ttl)
+    options.lookup_delay = int(options.lookup_delay)
+    main2(options, args)
+
+if __name__ == '__main__':
+    main()
@@ -76,7 +76,8 @@ def main2(options, args):
                         logs_level,
                         auto_bootstrap=options.auto_bootstrap,
                         bootstrap_mode=options.bootstrap_mode,
-                        swift_port=options.swift_port)
+                        swift_port=options.swift_port,
+                        async_logging=options.async_logs)
     if options.lookup_delay:
         loop_forever = not options.num_lookups
         remaining_lookups = options.num_lookups
@@ -147,6 +148,10 @@ def main():
     parser.add_option("--debug",dest="debug",
                       action='store_true', default=False,
                       help="DEBUG mode")
+    parser.add_option("--async-logs",dest="async_logs",
+                      action='store_true', default=False,
+                      help="Write logs from a background thread (log records\
+    are dropped when the writer cannot keep up)")
     parser.add_option("--gui",dest="gui",
                       action='store_true', default=False,
                       help="Graphical user interface")
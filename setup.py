@@ -6,7 +6,7 @@ setup(
     author='Raul Jimenez and contributors',
     author_email='rauljc@gkth.se',
     packages=['pymdht', 'pymdht.core', 'pymdht.plugins', 'pymdht.ui'],
-    scripts=['run_pymdht_node.py'],
+    scripts=['run_pymdht_node.py', 'run_pymdht_farm.py'],
     url='http://pypi.python.org/pypi/Pymdht/',
     license='LICENSE.txt',
     description='A flexible implementation of the Mainline DHT protocol.',